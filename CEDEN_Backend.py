@@ -0,0 +1,240 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module is where the scripts get their database connections. CEDEN_DataRefresh.py, FHAB_BloomReport.py
+and WorkingScripts\\FHAB_update.py each called pyodbc.connect with the SQL Server driver on their own. A backend
+knows how to connect to one database:
+	SQLServerBackend   the DataMart or the FHAB database through pyodbc, tried again with a growing wait when the
+	                   server can't be reached
+	SQLiteBackend      a SQLite file with the same tables as the DataMart, ie. the synthetic DataMart of
+	                   WorkingScripts\\Synthetic_DataMart.py, to try the scripts and benchmark the parallel extraction
+	                   on a computer without SQL Server. It has the YEAR and RIGHT functions the shard keys use.
+	                   RIGHT is a reserved word in SQLite, so its cursors put it in quotes ("RIGHT"(SampleDate, 4))
+	                   before a query is run and the keys are written the SQL Server way everywhere.
+	A ConnectionPool keeps the connections of a backend so they are used again by the next table or job instead of
+logging in every time. It hands out at most size connections at once, checks a connection with "SELECT 1" before
+handing it out again and makes a new one when the check fails, so a connection that dropped while it waited in the
+pool is never used. Its connect method works with Reconnecting (CEDEN_Reader.py) like DataMart_connect, closing the
+connection gives it back to the pool.
+
+'''
+
+import re
+import time
+import sqlite3
+import threading
+
+# the driver used for SQL Server, see pyodbc.drivers() for the ones installed on your machine
+DRIVER = 'ODBC Driver 11 for SQL Server'
+# the functions of the SQL Server queries that are reserved words in SQLite, a call to them is put in quotes
+RESERVED = re.compile(r'\b(RIGHT)\s*\(', re.IGNORECASE)
+
+
+# SQLServerBackend connects to a SQL Server with pyodbc. trusted=True logs in with the windows account instead of
+# pwd. Connecting is tried tries times, the first wait is backoff seconds and every next one is twice as long.
+class SQLServerBackend:
+	def __init__(self, server, uid=None, pwd=None, trusted=False, driver=DRIVER, tries=5, backoff=30.):
+		self.server = server
+		self.uid = uid
+		self.pwd = pwd
+		self.trusted = trusted
+		self.driver = driver
+		self.tries = tries
+		self.backoff = backoff
+
+	# connect returns a new connection. It raises a ConnectionError when the server can't be reached after tries
+	# tries.
+	def connect(self):
+		# pyodbc is only needed for SQL Server, the SQLite backend works without it
+		import pyodbc
+		for attempt in range(self.tries):
+			try:
+				if self.trusted:
+					return pyodbc.connect(Driver=self.driver, Server=self.server, uid=self.uid, Trusted_Connection='Yes')
+				return pyodbc.connect(Driver=self.driver, Server=self.server, uid=self.uid, pwd=self.pwd)
+			except pyodbc.Error as error:
+				print("Couldn't connect to %s (%s). It is down or you might have a typo somewhere. Make sure you've got "
+				      "the right password and Server id. Check internet connection." % (self.server, error))
+				if attempt + 1 < self.tries:
+					pause = self.backoff * 2 ** attempt
+					print("\tTrying again in %d seconds" % pause)
+					time.sleep(pause)
+		raise ConnectionError("Couldn't connect to %s after %d tries" % (self.server, self.tries))
+
+
+# year is YEAR() of SQL Server for SQLite, the dates are text there
+def year(date):
+	if date is None:
+		return None
+	return int(str(date)[:4])
+
+
+def right(text, length):
+	if text is None:
+		return None
+	return str(text)[-length:] if length > 0 else ''
+
+
+# sqlite_sql returns a query of SQL Server that SQLite can run, ie. RIGHT(SampleDate, 4) -> "RIGHT"(SampleDate, 4)
+def sqlite_sql(sql):
+	return RESERVED.sub(lambda match: '"%s"(' % match.group(1).upper(), sql)
+
+
+# _SQLiteCursor is the cursor of a SQLiteBackend connection, it runs the queries through sqlite_sql
+class _SQLiteCursor(sqlite3.Cursor):
+	def execute(self, sql, parameters=()):
+		return super().execute(sqlite_sql(sql), parameters)
+
+	def executemany(self, sql, parameters):
+		return super().executemany(sqlite_sql(sql), parameters)
+
+
+class _SQLiteConnection(sqlite3.Connection):
+	def cursor(self, factory=_SQLiteCursor):
+		return super().cursor(factory)
+
+	def execute(self, sql, parameters=()):
+		return self.cursor().execute(sql, parameters)
+
+
+# SQLiteBackend connects to a SQLite file. The connections can be used from the reader's fetching thread.
+class SQLiteBackend:
+	def __init__(self, path):
+		self.path = path
+
+	def connect(self):
+		cnxn = sqlite3.connect(self.path, check_same_thread=False, factory=_SQLiteConnection)
+		cnxn.create_function('YEAR', 1, year, deterministic=True)
+		cnxn.create_function('RIGHT', 2, right, deterministic=True)
+		return cnxn
+
+
+# PooledConnection is a connection handed out by a ConnectionPool. It acts like the connection itself, but close()
+# gives it back to the pool. The cursors made from it are closed when it is given back so the next user finds the
+# connection free.
+class PooledConnection:
+	def __init__(self, pool, cnxn):
+		self.pool = pool
+		self.cnxn = cnxn
+		self.cursors = []
+
+	def cursor(self):
+		cursor = self.cnxn.cursor()
+		self.cursors += [cursor]
+		return cursor
+
+	def close(self):
+		self.pool.release(self)
+
+	# discard closes the connection for good and frees its place in the pool, for a connection that dropped
+	def discard(self):
+		self.pool.release(self, broken=True)
+
+	def __getattr__(self, name):
+		return getattr(self.cnxn, name)
+
+
+# ConnectionPool keeps up to size connections of backend. healthCheck=False skips the "SELECT 1" before a connection
+# is handed out again.
+class ConnectionPool:
+	def __init__(self, backend, size=4, healthCheck=True):
+		self.backend = backend
+		self.size = size
+		self.healthCheck = healthCheck
+		self.idle = []
+		self.lock = threading.Lock()
+		self.slots = threading.BoundedSemaphore(size)
+		self.made = 0
+		self.reused = 0
+		self.dropped = 0
+
+	# acquire returns a connection, waiting for one to be given back when size of them are in use
+	def acquire(self):
+		self.slots.acquire()
+		try:
+			while True:
+				with self.lock:
+					cnxn = self.idle.pop() if self.idle else None
+				if cnxn is None:
+					cnxn = self.backend.connect()
+					self.made += 1
+					break
+				if alive(cnxn, self.healthCheck):
+					self.reused += 1
+					break
+				# it dropped while it was in the pool
+				self.dropped += 1
+				discard(cnxn)
+		except BaseException:
+			self.slots.release()
+			raise
+		return PooledConnection(self, cnxn)
+
+	# release gives a connection back, see PooledConnection.close. broken=True closes it instead.
+	def release(self, connection, broken=False):
+		if connection.cnxn is None:
+			return
+		if broken:
+			self.dropped += 1
+			discard(connection.cnxn)
+		else:
+			for cursor in connection.cursors:
+				try:
+					cursor.close()
+				except Exception:
+					# the connection is gone, the health check finds out
+					pass
+			with self.lock:
+				self.idle += [connection.cnxn]
+		connection.cnxn = None
+		self.slots.release()
+
+	# connect returns a connection and its cursor, like DataMart_connect (CEDEN_DataRefresh.py)
+	def connect(self):
+		cnxn = self.acquire()
+		return cnxn, cnxn.cursor()
+
+	# close closes the connections waiting in the pool
+	def close(self):
+		with self.lock:
+			idle, self.idle = self.idle, []
+		for cnxn in idle:
+			discard(cnxn)
+
+	def stats(self):
+		return {'made': self.made, 'reused': self.reused, 'dropped': self.dropped}
+
+
+# alive checks a connection with a query that doesn't touch any table
+def alive(cnxn, healthCheck=True):
+	if not healthCheck:
+		return True
+	cursor = None
+	try:
+		cursor = cnxn.cursor()
+		cursor.execute('SELECT 1')
+		cursor.fetchall()
+		return True
+	except Exception:
+		return False
+	finally:
+		if cursor is not None:
+			try:
+				cursor.close()
+			except Exception:
+				pass
+
+
+def discard(cnxn):
+	try:
+		cnxn.close()
+	except Exception:
+		# the connection is already gone
+		pass
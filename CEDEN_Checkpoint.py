@@ -0,0 +1,140 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module keeps a checkpoint of a data_retrieval run (CEDEN_DataRefresh.py). A run used to start over from
+the WQX stations when the connection to the DataMart dropped hours in. With the checkpoint, a run that died is
+started again and only does what is left.
+	data_retrieval splits every table in jobs: the whole table, the shards of a sharded table (ranges of the shard
+key, see CEDEN_Shards.py) or the changed years of an incremental table. The plan of every table is saved before any
+job starts, so the run that resumes uses the same key ranges even if the DataMart changed in between. Every job that
+is done is saved with its files and then every table that is finished (stitched or merged). A file is saved with its
+hash, number of lines, size and modification time, and a job or table is only used again when all of its files are
+still there with the same size and modification time. Anything else is extracted again.
+	The checkpoint is removed once the run is complete. A checkpoint made with other settings (separator, extension,
+IR or not, shard key) or older than maxAge hours is not used.
+
+'''
+
+import os
+import json
+import time
+from CEDEN_Digests import digest_of, record_digests
+from CEDEN_Manifest import content_digest
+
+CHECKPOINT_VERSION = 1
+
+
+# Checkpoint is the checkpoint of a run kept in checkpointFile. settings are the settings the files depend on, a
+# dictionary that can be written as JSON.
+class Checkpoint:
+	def __init__(self, checkpointFile, settings, maxAge=48):
+		self.checkpointFile = checkpointFile
+		self.settings = settings
+		self.maxAge = maxAge
+		checkpoint = self._load()
+		self.started = checkpoint.get('started', time.time())
+		# plan: filename: [jobs, dirty years, table state], jobs: filename: {job number: result}, tables: filename:
+		# result
+		self.plans = checkpoint.get('plans', {})
+		self.jobs = checkpoint.get('jobs', {})
+		self.tables = checkpoint.get('tables', {})
+		if checkpoint:
+			print("Resuming the run started %s from %s: %d tables and %d jobs are done" %
+			      (time.strftime('%Y-%m-%d %H:%M', time.localtime(self.started)), checkpointFile, len(self.tables),
+			       sum(len(jobs) for jobs in self.jobs.values())))
+
+	# _load reads the checkpoint. A missing, broken, old or different checkpoint means the run starts from scratch.
+	def _load(self):
+		if not os.path.isfile(self.checkpointFile):
+			return {}
+		try:
+			with open(self.checkpointFile, 'r', encoding='utf8') as checkpointIn:
+				checkpoint = json.load(checkpointIn)
+		except ValueError:
+			return {}
+		if checkpoint.get('version') != CHECKPOINT_VERSION or checkpoint.get('settings') != self.settings:
+			return {}
+		if time.time() - checkpoint['started'] > self.maxAge * 3600:
+			print("The checkpoint in %s is more than %d hours old, starting over" % (self.checkpointFile, self.maxAge))
+			return {}
+		return checkpoint
+
+	# save writes the checkpoint next to the old one and then replaces it, so a crash never leaves half a checkpoint.
+	# The sites keep their order, it is the order of the All_CEDEN_Sites file.
+	def save(self):
+		with open(self.checkpointFile + '.tmp', 'w', encoding='utf8') as checkpointOut:
+			json.dump({'version': CHECKPOINT_VERSION, 'settings': self.settings, 'started': self.started,
+			           'plans': self.plans, 'jobs': self.jobs, 'tables': self.tables}, checkpointOut)
+		os.replace(self.checkpointFile + '.tmp', self.checkpointFile)
+
+	# plan returns the jobs (location, where, prune), dirty years and table state planned for a table, or None
+	def plan(self, filename):
+		if filename not in self.plans:
+			return None
+		jobs, dirty, tableState = self.plans[filename]
+		return [tuple(job) for job in jobs], dirty, tableState
+
+	# save_plans keeps the plans of the tables that don't have one yet, plans is a dictionary of filename: (jobs,
+	# dirty years, table state)
+	def save_plans(self, plans):
+		for filename, plan in plans.items():
+			self.plans.setdefault(filename, plan)
+		self.save()
+
+	# job returns the result of a job that was done, (writtenFiles, sites, rows) like extract_table, or None
+	def job(self, filename, number):
+		return self._result(self.jobs.get(filename, {}).get(str(number)))
+
+	def job_done(self, filename, number, result):
+		self.jobs.setdefault(filename, {})[str(number)] = self._entry(result)
+		self.save()
+
+	# table returns the result of a table that is finished, or None
+	def table(self, filename):
+		return self._result(self.tables.get(filename))
+
+	# table_done keeps the result of a finished table. Its jobs are not needed anymore, their files were stitched or
+	# merged.
+	def table_done(self, filename, result):
+		self.tables[filename] = self._entry(result)
+		self.jobs.pop(filename, None)
+		self.save()
+
+	# clear removes the checkpoint once the run is complete
+	def clear(self):
+		if os.path.isfile(self.checkpointFile):
+			os.remove(self.checkpointFile)
+
+	# _entry is what is kept of a result. The hashes come from open_output, a file written some other way is read.
+	@staticmethod
+	def _entry(result):
+		writtenFiles, sites, rows = result
+		hashes = {}
+		for path in writtenFiles.values():
+			digest = digest_of(path) or content_digest(path)
+			stat = os.stat(path)
+			hashes[path] = [digest[0], digest[1], stat.st_size, stat.st_mtime_ns]
+		return {'files': writtenFiles, 'sites': sites, 'rows': rows, 'hashes': hashes}
+
+	# _result gives back a result if every file is still the one that was kept, and hands their hashes to the
+	# manifest so they aren't read again
+	@staticmethod
+	def _result(entry):
+		if entry is None:
+			return None
+		for path, (digest, lines, size, mtime) in entry['hashes'].items():
+			if not os.path.isfile(path):
+				return None
+			stat = os.stat(path)
+			if stat.st_size != size or stat.st_mtime_ns != mtime:
+				return None
+		record_digests({os.path.abspath(path): (digest, lines)
+		                for path, (digest, lines, size, mtime) in entry['hashes'].items()})
+		return entry['files'], entry['sites'], entry['rows']
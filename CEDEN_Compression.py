@@ -0,0 +1,437 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module lets data_retrieval (CEDEN_DataRefresh.py), selectByAnalyte and the subsets write their files
+compressed as they go, with no uncompressed copy on disk. The full WaterChemistry, Tissue and Habitat files are
+several GB, and uploads of the Habitat file failed once it passed 2 GB.
+	The compression is chosen by the extension of the file: '.csv.gz' is gzip and '.csv.zst' is zstd (needs the
+zstandard library). Anything else is written as plain text. open_output returns a file for the csv writers. The
+text written to it is cut in blocks of BLOCK_SIZE, and the blocks are compressed by a small pool of threads while
+the main loop keeps cleaning and scoring records. zlib and zstd let go of the GIL while they compress, so this
+really runs in parallel. Each block is a complete gzip member or zstd frame and they are written in order. A file
+made of several members is still a normal .gz or .zst file for gzip, 7-zip, pandas, etc. open_input reads back any
+file written by open_output.
+	When a compressed file is closed, its compression ratio and throughput are printed.
+	Every file written by open_output hands its text to a ContentDigest as it is written and is put in place once it
+is closed, see CEDEN_Digests.py.
+	The time spent in the files (hashing, handing the blocks to the compression threads, writing to disk) is added
+up for the profile of a run, see io_seconds and CEDEN_Profile.py.
+	PooledOutput is an output file for the partitions of CEDEN_Partitions.py, which can be too many to keep open. It
+keeps its text in memory and only gets an open file from a pool when it writes a block.
+
+'''
+
+import os
+import io
+import gzip
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from CEDEN_Digests import ContentDigest, partial_path, finish_output, abort_output
+
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+
+# the extensions of the compressed files and the compression they use
+COMPRESSIONS = {'.gz': 'gzip', '.zst': 'zstd', }
+# the compression level of each compression
+LEVELS = {'gzip': 6, 'zstd': 3, }
+# the size of the blocks that are compressed on their own, in characters
+BLOCK_SIZE = 1024 * 1024
+# the number of threads compressing the blocks of a file
+THREADS = 2
+# stands for "use the compression of the file's extension"
+_EXTENSION = object()
+# the seconds this process spent writing output files, see io_seconds
+_ioSeconds = 0.
+
+
+# compression_of returns the compression of a file from its extension, or None for a plain file
+def compression_of(path):
+	for extension, compression in COMPRESSIONS.items():
+		if path.endswith(extension):
+			return compression
+	return None
+
+
+# strip_compression removes the compression extension of a file name ('WaterChemistryData.csv.gz' ->
+# 'WaterChemistryData.csv')
+def strip_compression(path):
+	for extension in COMPRESSIONS:
+		if path.endswith(extension):
+			return path[:-len(extension)]
+	return path
+
+
+# require_compression raises an ImportError when the compression of extension needs a library that isn't installed
+def require_compression(extension):
+	_require(compression_of(extension))
+
+
+def _require(compression):
+	if compression == 'zstd' and zstandard is None:
+		raise ImportError("zstd compression needs the zstandard library, pip install zstandard")
+
+
+# _compress compresses one block on its own and returns it with the time it took
+def _compress(block, compression, level):
+	start = time.perf_counter()
+	if compression == 'gzip':
+		# mtime=0 makes the same content give the same file
+		data = gzip.compress(block, compresslevel=level, mtime=0)
+	else:
+		# a ZstdCompressor can't be shared between threads
+		data = zstandard.ZstdCompressor(level=level).compress(block)
+	return data, time.perf_counter() - start
+
+
+# io_seconds returns the time this process spent in the output files so far. Only the time the writing thread waits
+# counts, not the compression threads.
+def io_seconds():
+	return _ioSeconds
+
+
+# CompressedWriter is a text file that compresses everything written to it, see above. It only has what the csv
+# writers need: write, flush and close. With binary=True it is written bytes instead of text.
+class CompressedWriter:
+	def __init__(self, path, compression, level=None, threads=THREADS, blockSize=BLOCK_SIZE, report=True,
+	             binary=False):
+		_require(compression)
+		self.path = path
+		self.compression = compression
+		self.level = LEVELS[compression] if level is None else level
+		self.blockSize = blockSize
+		self.report = report
+		self.binary = binary
+		self.partial = partial_path(path)
+		self.fileOut = open(self.partial, 'wb')
+		self.digest = ContentDigest()
+		self.pool = ThreadPoolExecutor(max_workers=threads)
+		# the blocks being compressed, in the order they go in the file. At most maxPending are kept in memory.
+		self.pending = deque()
+		self.maxPending = threads * 2
+		self.buffer = []
+		self.buffered = 0
+		self.raw = 0
+		self.compressed = 0
+		self.seconds = 0.
+		self.closed = False
+
+	def write(self, text):
+		self.buffer += [text]
+		self.buffered += len(text)
+		if self.buffered >= self.blockSize:
+			self._submit()
+		return len(text)
+
+	# _submit hands the buffered text to the pool and writes the blocks that are done
+	def _submit(self):
+		global _ioSeconds
+		start = time.perf_counter()
+		block = b''.join(self.buffer) if self.binary else ''.join(self.buffer).encode('utf8')
+		self.buffer = []
+		self.buffered = 0
+		self.raw += len(block)
+		self.digest.update(block)
+		self.pending += [self.pool.submit(_compress, block, self.compression, self.level)]
+		while len(self.pending) > self.maxPending or (self.pending and self.pending[0].done()):
+			self._write_next()
+		_ioSeconds += time.perf_counter() - start
+
+	# _write_next waits for the oldest block and writes it
+	def _write_next(self):
+		data, seconds = self.pending.popleft().result()
+		self.fileOut.write(data)
+		self.compressed += len(data)
+		self.seconds += seconds
+
+	def flush(self):
+		pass
+
+	def close(self):
+		global _ioSeconds
+		if self.closed:
+			return
+		self.closed = True
+		start = time.perf_counter()
+		try:
+			# an empty file still gets one (empty) member so it can be read back
+			if self.buffer or not self.raw:
+				self._submit()
+			while self.pending:
+				self._write_next()
+		finally:
+			self.pool.shutdown()
+			self.fileOut.close()
+			_ioSeconds += time.perf_counter() - start
+		finish_output(self.path, self.partial, self.digest.result())
+		if self.report:
+			print("\tCompressed %s with %s: %.1f MB to %.1f MB (%.1fx) at %.1f MB/s" %
+			      (os.path.basename(self.path), self.compression, self.raw / 1e6, self.compressed / 1e6,
+			       self.raw / max(self.compressed, 1), self.raw / 1e6 / max(self.seconds, 1e-6)))
+
+	# abort stops writing the file without finishing it, see abort_output
+	def abort(self):
+		if self.closed:
+			return
+		self.closed = True
+		self.pool.shutdown(cancel_futures=True)
+		self.fileOut.close()
+		abort_output(self.path, self.partial)
+
+	def __enter__(self):
+		return self
+
+	# when the with block failed the file is left unfinished
+	def __exit__(self, excType, exc, traceback):
+		if excType is None:
+			self.close()
+		else:
+			self.abort()
+
+
+# the threads compressing the blocks of every PooledOutput of this process and the process they belong to, see
+# _compression_threads
+_pooledCompression = (None, None)
+
+
+# _compression_threads returns the threads of the PooledOutputs. They are started by the first one, and again in a
+# worker process forked from this one since the threads don't come along.
+def _compression_threads():
+	global _pooledCompression
+	if _pooledCompression[0] != os.getpid():
+		_pooledCompression = (os.getpid(), ThreadPoolExecutor(max_workers=THREADS))
+	return _pooledCompression[1]
+
+
+# PooledOutput is an output file that doesn't stay open. The text written to it waits in memory (text, a StringIO)
+# until bufferSize characters are there, then the block is hashed and written to the open file handles (a HandlePool,
+# see CEDEN_Partitions.py) gives it. handles closes the least recently used file when too many are open, the file is
+# opened again to append to the next time. A compressed file hands its blocks to threads shared by every PooledOutput
+# and writes them in order once they are done, like CompressedWriter. It only has what the csv writers need: write,
+# flush and close. A csv writer can also write to text directly and call spill once bufferSize is reached, which
+# saves a python call per row.
+class PooledOutput:
+	def __init__(self, path, handles, bufferSize=BLOCK_SIZE, compression=_EXTENSION, report=True):
+		if compression is _EXTENSION:
+			compression = compression_of(path)
+		if compression:
+			_require(compression)
+			self.threads = _compression_threads()
+		self.path = path
+		self.handles = handles
+		self.compression = compression
+		self.bufferSize = bufferSize
+		self.report = report
+		self.partial = partial_path(path)
+		self.digest = ContentDigest()
+		self.text = io.StringIO()
+		# the compressed blocks on their way to the file, in order
+		self.pending = deque()
+		# the file is created by the first block and appended to after that
+		self.created = False
+		self.raw = 0
+		self.compressed = 0
+		self.seconds = 0.
+		self.closed = False
+
+	def write(self, text):
+		self.text.write(text)
+		if self.text.tell() >= self.bufferSize:
+			self.spill()
+		return len(text)
+
+	# spill writes the text waiting in memory to the file, or hands it to the compression threads
+	def spill(self):
+		global _ioSeconds
+		start = time.perf_counter()
+		block = self.text.getvalue().encode('utf8')
+		self.text.seek(0)
+		self.text.truncate()
+		self.raw += len(block)
+		self.digest.update(block)
+		if self.compression:
+			self.pending += [self.threads.submit(_compress, block, self.compression, LEVELS[self.compression])]
+			while len(self.pending) > 1 or (self.pending and self.pending[0].done()):
+				self._write_next()
+		else:
+			self.handles.handle(self).write(block)
+			self.compressed += len(block)
+		_ioSeconds += time.perf_counter() - start
+
+	# _write_next waits for the oldest compressed block and writes it
+	def _write_next(self):
+		data, seconds = self.pending.popleft().result()
+		self.handles.handle(self).write(data)
+		self.compressed += len(data)
+		self.seconds += seconds
+
+	# open_file opens the file for handles
+	def open_file(self):
+		fileOut = open(self.partial, 'ab' if self.created else 'wb')
+		self.created = True
+		return fileOut
+
+	def flush(self):
+		pass
+
+	def close(self):
+		global _ioSeconds
+		if self.closed:
+			return
+		self.closed = True
+		# an empty file still gets one (empty) member so it can be read back
+		if self.text.tell() or not self.raw:
+			self.spill()
+		start = time.perf_counter()
+		while self.pending:
+			self._write_next()
+		_ioSeconds += time.perf_counter() - start
+		self.handles.release(self)
+		finish_output(self.path, self.partial, self.digest.result())
+		if self.compression and self.report:
+			print("\tCompressed %s with %s: %.1f MB to %.1f MB (%.1fx) at %.1f MB/s" %
+			      (os.path.basename(self.path), self.compression, self.raw / 1e6, self.compressed / 1e6,
+			       self.raw / max(self.compressed, 1), self.raw / 1e6 / max(self.seconds, 1e-6)))
+
+	# abort stops writing the file without finishing it, see abort_output. The blocks still being compressed are
+	# dropped.
+	def abort(self):
+		if self.closed:
+			return
+		self.closed = True
+		self.pending.clear()
+		self.handles.release(self)
+		abort_output(self.path, self.partial)
+
+	def __enter__(self):
+		return self
+
+	# when the with block failed the file is left unfinished
+	def __exit__(self, excType, exc, traceback):
+		if excType is None:
+			self.close()
+		else:
+			self.abort()
+
+
+# _PlainBuffer is the binary buffer under a plain output file. It hands the bytes on their way to the disk to a
+# ContentDigest.
+class _PlainBuffer(io.BufferedWriter):
+	def __init__(self, path, bufferSize):
+		self.path = path
+		self.partial = partial_path(path)
+		super().__init__(io.FileIO(self.partial, 'w'), bufferSize)
+		self.digest = ContentDigest()
+
+	def write(self, data):
+		global _ioSeconds
+		start = time.perf_counter()
+		self.digest.update(data)
+		written = super().write(data)
+		_ioSeconds += time.perf_counter() - start
+		return written
+
+	def close(self):
+		if self.closed:
+			return
+		super().close()
+		finish_output(self.path, self.partial, self.digest.result())
+
+	# abort closes the file without finishing it, see abort_output
+	def abort(self):
+		if self.closed:
+			return
+		try:
+			super().close()
+		finally:
+			abort_output(self.path, self.partial)
+
+	# when the with block failed the file is left unfinished
+	def __exit__(self, excType, exc, traceback):
+		if excType is None:
+			self.close()
+		else:
+			self.abort()
+
+	# a file that was never closed, ie. a subset of a table that failed, is not finished either
+	def __del__(self):
+		self.abort()
+
+
+# _OutputText is the text file of open_output over a _PlainBuffer, it leaves the file unfinished like the buffer
+# when the with block failed or it was never closed
+class _OutputText(io.TextIOWrapper):
+	def abort(self):
+		self.buffer.abort()
+
+	def __exit__(self, excType, exc, traceback):
+		if excType is None:
+			self.close()
+		else:
+			self.abort()
+
+	def __del__(self):
+		self.buffer.abort()
+
+
+# open_output opens a file to write text to, compressed or not depending on its extension. compression can be
+# given when the extension doesn't tell (ie. a temporary file). buffering is for the plain files. binary=True opens it
+# to write utf8 bytes instead of text, for the RecordWriter of CEDEN_Serializer.py.
+def open_output(path, buffering=-1, compression=_EXTENSION, binary=False):
+	if compression is _EXTENSION:
+		compression = compression_of(path)
+	if compression:
+		return CompressedWriter(path, compression, binary=binary)
+	buffer = _PlainBuffer(path, buffering if buffering > 1 else io.DEFAULT_BUFFER_SIZE)
+	if binary:
+		return buffer
+	return _OutputText(buffer, encoding='utf8', newline='', line_buffering=buffering == 1)
+
+
+# _open_binary opens a compressed file to read its uncompressed bytes. It reads every member or frame.
+def _open_binary(path, compression):
+	if compression == 'gzip':
+		return gzip.open(path, 'rb')
+	_require(compression)
+	return zstandard.ZstdDecompressor().stream_reader(open(path, 'rb'), read_across_frames=True, closefd=True)
+
+
+# open_binary opens a file written by open_output, compressed or not, to read its text as utf8 bytes
+def open_binary(path):
+	compression = compression_of(path)
+	return _open_binary(path, compression) if compression else open(path, 'rb')
+
+
+# open_input opens a file written by open_output to read its text. compression works like in open_output.
+def open_input(path, compression=_EXTENSION):
+	if compression is _EXTENSION:
+		compression = compression_of(path)
+	if compression:
+		return io.TextIOWrapper(_open_binary(path, compression), newline='', encoding='utf8')
+	return open(path, 'r', newline='', encoding='utf8')
+
+
+# smaller_than is True when the text of a file, compressed or not, is shorter than size bytes. Only the first size
+# bytes of a compressed file are uncompressed.
+def smaller_than(path, size):
+	compression = compression_of(path)
+	if not compression:
+		return os.stat(path).st_size < size
+	read = 0
+	with _open_binary(path, compression) as fileIn:
+		while read < size:
+			block = fileIn.read(size - read)
+			if not block:
+				break
+			read += len(block)
+	return read < size
@@ -0,0 +1,248 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module holds the compiled version of the data quality decision tree used by data_retrieval in
+CEDEN_DataRefresh.py. Instead of walking the Mod_CodeColumns dictionary twice for every record, a
+DataQualityPlan is built once per table from the DictionaryFixer output and the column order of the
+cursor. The plan stores the position of every QA column, the code lookups and the special rules so
+that each record is scored with simple index and dictionary lookups. The DataQuality and
+DataQualityIndicator values produced are identical to the original per-record logic.
+
+'''
+
+import re
+from functools import lru_cache
+
+# these are the kinds of columns in the decision tree. Each one has its own special rule in the original
+# data_retrieval logic. Everything that isn't listed here is a plain "is the value in the QA list" check.
+QA_COLUMN = 'QACode'
+STATION_COLUMN = 'StationCode'
+ANALYTE_COLUMNS = ('Analyte', 'AnalyteName', )
+RESQUAL_COLUMNS = ('ResultQualCode', 'ResQualCode', )
+RESULT_COLUMN = 'Result'
+
+# numerical identifiers for each kind of step in the plan
+_GENERIC, _QACODE, _STATION, _ANALYTE, _RESQUAL, _RESULT = range(6)
+
+# The IR2018 WQ and Tissue tables report SampleDate as monthdayyear so the year is the last four characters.
+# For IR2018_WQ every record is checked against the year (the "or" in the original rule is not bound to DNQ),
+# for IR2018_Tissue only the DNQ records are.
+IR_YEAR_ALL = ('IR2018_WQ', )
+IR_YEAR_DNQ = ('IR2018_Tissue', )
+
+# precompiled patterns for the StationCode and Analyte special rules
+NONPJ = '000NONPJ'
+SURROGATE = re.compile('[Ss]urrogate')
+
+# stand in for "the codeVal variable has not been assigned yet" in the original logic
+_UNBOUND = object()
+
+
+# DataQualityPlan compiles the Mod_CodeColumns dictionary (output of DictionaryFixer) against the list of column
+# names for a table. score() takes a record as a list of values, in the same order as the unique names in
+# columns, and returns a tuple of the DataQuality and DataQualityIndicator values. The indicator is None when the
+# record keeps whatever was already in its DataQualityIndicator column (MetaData and Passed records).
+# Most records share a handful of QA code combinations, so the outcome of every signature is kept in a bounded
+# LRU cache of cacheSize entries. Use cacheSize=0 to turn the cache off.
+class DataQualityPlan:
+	def __init__(self, Mod_CodeColumns, columns, table, DQ_Codes, cacheSize=50000):
+		self.table = table
+		self.DQ_Codes = DQ_Codes
+		# recordDict = dict(zip(columns, row)) keeps the first position of a repeated column name so the
+		# record we get handed is in that same order
+		self.positions = {name: i for i, name in enumerate(dict.fromkeys(columns))}
+		self.irYear = table in IR_YEAR_ALL or table in IR_YEAR_DNQ
+		self.sampleDateIndex = self.positions.get('SampleDate')
+		self.steps = []
+		for codeCol, codes in Mod_CodeColumns.items():
+			# this raises a KeyError just like recordDict[codeCol] would if the column is missing
+			index = self.positions[codeCol]
+			lookup = {codeVal: int(value) for codeVal, value in codes.items()}
+			if codeCol == QA_COLUMN:
+				kind = _QACODE
+			elif codeCol == STATION_COLUMN:
+				kind = _STATION
+			elif codeCol in ANALYTE_COLUMNS:
+				kind = _ANALYTE
+			elif codeCol in RESQUAL_COLUMNS:
+				kind = _RESQUAL
+			elif codeCol == RESULT_COLUMN:
+				kind = _RESULT
+			else:
+				kind = _GENERIC
+			self.steps += [(kind, index, codeCol, lookup), ]
+		# The original StationCode rule never checks the StationCode value itself. It compares the *previous*
+		# codeVal (left over from an earlier column, or even from the previous record) to the StationCode list.
+		# We keep that behavior so that the output stays identical. staleSteps are the columns before
+		# StationCode, nearest first, that can set codeVal. If none of them are sure to set it, the value left
+		# over from the previous record is used. The original logic also let the value of the last record of the
+		# previous table leak into the first record of the next one, that is not kept: every table (and shard)
+		# starts with codeVal unassigned, so the tables don't depend on each other.
+		self.staleSteps = []
+		self.staleFromState = False
+		kinds = [step[0] for step in self.steps]
+		if _STATION in kinds:
+			self.staleFromState = True
+			for kind, index, codeCol, lookup in reversed(self.steps[:kinds.index(_STATION)]):
+				if kind == _ANALYTE:
+					continue
+				self.staleSteps += [(kind, index), ]
+				if kind != _RESULT:
+					# everything but Result always sets codeVal
+					self.staleFromState = False
+					break
+		# the last codeVal of a record is the last value of the last column in the indicator loop
+		self.codeVal = _UNBOUND
+		if self.steps:
+			self.lastKind, self.lastIndex = self.steps[-1][0], self.steps[-1][1]
+		if cacheSize:
+			self.cached_score = lru_cache(maxsize=cacheSize)(self.score_signature)
+		else:
+			self.cached_score = self.score_signature
+
+	# _stale returns what codeVal held when the original logic reached the StationCode column
+	def _stale(self, record):
+		for kind, index in self.staleSteps:
+			value = record[index]
+			if kind == _RESULT:
+				if value:
+					return value[-1]
+			else:
+				return value
+		return self.codeVal
+
+	# signature reduces a record to only the values that can change its data quality. Values that are not in
+	# a QA list are replaced with None so that records with different Latitudes, Results, StationCodes, etc.
+	# can share a signature, and the SampleDate only adds its year for the DNQ and IR rules.
+	# score_signature() works from this tuple alone which is what makes the cache possible.
+	def signature(self, record):
+		tokens = []
+		for kind, index, codeCol, lookup in self.steps:
+			value = record[index]
+			if kind == _GENERIC or kind == _RESULT:
+				tokens += [value if value in lookup else None]
+			elif kind == _QACODE:
+				tokens += [value]
+			elif kind == _STATION:
+				if NONPJ in value:
+					tokens += [(value if value in lookup else None, True, None)]
+				else:
+					stale = self._stale(record)
+					staleDQ = None if stale is _UNBOUND else lookup.get(stale)
+					tokens += [(value if value in lookup else None, False, staleDQ)]
+			elif kind == _ANALYTE:
+				tokens += [(value if value in lookup else None, bool(SURROGATE.search(value)))]
+			else:
+				# the year is only needed for DNQ records and the IR special rules
+				if self.table in IR_YEAR_ALL or value == 'DNQ':
+					sampleDate = record[self.sampleDateIndex] if self.sampleDateIndex is not None else \
+						record[self.positions['SampleDate']]
+					year = sampleDate[-4:] if self.irYear else sampleDate[:4]
+				else:
+					year = None
+				tokens += [(value, year)]
+		if self.staleFromState and self.steps:
+			value = record[self.lastIndex]
+			self.codeVal = value.split(',')[-1] if self.lastKind == _QACODE else value
+		return tuple(tokens)
+
+	# score_signature runs the decision tree once over the signature. It collects the max DQ value and, at the
+	# same time, every code that could end up in the quality indicator.
+	def score_signature(self, tokens):
+		MaxDQ = -1
+		hasZero = False
+		candidates = []
+		for (kind, index, codeCol, lookup), token in zip(self.steps, tokens):
+			if kind == _QACODE:
+				for codeVal in token.split(','):
+					value = lookup.get(codeVal)
+					if value is not None:
+						MaxDQ = max(MaxDQ, value)
+						hasZero = hasZero or value == 0
+						candidates += [(value, codeCol, codeVal)]
+				# the whole QACode string is also checked against the list
+				value = lookup.get(token)
+				if value is not None:
+					MaxDQ = max(MaxDQ, value)
+					hasZero = hasZero or value == 0
+			elif kind == _STATION:
+				codeVal, isNonPJ, staleDQ = token
+				if isNonPJ:
+					hasZero = True
+					MaxDQ = max(MaxDQ, 0)
+				elif staleDQ is not None:
+					MaxDQ = max(MaxDQ, staleDQ)
+					hasZero = hasZero or staleDQ == 0
+				if codeVal is not None:
+					candidates += [(lookup[codeVal], codeCol, codeVal)]
+			elif kind == _ANALYTE:
+				codeVal, isSurrogate = token
+				if isSurrogate:
+					hasZero = True
+					MaxDQ = max(MaxDQ, 0)
+				if codeVal is not None:
+					candidates += [(lookup[codeVal], codeCol, codeVal)]
+			elif kind == _RESQUAL:
+				codeVal, year = token
+				value = None
+				if self.table in IR_YEAR_ALL or self.table in IR_YEAR_DNQ and codeVal == 'DNQ':
+					if int(year) < 2008:
+						value = 6
+				elif codeVal == 'DNQ' and int(year) < 2008:
+					value = 6
+				elif codeVal == 'ND':
+					# ND is a pass whether or not the record has a Result
+					value = 1
+				else:
+					value = lookup.get(codeVal)
+				if value is not None:
+					MaxDQ = max(MaxDQ, value)
+					hasZero = hasZero or value == 0
+				if codeVal in lookup:
+					candidates += [(lookup[codeVal], codeCol, codeVal)]
+			elif kind == _RESULT:
+				# Results never add to DQ, they only show up in the indicator
+				if token is not None:
+					candidates += [(lookup[token], codeCol, token)]
+			else:
+				if token is not None:
+					value = lookup[token]
+					MaxDQ = max(MaxDQ, value)
+					hasZero = hasZero or value == 0
+					candidates += [(value, codeCol, token)]
+		if MaxDQ == -1:
+			# nothing was found for this record, it slipped through the cracks
+			MaxDQ = 7
+		if hasZero:
+			return self.DQ_Codes[0], None
+		elif MaxDQ == 1:
+			return self.DQ_Codes[1], None
+		# Build the indicator from the codes equal to the max DQ, grouped by column in column order
+		QInd = []
+		for value, codeCol, codeVal in candidates:
+			if value == MaxDQ:
+				if QInd and QInd[-1][0] == codeCol:
+					QInd[-1][1].append(codeVal)
+				else:
+					QInd += [(codeCol, [codeVal])]
+		if MaxDQ == 6 and not QInd:
+			return self.DQ_Codes[MaxDQ], 'ResultQualCode Special Rules'
+		return self.DQ_Codes[MaxDQ], '; '.join(codeCol + ':' + ','.join(values) for codeCol, values in QInd)
+
+	# score a single record
+	def score(self, record):
+		return self.cached_score(self.signature(record))
+
+	# cache_stats returns the hits, misses and current size of the signature cache
+	def cache_stats(self):
+		if not hasattr(self.cached_score, 'cache_info'):
+			return {'hits': 0, 'misses': 0, 'size': 0}
+		info = self.cached_score.cache_info()
+		return {'hits': info.hits, 'misses': info.misses, 'size': info.currsize}
@@ -28,7 +28,6 @@ Prerequisites:
 		working on a mac... I tried)
 	Python 3.X
 	pyodbc library for python.  See https://github.com/mkleehammer/pyodbc
-	dkan library for python.    See https://github.com/GetDKAN/pydkan
 	set appropriate server addresses, usernames, passwords for both the water boards DataMart and
 	Data.ca.gov's account.
 	Please also use the pyodbc's drivers() tool to determine which sql driver is on your machine.
@@ -37,14 +36,36 @@ Prerequisites:
 '''
 
 # Import the necessary libraries of python code
-import pyodbc
 import os
 import csv
 import re
 from datetime import datetime
-import string
 import getpass
-from dkan.client import DatasetAPI
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from CEDEN_DataQuality import DataQualityPlan
+from CEDEN_Subsets import Subset, RegionPartitioner, write_Sites, published, subset_query
+from CEDEN_Partitions import PartitionWriter
+from CEDEN_Reader import BatchedReader, ARRAYSIZE, Reconnecting
+from CEDEN_Writer import WriteBehind, WRITE_DEPTH, WRITE_BUFFER
+from CEDEN_Backend import SQLServerBackend, ConnectionPool
+from CEDEN_Scheduler import table_counts, largest_first, save_history
+from CEDEN_Shards import TEXT_DATES, table_key, histogram, split_histogram, shard_clauses, shard_location, stitch_shards
+from CEDEN_Stations import stations_fingerprint, load_station_cache, save_station_cache, read_stations
+from CEDEN_Sanitizer import Sanitizer, printable_for
+from CEDEN_Records import RecordLayout
+from CEDEN_Serializer import RecordWriter
+from CEDEN_Parquet import require_pyarrow, write_parquet, parquet_siblings
+from CEDEN_Upload import StreamingClient, UploadScheduler
+from CEDEN_Publish import PublishQueue
+from CEDEN_Compression import open_output, open_input, require_compression, smaller_than
+from CEDEN_Digests import keep_unchanged, take_digests, record_digests
+from CEDEN_Manifest import Manifest
+from CEDEN_Checkpoint import Checkpoint
+from CEDEN_Profile import TableTiming, RunProfile, take_timings, record_timings, profiled
+from CEDEN_Query import TableQuery, RENAME_TARGET, COMPUTED_COLUMNS
+from CEDEN_Incremental import FINGERPRINT, INCREMENTAL_FOLDER, DATE_FORMAT, load_state, save_state, year_fingerprints, \
+	dirty_years, year_clause, full_rebuild_due, table_state, merge_delta, read_sites, count_records
 
 
 ##### These are not currently in use as we have decided not to calculate RB values for each site
@@ -64,10 +85,71 @@ from dkan.client import DatasetAPI
 #polygons = shpfilePoints
 
 
-# decodeAndStrip takes a string and filters each character through the printable variable. It returns a filtered string.
-def decodeAndStrip(t):
-	filter1 = ''.join(filter(lambda x: x in printable, str(t)))
-	return filter1
+###############################################################################
+##################        Dictionaries for QA codes below 		###############
+###############################################################################
+# The following python dictionaries refer to codes and their corresponding data quality value as determined by
+# Melissa Morris of SWRCB, Office of Information Management and Analysis. 0: QC record, 1: Passed QC, 2: Needs some
+# review, 3: Spatial Accuracy Unknown, 4: Needs extensive review, 5: unknown data quality, 6: reject data record  (as
+#  of 1/22/18)
+QA_Code_list = {"AWM": 1, "AY": 2, "BB": 2, "BBM": 2, "BCQ": 1, "BE": 2, "BH": 1, "BLM": 4, "BRKA": 2, "BS": 2,
+                "BT": 6, "BV": 4, "BX": 4, "BY": 4, "BZ": 4, "BZ15": 2, "C": 1, "CE": 4, "CIN": 2, "CJ": 2, "CNP": 2,
+                "CQA": 1, "CS": 2, "CSG": 2, "CT": 2, "CVH": 1, "CVHB": 4, "CVL": 1, "CVLB": 4, "CZM": 2, "D": 1,
+                "DB": 2, "DBLOD": 2, "DBM": 2, "DF": 2, "DG": 1, "DO": 1, "DRM": 2, "DS": 1, "DT": 1, "ERV": 4, "EUM": 4,
+                "EX": 4, "F": 2, "FCL": 2, "FDC": 2, "FDI": 2, "FDO": 6, "FDP": 2, "FDR": 1, "FDS": 1, "FEU": 6, "FIA": 6,
+                "FIB": 4, "FIF": 6, "FIO": 4, "FIP": 4, "FIT": 2, "FIV": 6, "FLV": 6, "FNM": 6, "FO": 2, "FS": 6, "FTD": 6,
+                "FTT": 6, "FUD": 6, "FX": 4, "GB": 2, "GBC": 4, "GC": 1, "GCA": 1, "GD": 1, "GN": 4, "GR": 4, "H": 2, "H22": 4,
+                "H24": 4, "H8": 2, "HB": 2, "HD": 4, "HH": 2, "HNO2": 2, "HR": 1, "HS": 4, "HT": 1, "IE": 2, "IF": 2, "IL": 4,
+                "ILM": 2, "ILN": 2, "ILO": 2, "IM": 2, "IP": 4, "IP5": 4, "IPMDL2": 4, "IPMDL3": 4, "IPRL": 4, "IS": 4,
+                "IU": 4, "IZM": 2, "J": 2, "JA": 2, "JDL": 2, "LB": 2, "LC": 4, "LRGN": 6, "LRIL": 6, "LRIP": 6, "LRIU": 6,
+                "LRJ": 6, "LRJA": 6, "LRM": 6, "LRQ": 6, "LST": 6, "M": 2, "MAL": 1, "MN": 4, "N": 2, "NAS": 2, "NBC": 2,
+                "NC": 1, "NG": 1, "NMDL": 1, "None": 1, "NR": 5, "NRL": 1, "NTR": 1, "OA": 2, "OV": 2, "P": 4, "PG": 4,
+                "PI": 4, "PJ": 1, "PJM": 1, "PJN": 1, "PP": 4, "PRM": 4, "Q": 4, "QAX": 1, "QG": 4, "R": 6, "RE": 1, "REL": 1,
+                "RIP": 6, "RIU": 6, "RJ": 6, "RLST": 6, "RPV": 4, "RQ": 2, "RU": 4, "RY": 4, "SC": 1, "SCR": 2, "SLM": 1, "TA": 4,
+                "TAC": 1, "TC": 4, "TCI": 4, "TCT": 4, "TD": 4, "TH": 4, "THS": 4, "TK": 4, "TL": 2, "TNC": 2, "TNS": 1, "TOQ": 4,
+                "TP": 4, "TR": 6, "TS": 4, "TW": 2, "UF": 2, "UJ": 2, "UKM": 4, "ULM": 4, "UOL": 2, "VCQ": 2, "VQN": 2, "VC": 2,
+                "VBB": 2, "VBS": 2, "VBY": 4, "VBZ": 4, "VBZ15": 2, "VCJ": 2, "VCO": 2, "VCR": 2, "VD": 1, "VDO": 1, "VDS": 1,
+                "VELB": 1, "VEUM": 4, "VFDP": 2, "VFIF": 6, "VFNM": 6, "VFO": 2, "VGB": 2, "VGBC": 4, "VGN": 4, "VH": 2, "VH24": 4,
+                "VH8": 2, "VHB": 2, "VIE": 2, "VIL": 4, "VILN": 4, "VILO": 2, "VIP": 4, "VIP5": 4, "VIPMDL2": 4, "VIPMDL3": 4,
+                "VIPRL": 4, "VIS": 4, "VIU": 4, "VJ": 2, "VJA": 2, "VLB": 2, "VLMQO": 2, "VM": 2, "VNBC": 2, "VNC": 1, "VNMDL": 1,
+                "VNTR": 1, "VPJM": 1, "VPMQO": 2, "VQAX": 1, "VQCA": 4, "VQCP": 4, "VR": 6, "VRBS": 6, "VRBZ": 6, "VRDO": 6,
+                "VRE": 1, "VREL": 1, "VRGN": 6, "VRIL": 6, "VRIP": 6, "VRIU": 6, "VRJ": 6, "VRLB": 6, "VRLST": 6, "VRQ": 2,
+                "VRVQ": 6, "VS": 2, "VSC": 1, "VSCR": 2, "VSD3": 1, "VTAC": 1, "VTCI": 4, "VTCT": 4, "VTNC": 2, "VTOQ": 4, "VTR": 6,
+                "VTW": 4, "VVQ": 6, "WOQ": 4,  }
+BatchVerificationCode_list = {"NA": 5, "NR": 5, "VAC": 1, "VAC,VCN": 6, "VAC,VMD": 2, "VAC,VMD,VQI": 4,
+                              "VAC,VQI": 4, "VAC,VR": 6, "VAF": 1, "VAF,VMD": 2, "VAF,VQI": 4, "VAP": 1,
+                              "VAP,VI": 4, "VAP,VQI": 4, "VCN": 6, "VLC": 1, "VLC,VMD": 2, "VLC,VMD,VQI": 4,
+                              "VLC,VQI": 4, "VLF": 1, "VMD": 2, "VQI": 4, "VQI,VTC": 4, "VQN": 5, "VR": 6, "VTC": 2}
+ResultQualCode_list = {"/oC": 4, "<": 1, "<=": 1, "=": 1, ">": 1, ">=": 1, "A": 1, "CG": 4, "COL": 1, "DNQ": 1,
+                       "JF": 1, "NA": 6, "ND": 1, "NR": 6, "NRS": 6, "NRT": 6, "NSI": 1, "P": 1, "PA": 1, "w/C": 4,
+                       "": 1, "Systematic Contamination": 4, }
+Latitude_list = {"-88": 0, "": 6, '0.0': 6, }
+Result_list = {"": 1, }
+StationCode_list = {"LABQA": 0, "LABQA_SWAMP": 0, "000NONPJ": 0, "FIELDQA": 0, "Non Project QA Sample": 0,
+                    "Laboratory QA Sample": 0, "Field QA sample": 0, "FIELDQA SWAMP": 0, "000NONSW": 0, }
+SampleTypeCode_list = {"LabBlank": 0, "CompBLDup": 0, "LCS": 0, "CRM": 0, "FieldBLDup_Grab": 0, "FieldBLDup_Int": 0,
+                       "FieldBLDup": 0, "FieldBlank": 0, "TravelBlank": 0, "EquipBlank": 0, "DLBlank": 0,
+                       "FilterBlank": 0, "MS1": 0, "MS2": 0, "MS3": 0, "MSBLDup": 0, }
+ProgramName_list = {}
+SampleDate_list = {"Jan  1 1950 12:00AM": 0, }
+Analyte_list = {"Surrogate": 0, }
+MatrixName_list = {"blankwater": 0, "Blankwater": 0, "labwater": 0, "blankmatrix": 0, }
+CollectionReplicate_list = {"0": 1, "1": 1, "2": 0, "3": 0, "4": 0, "5": 0, "6": 0, "7": 0, "8": 0, }
+ResultsReplicate_list = {"0": 1, "1": 1, "2": 0, "3": 0, "4": 0, "5": 0, "6": 0, "7": 0, "8": 0, }
+Datum_list = {"NR": 3, }
+DQ_Codes = {0: "MetaData", 1: "Passed", 2: "Some review needed", 3: "Spatial accuracy unknown",
+            4: "Extensive review needed", 5: "Unknown data quality", 6: "Reject record", 7: 'Error in data'}
+# the CodeColumns variable is a dictionary template for each dataset. Some datasets do not have all of these columns
+# and as such have to be removed with the DictionaryFixer definition below.
+CodeColumns = {"QACode": QA_Code_list, "BatchVerification": BatchVerificationCode_list,
+              "ResultQualCode": ResultQualCode_list, "Latitude": Latitude_list, "Result": Result_list,
+              "StationCode": StationCode_list, "SampleTypeCode": SampleTypeCode_list, "SampleDate": SampleDate_list,
+              "ProgramName": ProgramName_list, "Analyte": Analyte_list, "MatrixName": MatrixName_list,
+              "CollectionReplicate": CollectionReplicate_list, "ResultsReplicate": ResultsReplicate_list,
+              "Datum": Datum_list, }
+###############################################################################
+##################        Dictionaries for QA codes above 		###############
+###############################################################################
 
 ###########################################################################################################################
 #########################        Dictionary of code fixer 	below	###########################
@@ -241,366 +323,678 @@ def DictionaryFixer(CodeColumns, filename ):
 #########################        Dictionary of code fixer 	above	###########################
 ###########################################################################################################################
 
-# data_retrieval is the meat of this script. It takes the tables dictionary defined above, two dates (specified
-# below), and a save location for the output files.
-def data_retrieval(tables, saveLocation, sep, extension, For_IR):
-	# initialize writtenFiles where we will store the output complete file paths in list format.
+# the WQX stations table has to be extracted before every other table since they look up the datum of each
+# station in it. data_retrieval runs it as its own stage before the rest of the tables.
+WQX_table = 'DM_WQX_Stations_MV'
+# commonly used string for filename creation.
+range_1950 = '_prior_to_1999'
+range_2000 = '_2000-2009'
+range_2010 = '_2010-present'
+# connecting to the DataMart is tried connectTries times. The first wait is connectBackoff seconds, every next one is
+# twice as long.
+connectTries = 5
+connectBackoff = 30.
+
+
+# DataMart_backend is the SWRCB internal DataMart (see CEDEN_Backend.py). Server, IUD, PWD are set as environmental
+# variables so no passwords are in plain text, see "Main" below for importing examples. Please be sure that you have
+# the 'ODBC Driver 11 for SQL Server' driver installed on your machine.
+def DataMart_backend():
+	return SQLServerBackend(SERVER1, uid=UID, pwd=PWD, tries=connectTries, backoff=connectBackoff)
+
+
+# DataMart_connect creates a connection to the SWRCB internal DataMart and a cursor that executes the sql statements.
+# It raises a ConnectionError when the DataMart can't be reached after connectTries tries.
+def DataMart_connect():
+	cnxn = DataMart_backend().connect()
+	# a python cursor is a synonym to a recordset or resultset.
+	return cnxn, cnxn.cursor()
+
+
+# date_range_of returns the key of the date divided files (see PartitionWriter in CEDEN_Partitions.py): the date
+# range a record goes in by its SampleDate year. Prior to 1999, 2000-2009, 2010-present
+def date_range_of(SampleDateSlot):
+	def date_range(record):
+		recordYear = int(record[SampleDateSlot][:4])
+		if recordYear < 2000:
+			return range_1950
+		elif recordYear < 2010:
+			return range_2000
+		return range_2010
+	return date_range
+
+
+# these lines remove the date divided files that are almost empty. A date range without records never gets a file,
+# but the ones with only a few records are not worth publishing either. So we erase them based on # of bytes which
+# is 2000
+def remove_empty_ranges(writtenFiles, filename):
+	for dateRange in (range_1950, range_2000, range_2010):
+		if filename + dateRange in writtenFiles and smaller_than(writtenFiles[filename + dateRange], 2000):
+			os.remove(writtenFiles[filename + dateRange])
+			writtenFiles.pop(filename + dateRange)
+
+
+# default_query is the TableQuery of a table that wasn't declared in data_retrieval's queries. It selects every
+# column but the data quality ones data_retrieval adds itself (COMPUTED_COLUMNS) and, except for the IR tables,
+# publishes TargetLatitude and TargetLongitude as Latitude and Longitude.
+def default_query(table, For_IR):
+	if table == WQX_table:
+		return TableQuery(table, rename=RENAME_TARGET)
+	if For_IR:
+		return TableQuery(table, exclude=COMPUTED_COLUMNS)
+	return TableQuery(table, exclude=COMPUTED_COLUMNS, rename=RENAME_TARGET)
+
+
+# extract_table queries one table of the tables dictionary with cursor, cleans every record, estimates its data
+# quality and writes the full dataset, the date divided datasets and the subsets of that table. WQX_Sites is the
+# station datum lookup (StationCode: Datum) used by every table but the IR and Benthic ones. For the WQX table
+# itself, WQX_Sites is filled with the stations as they are written. where limits the query to part of the table (see
+# CEDEN_Shards.py) and prune=False keeps the date divided files even if they are empty, for shards that are
+# stitched together later. query is the TableQuery of the table, the default one selects every column. reconnect
+# connects to the DataMart again and returns the new cursor (see Reconnecting in CEDEN_Reader.py), when the connection
+# drops the query is run again and the rows that were already written are skipped. writeBehind is how many batches
+# of records can wait for the writer thread (see CEDEN_Writer.py), 0 writes them on this thread. It returns the files
+# written, the sites found and the number of rows read.
+def extract_table(cursor, filename, table, saveLocation, sep, extension, For_IR, WQX_Sites=None, DQ_cacheSize=50000,
+                  subsets=(), arraysize=ARRAYSIZE, prefetch=True, autoTune=True, where=None,
+                  prune=True, query=None, reconnect=None, writeBehind=WRITE_DEPTH):
 	writtenFiles = {}
-	try:
-		# a python cursor is a synonym to a recordset or resultset.
-		# this is the connection to SWRCB internal DataMart. Server, IUD, PWD are set as environmental variables so
-		# no passwords are in plain text, see "Main" below for importing examples. UID
-		# below create a connection
-		# Please be sure that you have the 'ODBC Driver 11 for SQL Server' driver installed on your machine.
-		cnxn = pyodbc.connect(Driver='ODBC Driver 11 for SQL Server', Server=SERVER1, uid=UID, pwd=PWD)
-		# creates a cursor which will execute the sql statement
-		cursor = cnxn.cursor()
-	except:
-		print("Couldn't connect to %s. It is down or you might have a typo somewhere. Make sure you've got the "
-		      "right password and Server id. Check internet "
-		      "connection." % SERVER1)
-	# initialize an AllSites dictionary
 	AllSites = {}
+	rows = 0
 	# LAt/Long strings in variables
 	Latitude, Longitude = ['Latitude', 'Longitude', ]
-	# commonly used string for filename creation.
-	range_1950 = '_prior_to_1999'
-	range_2000 = '_2000-2009'
-	range_2010 = '_2010-present'
-	# This loop iterates on each item in the tables variable below
-	for count, (filename, table) in enumerate(tables.items()):
-		# creates and addes the full path of the file to be created for the full datasets as
-		# well as the date divided subsets. the filename_xx variables are used as part of the
-		# file writing process
-		writtenFiles[filename] = os.path.join(saveLocation, '%s%s' % (filename, extension))
-		filename_1950 = os.path.join(saveLocation, '%s%s' % (filename + range_1950, extension))
-		filename_2000 = os.path.join(saveLocation, '%s%s' % (filename + range_2000, extension))
-		filename_2010 = os.path.join(saveLocation, '%s%s' % (filename + range_2010, extension))
-		writtenFiles[filename + range_1950] = filename_1950
-		writtenFiles[filename + range_2000] = filename_2000
-		writtenFiles[filename + range_2010] = filename_2010
-		# Sine the WQX file has to be first, we use count == 0 as a way to filter these actions
-		# for the first iteration only. we want to grab the file path for the WQX file
-		if count == 0:
-			WQXfile = writtenFiles[filename]
-		##############################################################################
-		########################## SQL Statement  ####################################
-		##############################################################################
-		# The DM_WQX_Stations_MV table should not be filtered by date but the significant difference between this
-		# table and the others is that we are not calculating new fields a do not have to add columns. Also,
-		# benthic dataset does not need the Datum column
-		if table == 'DM_WQX_Stations_MV':
-			sql = "SELECT * FROM %s ;" % table
-			cursor.execute(sql)
-			columns = [desc[0].replace('TargetL', 'L') for desc in cursor.description]
+	# creates and addes the full path of the file to be created for the full datasets as
+	# well as the date divided subsets. the filename_xx variables are used as part of the
+	# file writing process
+	writtenFiles[filename] = os.path.join(saveLocation, '%s%s' % (filename, extension))
+	##############################################################################
+	########################## SQL Statement  ####################################
+	##############################################################################
+	# The DM_WQX_Stations_MV table should not be filtered by date but the significant difference between this
+	# table and the others is that we are not calculating new fields a do not have to add columns. Also,
+	# benthic dataset does not need the Datum column
+	# The columns, their published names and any filter are declared with a TableQuery (see CEDEN_Query.py)
+	if query is None:
+		query = default_query(table, For_IR)
+	# every value is passed through the printable filter, see CEDEN_Sanitizer.py
+	sanitizer = Sanitizer(printable)
+	# the time spent in each stage of the extraction, for the profile of the run (see CEDEN_Profile.py)
+	timing = TableTiming(filename, table, where)
+	since = time.perf_counter()
+
+	# requery runs the query again on a new connection, for the reader when the connection dropped
+	def requery():
+		newCursor = reconnect()
+		query.execute(newCursor, where)
+		return newCursor
+	if table == WQX_table:
+		columns = query.execute(cursor)
+	else:
+		columns = query.execute(cursor, where)
+		# IR tables do not have lat/long renamed
+		if For_IR:
+			Latitude, Longitude = ['TargetLatitude', 'TargetLongitude', ]
+		# Check to see if datum is in the column headers, add two new column names
+		if 'Datum' in columns:
+			columns += ['DataQuality'] + ['DataQualityIndicator']
 		else:
-			sql = "SELECT * FROM %s" % table
-			cursor.execute(sql)
-			# IR tables do not have lat/long renamed
-			if For_IR:
-				columns = [desc[0] for desc in cursor.description]
-				Latitude, Longitude = ['TargetLatitude', 'TargetLongitude', ]
-			else:
-				columns = [desc[0].replace('TargetL', 'L') for desc in cursor.description]
-			# Check to see if datum is in the column headers, add two new column names
-			if 'Datum' in columns:
-				columns += ['DataQuality'] + ['DataQualityIndicator']
+			columns += ['DataQuality'] + ['DataQualityIndicator'] + ['Datum']
+	timing.lap('query', since)
+	##############################################################################
+	########################## SQL Statement  ####################################
+	##############################################################################
+	# this is where we create a reader for each file in the "tables" variable
+	# using the filename iterable
+	# the files are compressed as they are written when the extension asks for it, see CEDEN_Compression.py
+	with open_output(writtenFiles[filename], buffering=WRITE_BUFFER, binary=True) as csvfile:
+		# we create a writer object which we will only call towards the very end of the data
+		# quality estimation. It writes what csv.writer did, see CEDEN_Serializer.py
+		writer = RecordWriter(csvfile, sep)
+		# we open a file and write the first row, the column names
+		writer.writerow(columns)
+		#########################
+		# if the table is the WQX stations table
+		if table == WQX_table:
+			# the position of the columns we need in each record, see CEDEN_Records.py
+			layout = RecordLayout(columns)
+			LongitudeSlot = layout.slot(Longitude)
+			if WQX_Sites is not None:
+				StationSlot, DatumSlot = layout.slot('StationCode'), layout.slot('Datum')
+			# rows are fetched in batches, the next batch is fetched while we work on this one. Each
+			# batch goes through one stage after the other so every stage can be timed, see
+			# CEDEN_Profile.py
+			reader = BatchedReader(cursor, arraysize=arraysize, prefetch=prefetch, autoTune=autoTune,
+			                       reconnect=requery if reconnect else None)
+			for batch in reader.iter_batches():
+				since = time.perf_counter()
+				records = []
+				for row in batch:
+					# we have to make a distinction between None, 'None', and ''
+					# 'None' and '' are used specifically in the datasets, but
+					# None gets translated to 'None' unless we replace it with
+					# '' explicitly. clean_row does that and strips all other invalid characters
+					# the cleaned row is the record we work on and write, no dictionary is made
+					record = layout.record(sanitizer.clean_row(row))
+					# Sometime the Longitude gets entered as 119 instead of -119...
+					# make sure Longitude value is negative and less than 10000 (could be projected)
+					try:
+						long = float(record[LongitudeSlot])
+						if 0. < long < 10000.0 :
+							record[LongitudeSlot] = -long
+					except ValueError:
+						pass
+					records.append(record)
+				since = timing.lap('sanitize', since)
+				# write the records to the WQX file
+				writer.writerows(records)
+				since = timing.lap('write', since)
+				# and add the stations to the station index the other tables use for their datum
+				if WQX_Sites is not None:
+					for record in records:
+						WQX_Sites[record[StationSlot]] = record[DatumSlot]
+				timing.lap('datum', since)
+			timing.finish(reader)
+			rows = reader.rows
+		else:
+			# if not WQX filename
+			# create a dictionary of code values specific to the filenames needs
+			# see Dictionary Fixer above
+			Mod_CodeColumns = DictionaryFixer(CodeColumns, filename)
+			# compile the data quality decision tree once for this table.
+			# DQ_cacheSize sets how many distinct QA code combinations are remembered.
+			DQ_plan = DataQualityPlan(Mod_CodeColumns, columns, table, DQ_Codes, cacheSize=DQ_cacheSize)
+			# open the subset files that come from this table (SafeToSwim, Pesticides, By_RB, ...)
+			tableSubsets = [subset for subset in subsets if subset.table == filename]
+			for subset in tableSubsets:
+				print("\tWriting data subset %s" % subset.newFileName)
+				subset.open(saveLocation, columns)
+			# the position of every column we need in a record, worked out once for the table. See
+			# CEDEN_Records.py
+			layout = RecordLayout(columns)
+			StationSlot, StationNameSlot = layout.slot('StationCode'), layout.slot('StationName')
+			LatitudeSlot, LongitudeSlot = layout.slot(Latitude), layout.slot(Longitude)
+			DatumSlot = layout.slot('Datum')
+			DataQualitySlot = layout.slot('DataQuality')
+			IndicatorSlot = layout.slot('DataQualityIndicator')
+			# the IR tables are not date divided. The date divided files are only created once a record goes in them,
+			# see CEDEN_Partitions.py
+			dateRanges = None
+			if not For_IR:
+				dateRanges = PartitionWriter(columns, date_range_of(layout.slot('SampleDate')),
+				                             lambda dateRange: os.path.join(saveLocation, '%s%s' % (filename + dateRange,
+				                                                                                    extension)), sep)
+			addDatum = not (For_IR or filename == 'BenthicData')
+			reader = BatchedReader(cursor, arraysize=arraysize, prefetch=prefetch, autoTune=autoTune,
+			                       reconnect=requery if reconnect else None)
+			# write_records writes a batch of records to the full file, the date divided files and the subsets. With
+			# writeBehind it runs on a thread of its own while the next batch is cleaned and scored (see
+			# CEDEN_Writer.py), the records of a batch aren't touched again once they are handed over.
+			def write_records(records):
+				writer.writerows(records)
+				for record in records:
+					if dateRanges is not None:
+						dateRanges.write(record)
+					# hand the record to each subset of this table, they only keep what they need
+					for subset in tableSubsets:
+						subset.route(record)
+			with WriteBehind(write_records, depth=writeBehind) as behind:
+				for batch in reader.iter_batches():
+					since = time.perf_counter()
+					records = []
+					for row in batch:
+						# see None, 'None' and '' above
+						# we have to make the record as long as columns since we add a column for
+						# datum, data quality and estimator, but sometimes only 2. layout.record pads
+						# the cleaned row with '' and the row becomes our record, no dictionary is made
+						record = layout.record(sanitizer.clean_row(row))
+						# make sure Longitude value is negative and less than 10000 (could be projected)
+						try:
+							long = float(record[LongitudeSlot])
+							if 0. < long < 10000.0 :
+								record[LongitudeSlot] = -long
+						except ValueError:
+							pass
+						records.append(record)
+					since = timing.lap('sanitize', since)
+					for record in records:
+						#####  IR and Benthic datasets do not need datum added  #####
+						# Everyone else ...
+						# check to see if the current record's station code is in the variable
+						# WQX_Sites and if it is, then store that datum value to our current record
+						# otherwise store 'NR' not recorded
+						if addDatum:
+							record[DatumSlot] = WQX_Sites.get(record[StationSlot], 'NR')
+						#####  ^^^^^^^^^^^^^^^^^^^^^  #####
+						# for each line that we process, all of the sites found in benthic, water chem,
+						# tissue, habitat, WQX, Toxicity we store the Stationname, Lat/Long and datum to
+						# this temporary thing called:
+						#                              AllSites
+						if record[StationSlot] not in AllSites:
+							AllSites[record[StationSlot]] = [record[StationNameSlot], record[LatitudeSlot],
+							                                 record[LongitudeSlot], record[DatumSlot], ]
+					since = timing.lap('datum', since)
+					############
+					# This is the begining of the data quality estimation. The DQ_plan was compiled
+					# from Mod_CodeColumns above and holds the whole decision tree. See
+					# CEDEN_DataQuality.py for the rules and what the DataQuality and
+					# DataQualityIndicator values mean.
+					for record in records:
+						DataQuality, DataQualityIndicator = DQ_plan.score(record)
+						record[DataQualitySlot] = DataQuality
+						if DataQualityIndicator is not None:
+							record[IndicatorSlot] = DataQualityIndicator
+					since = timing.lap('score', since)
+					# Now that we have something very special called
+					#
+					###############      record     ##############
+					#
+					# we write it to each of our open files... millions of times. See write_records above
+					behind.put(records)
+					timing.lap('write', since)
+			timing.finish(reader, behind if writeBehind else None)
+			rows = reader.rows
+			print("\tRead %d rows from %s in %d batches of up to %d rows" % (reader.rows, table,
+			                                                            reader.batches, reader.arraysize))
+			if dateRanges is not None:
+				dateFiles = dateRanges.close()
+				for dateRange in (range_1950, range_2000, range_2010):
+					if dateRange in dateFiles:
+						writtenFiles[filename + dateRange] = dateFiles[dateRange]
+			for subset in tableSubsets:
+				writtenFiles.update(subset.close())
+				print("\t\tFinished writing data subset %s (%d records)" % (subset.newFileName,
+				                                                            subset.rows))
+			print("\tData quality cache for %s: %d hits, %d misses" %
+			      (filename, DQ_plan.cache_stats()['hits'], DQ_plan.cache_stats()['misses']))
+	if prune:
+		remove_empty_ranges(writtenFiles, filename)
+	print("Finished data retrieval for the %s table%s" % (filename, ' (%s)' % where if where else ''))
+	return writtenFiles, AllSites, rows
+
+
+# the station index of the worker processes, see _init_worker
+shared_WQX_Sites = None
+# where the worker processes dump the cProfile statistics of their jobs for a deep profile, see _init_worker
+shared_profilePrefix = None
+# the connection of the worker process, kept from one job to the next, see _init_worker
+shared_connections = None
+
+
+# _init_worker runs once in each worker process of data_retrieval. On windows the workers import this script
+# fresh, without running "Main" below, so the backend (with the connection settings) and the printable filter are
+# handed over here. Each worker keeps its connection in a pool of one and uses it again for its next job.
+# The station index is handed over here as well, once per worker instead of once per table, and only read after.
+# previous are the hashes of the files of the last run, see keep_unchanged (CEDEN_Digests.py). profilePrefix is
+# not None when the run is profiled with cProfile, see RunProfile (CEDEN_Profile.py).
+def _init_worker(backend, printable_filter, WQX_Sites, previous, profilePrefix=None):
+	global printable, shared_WQX_Sites, shared_profilePrefix, shared_connections
+	shared_connections = ConnectionPool(backend, size=1)
+	printable = printable_filter
+	shared_WQX_Sites = WQX_Sites
+	shared_profilePrefix = profilePrefix
+	keep_unchanged(previous)
+
+
+# _extract_table_worker extracts a single table in a worker process with the connection of the worker. The
+# hashes of the files it wrote and the timing of the job are returned along with the result of extract_table.
+def _extract_table_worker(filename, table, saveLocation, sep, extension, For_IR, DQ_cacheSize, subsets,
+                          arraysize, prefetch, autoTune, where=None, prune=True, query=None, writeBehind=WRITE_DEPTH):
+	link = Reconnecting(shared_connections.connect)
+	options = dict(WQX_Sites=shared_WQX_Sites, DQ_cacheSize=DQ_cacheSize, subsets=subsets, arraysize=arraysize,
+	               prefetch=prefetch, autoTune=autoTune, where=where, prune=prune, query=query,
+	               reconnect=link.reconnect, writeBehind=writeBehind)
+	try:
+		if shared_profilePrefix:
+			result = profiled(shared_profilePrefix, extract_table, link.cursor, filename, table, saveLocation, sep,
+			                  extension, For_IR, **options)
+		else:
+			result = extract_table(link.cursor, filename, table, saveLocation, sep, extension, For_IR, **options)
+		return result, take_digests(), take_timings()
+	finally:
+		link.close()
+
+
+# data_retrieval is the meat of this script. It takes the tables dictionary defined above, two dates (specified
+# below), and a save location for the output files. subsets is a list of Subset and RegionPartitioner objects
+# (see CEDEN_Subsets.py) that get written while their table is being extracted. arraysize, prefetch and autoTune
+# control how rows are fetched from the DataMart (see CEDEN_Reader.py). writeBehind is how many batches of records
+# can wait to be written on the writer thread of each table, 0 writes them as they come (see CEDEN_Writer.py).
+#   The WQX stations table is extracted first, on its own, since every other table looks up its datum values in
+# it. The rest of the tables do not depend on each other. With workers greater than 1 they are extracted at the
+# same time in a pool of worker processes, each with its own connection, largest table first (see
+# CEDEN_Scheduler.py). historyFile is where the row counts of each run are kept for that ordering. The files and
+# sites are merged back in the order of the tables dictionary so the output is the same as a one worker run.
+#   shards is a dictionary of filename: number of shards for the tables that are too big for a single worker
+# (ie. {'WaterChemistryData': 4}). Those tables are split into ranges of shardKey that are extracted at the same
+# time and stitched back together (see CEDEN_Shards.py). Shards are only used when workers is greater than 1. The
+# records are the same as a run in one go, but a station with records in more than one shard gets the site of its
+# first record in the order of the shards, which can be another one than in a run in one go.
+# shardKey is the SampleDate year of each view by default, YEAR(SampleDate) or the last four characters of the
+# monthdayyear text dates of IR2018_WQ and IR2018_Tissue (see table_key). A shardKey given here is used for every table.
+#   incremental is a dictionary of filename: fingerprint for the tables that are refreshed incrementally (see
+# CEDEN_Incremental.py). Only the SampleDate years (shardKey) whose fingerprint changed since the last run are
+# extracted and merged into the existing files. stateFile keeps the fingerprints between runs and a table is
+# extracted in full again every fullRebuildDays days.
+#   queries is a dictionary of filename: TableQuery (see CEDEN_Query.py) that declares the columns to publish, their
+# names and a filter applied by the server for each table. Tables that are not in it get default_query. The column
+# names of each table are only asked for once per run.
+#   subsetOnly are the filenames of the tables that are only extracted for their subsets (see subset_query in
+# CEDEN_Subsets.py). The DataMart only sends the records of their subsets, the subset files are published but the
+# datasets of the table itself are written without being published. Their sites are the ones of the subset records.
+#   stationCache is the file where the station index is kept between runs (see CEDEN_Stations.py). When the
+# stations view hasn't changed since the last run, the WQX stations are not extracted again.
+#   parquet=True also writes a Parquet copy of every file once they are all finished (see CEDEN_Parquet.py). They
+# are returned in writtenFiles as well, ie. writtenFiles['WaterChemistryData.parquet'].
+#   manifest is a Manifest, where the content hash and number of records of every file are kept (see
+# CEDEN_Manifest.py). A file written again with the content it had in the last run is not replaced, so it keeps its
+# date.
+#   publish is a PublishQueue (see CEDEN_Publish.py). The files of each table are pushed on it as soon as the table
+# is finished, and uploaded in the background while the next tables are extracted.
+#   checkpointFile is where the tables and shards that are done are kept while the run goes on (see
+# CEDEN_Checkpoint.py). When a run dies, ie. the DataMart can't be reached anymore, the next run with the same
+# checkpointFile only extracts what is left. A job that fails in a worker doesn't stop the others, the run raises once
+# they are done.
+#   profile is a RunProfile (see CEDEN_Profile.py). The time of each phase of the run and of each stage of every
+# job are added to it, save it once the run is done.
+#   backend is the database the tables are read from (see CEDEN_Backend.py), the DataMart of SERVER1 by default. A
+# SQLiteBackend reads them from a SQLite file with the same tables instead. This process and every worker keep one
+# connection in a ConnectionPool for all of their tables and shards.
+def data_retrieval(tables, saveLocation, sep, extension, For_IR, DQ_cacheSize=50000, subsets=(),
+                   arraysize=ARRAYSIZE, prefetch=True, autoTune=True, workers=1, historyFile=None, shards=None,
+                   shardKey=None, incremental=None, stateFile=None, fullRebuildDays=7, queries=None,
+                   stationCache=None, parquet=False, manifest=None, publish=None, checkpointFile=None,
+                   profile=None, backend=None, writeBehind=WRITE_DEPTH, subsetOnly=()):
+	# fail now rather than after hours of extraction if pyarrow or zstandard is missing
+	if parquet:
+		require_pyarrow()
+	require_compression(extension)
+	previous = manifest.previous_digests() if manifest else {}
+	keep_unchanged(previous)
+	# the time of each phase of the run, the jobs time themselves (see TableTiming)
+	phases = {}
+	since = time.perf_counter()
+	take_timings()
+	# initialize writtenFiles where we will store the output complete file paths in list format.
+	writtenFiles = {}
+	queries = {filename: (queries or {}).get(filename) or default_query(table, For_IR)
+	           for filename, table in tables.items()}
+	# the datasets of the tables that are only extracted for their subsets are not published
+	hidden = set()
+	for filename in subsetOnly:
+		queries[filename] = subset_query(queries[filename], [subset for subset in subsets if subset.table == filename])
+		hidden.update(filename + name for name in ('', range_1950, range_2000, range_2010))
+	checkpoint = None
+	if checkpointFile:
+		checkpoint = Checkpoint(checkpointFile, {'sep': sep, 'extension': extension, 'For_IR': For_IR,
+		                                         'shardKey': shardKey})
+	backend = backend or DataMart_backend()
+	connections = ConnectionPool(backend, size=1)
+	# the connection is made again when it drops, link.cursor is always the one to use
+	link = Reconnecting(connections.connect)
+	# initialize an AllSites dictionary
+	AllSites = {}
+	# rows read from each table, kept in the history for the next run
+	counts = {}
+	# results of each table by filename, merged in the order of the tables dictionary at the end
+	results = {}
+	# the station index, StationCode: Datum, built while the WQX stations are written
+	WQX_Sites = {}
+
+	# finalized is called with the result of a table once its files won't change anymore
+	def finalized(filename):
+		tableFiles = published(results[filename][0], subsets, hidden)
+		if checkpoint:
+			checkpoint.table_done(filename, results[filename])
+		if manifest:
+			manifest.update(tableFiles.values())
+		if publish:
+			publish.push_files(tableFiles)
+
+	##### Stage 1: the WQX stations #####
+	for filename, table in tables.items():
+		if table == WQX_table:
+			WQXfile = os.path.join(saveLocation, '%s%s' % (filename, extension))
+			saved = checkpoint.table(filename) if checkpoint else None
+			if saved is not None:
+				print("The WQX stations were written before the last run stopped, reading the station index from %s"
+				      % WQXfile)
+				WQX_Sites = read_stations(WQXfile, sep)
+				results[filename] = saved
+				finalized(filename)
+				continue
+			fingerprint = stations_fingerprint(link.cursor, table, FINGERPRINT) if stationCache else None
+			cached = load_station_cache(stationCache, fingerprint, WQXfile)
+			if cached is not None:
+				print("The stations haven't changed since the last run, using the station index in %s" % stationCache)
+				WQX_Sites, rows = cached
+				results[filename] = ({filename: WQXfile}, {}, rows)
+				finalized(filename)
+				continue
+			results[filename] = extract_table(link.cursor, filename, table, saveLocation, sep, extension, For_IR,
+			                                  WQX_Sites=WQX_Sites, DQ_cacheSize=DQ_cacheSize, subsets=subsets,
+			                                  arraysize=arraysize, prefetch=prefetch, autoTune=autoTune,
+			                                  query=queries[filename], reconnect=link.reconnect)
+			save_station_cache(stationCache, fingerprint, WQXfile, WQX_Sites, results[filename][2])
+			finalized(filename)
+	# this is the barrier between the two stages. Nothing below starts until the WQX file is complete and the
+	# station index is built.
+	phases['stations'] = time.perf_counter() - since
+	since = time.perf_counter()
+	##### Stage 2: everything else #####
+	remaining = {filename: table for filename, table in tables.items() if table != WQX_table}
+	parallel = workers > 1 and len(remaining) > 1
+	order = list(remaining)
+	if parallel:
+		order = largest_first(remaining, table_counts(link.cursor, remaining, historyFile))
+		print("Extracting %d tables with %d workers in this order: %s" % (len(order), workers, ', '.join(order)))
+	# every table is planned as a list of extraction jobs of (save location, where clause, prune). A whole table is
+	# one job, a sharded table is one job per shard and an incremental table is one job for the years that changed
+	# since the last run, or no job at all if nothing changed. A run that resumes keeps the plan of the run it
+	# resumes.
+	jobs = {}
+	state = load_state(stateFile)
+	tableStates = {}
+	dirty = {}
+	for filename in order:
+		table = remaining[filename]
+		planned = checkpoint.plan(filename) if checkpoint else None
+		if planned is not None:
+			jobs[filename], dirtyYears, tableState = planned
+			if dirtyYears is not None:
+				dirty[filename] = dirtyYears
+			if tableState is not None:
+				tableStates[table] = tuple(tableState)
+			continue
+		jobs[filename] = [(saveLocation, None, True)]
+		key = table_key(table, shardKey)
+		if incremental and filename in incremental:
+			years = year_fingerprints(link.cursor, table, key, incremental[filename])
+			if not full_rebuild_due(state.get(table), key, incremental[filename], fullRebuildDays, saveLocation):
+				dirty[filename] = dirty_years(state[table]['years'], years)
+				print("%s changed in %d SampleDate years since the last run: %s" % (filename, len(dirty[filename]),
+				                                                                    ', '.join(dirty[filename])))
+				jobs[filename] = []
+				if dirty[filename]:
+					jobs[filename] = [(os.path.join(saveLocation, INCREMENTAL_FOLDER, filename),
+					                   year_clause(dirty[filename], key), False)]
+				tableStates[table] = (years, state[table]['full'])
+				continue
+			print("Full extraction of %s" % filename)
+			tableStates[table] = (years, datetime.now().strftime(DATE_FORMAT))
+		if parallel and shards and shards.get(filename, 1) > 1:
+			clauses = shard_clauses(split_histogram(histogram(link.cursor, table, key), shards[filename]), key)
+			if len(clauses) > 1:
+				# each shard writes to its own folder, they are put back together once they are all done
+				print("Splitting %s into %d shards on %s" % (filename, len(clauses), key))
+				jobs[filename] = [(shard_location(saveLocation, filename, shard), where, False)
+				                  for shard, where in enumerate(clauses)]
+	if checkpoint:
+		checkpoint.save_plans({filename: (jobs[filename], dirty.get(filename), tableStates.get(remaining[filename]))
+		                       for filename in order})
+	for filename in order:
+		for location, where, prune in jobs[filename]:
+			os.makedirs(location, exist_ok=True)
+	phases['planning'] = time.perf_counter() - since
+	since = time.perf_counter()
+	# the time spent putting the tables back together, it is taken out of the extraction
+	phases['finishing'] = 0.
+	# finish_table puts the jobs of a table back together once they are all done: the changed years are merged into
+	# the files of the last run, or the shards are stitched. Its files are final after that, they go in the manifest
+	# and on the publish queue so they are uploaded while the other tables are still being extracted.
+	def finish_table(filename, tableResults):
+		started = time.perf_counter()
+		table = remaining[filename]
+		if filename in dirty:
+			deltaFiles = tableResults[0][0] if tableResults else {}
+			# the records of a date divided file that was removed for being almost empty are gone, so records
+			# can't be merged into it
+			pruned = [filename + dateRange for dateRange in (range_1950, range_2000, range_2010)
+			          if filename + dateRange not in state[table]['files']]
+			tableFiles = merge_delta(state[table], deltaFiles, os.path.join(saveLocation, INCREMENTAL_FOLDER, filename),
+			                         saveLocation, sep, set(dirty[filename]), table in TEXT_DATES, pruned)
+			if tableFiles is None:
+				print("Falling back to a full extraction of %s" % filename)
+				results[filename] = extract_table(link.cursor, filename, table, saveLocation, sep, extension, For_IR,
+				                                  WQX_Sites=WQX_Sites, DQ_cacheSize=DQ_cacheSize, subsets=subsets,
+				                                  arraysize=arraysize, prefetch=prefetch, autoTune=autoTune,
+				                                  query=queries[filename], reconnect=link.reconnect,
+				                                  writeBehind=writeBehind)
+				tableStates[table] = (tableStates[table][0], datetime.now().strftime(DATE_FORMAT))
+			elif not dirty[filename] and 'sites' in state[table]:
+				# nothing changed, the sites and number of records of the last run still hold
+				results[filename] = (tableFiles, state[table]['sites'], state[table]['records'])
 			else:
-				columns += ['DataQuality'] + ['DataQualityIndicator'] + ['Datum']
-		##############################################################################
-		########################## SQL Statement  ####################################
-		##############################################################################
-		#initialize Sitecolumns
-		Sitecolumns = []
-		#  the First key in Tables must be the WQX_Stations. When count is 0, we do NOT read in
-		#  the WQX stations. If the script has already processed past WQX_Stations (count>0) then we read in the file
-		#  for accessing the datum associated with the station codes.
-		if count > 0 and not For_IR:
-			with open(WQXfile, 'r', newline='', encoding='utf8') as WQX_sites_reader:
-				WQX_Sites = {}
-				SitesCounter = 0
-				# we use the csv python module a lot here. It is standard and allows us to
-				# iterate over each line of a file.
-				reader = csv.reader(WQX_sites_reader, delimiter=sep, lineterminator='\n')
-				# we can treat "reader" like a list of every line in a file. That is how
-				# we iterate over the file
-				for row in reader:
-					# if this is the very first line of a file, it should be the headers
-					# Grab the headers and store them to SiteColumns
-					if SitesCounter == 0:
-						Sitecolumns = row
-						SitesCounter += 1
-					# create a dictionary of columns and the current row
-					# this way we can access each row's values by name
-					# we do this a lot in this file
-					SiterowDict = dict(zip(Sitecolumns, row))
-					# create a dictionary of station codes that return the datum value
-					WQX_Sites[SiterowDict['StationCode']] = SiterowDict['Datum']
-		if count == count:  ### Change back to  1 == 1:
-			# this is where we create a reader for each file in the "tables" variable
-			# using the filename iterable
-			with open(writtenFiles[filename], 'w', newline='', encoding='utf8') as csvfile:
-				# we open a file and write the first row with the DictWriter tool
-				dw = csv.DictWriter(csvfile, fieldnames=columns, delimiter=sep, lineterminator='\n')
-				dw.writeheader()
-				# we create a writer object which we will only call towards the very end of the data
-				# quality estimation
-				writer = csv.writer(csvfile, csv.QUOTE_MINIMAL, delimiter=sep, lineterminator='\n')
-				# here we create and open three additional files where we will write rows if the meet
-				# our logical criteria. Notice that the all have the columns variable and the dates
-				# refer to the general time division we are using. Prior to 1999, 2000-2009, 2010-present
-				with open(filename_1950, 'w', newline='', encoding='utf8') as csv1950:
-					dw1950 = csv.DictWriter(csv1950, fieldnames=columns, delimiter=sep, lineterminator='\n')
-					dw1950.writeheader()
-					writer1950 = csv.writer(csv1950, csv.QUOTE_MINIMAL, delimiter=sep, lineterminator='\n')
-					with open(filename_2000, 'w', newline='', encoding='utf8') as csv2000:
-						dw2000 = csv.DictWriter(csv2000, fieldnames=columns, delimiter=sep, lineterminator='\n')
-						dw2000.writeheader()
-						writer2000 = csv.writer(csv2000, csv.QUOTE_MINIMAL, delimiter=sep, lineterminator='\n')
-						with open(filename_2010, 'w', newline='', encoding='utf8') as csv2010:
-							dw2010 = csv.DictWriter(csv2010, fieldnames=columns, delimiter=sep,
-							                        lineterminator='\n')
-							dw2010.writeheader()
-							writer2010 = csv.writer(csv2010, csv.QUOTE_MINIMAL, delimiter=sep,
-							                        lineterminator='\n')
-							#########################
-							# if the table is the WQX stations table
-							if table == 'DM_WQX_Stations_MV':
-								for row in cursor:
-									# we have to make a distinction between None, 'None', and ''
-									# 'None' and '' are used specifically in the datasets, but
-									# None gets translated to 'None' unless we replace it with
-									# '' explicitly
-									row = [str(word) if word is not None else '' for word in row]
-									# strip all other invalid characters using decodeAndStrip definition
-									filtered = [decodeAndStrip(t) for t in list(row)]
-									# join the column list and the new filtered list
-									# to make a dictionary that we can use througout this script
-									recordDict = dict(zip(columns, filtered))
-									# Sometime the Longitude gets entered as 119 instead of -119...
-									# make sure Longitude value is negative and less than 10000 (could be projected)
-									try:
-										long = float(recordDict[Longitude])
-										if 0. < long < 10000.0 :
-											recordDict[Longitude] = -long
-									except ValueError:
-										pass
-									# write the values of our recordDictionary to the WQX file
-									writer.writerow(list(recordDict.values()))
-							else:
-								# if not WQX filename
-								# create a dictionary of code values specific to the filenames needs
-								# see Dictionary Fixer above
-								Mod_CodeColumns = DictionaryFixer(CodeColumns, filename)
-								for row in cursor:
-									# see None, 'None' and '' above
-									filtered = [decodeAndStrip(t) if t is not None else '' for t in list(row)]
-									# we have to make columns and filtered the same length otherwise python
-									# just uses the shorter of the two. since we want to add a column for
-									# datum, data quality and estimator, but sometimes only 2, we use the while
-									# function to iterate
-									while len(columns) > len(filtered):
-										filtered += ['']
-									# create a dictionary of columns and our current file row!!
-									recordDict = dict(zip(columns, filtered))
-									# make sure Longitude value is negative and less than 10000 (could be projected)
-									try:
-										long = float(recordDict[Longitude])
-										if 0. < long < 10000.0 :
-											recordDict[Longitude] = -long
-									except ValueError:
-										pass
-									#####  IR and Benthic datasets do not need datum added  #####
-									if For_IR or filename == 'BenthicData':
-										pass
-									# Everyone else ...
-									# check to see if the current record's station code is in the variable
-									# WQX_Sites and if it is, then store that datum value to our current record
-									# otherwise store 'NR' not recorded
-									else:
-										if recordDict['StationCode'] in WQX_Sites:
-											recordDict['Datum'] = WQX_Sites[recordDict['StationCode']]
-										else:
-											recordDict['Datum'] = 'NR'
-									#####  ^^^^^^^^^^^^^^^^^^^^^  #####
-									DQ = []
-									############
-									# This is the begining of the data quality estimation
-									# for each list in the modified dictionary of QA codes
-									for codeCol in list(Mod_CodeColumns):
-										# if the list is QACode
-										if codeCol == 'QACode':
-											# for each value in the specific record
-											# split the value up by commas and return a list
-											# ie.  codeVal may be 'QAC,DNR,LOB' which is a string
-											# this would return ['QAC', 'DNR', 'LOB'] which is an iterable list
-											for codeVal in recordDict[codeCol].split(','):
-												# if QAC or DNR or LOB is in the QACode list
-												if codeVal in list(Mod_CodeColumns[codeCol]):
-													# add that numerical value to a temporary variable called "DQ"
-													DQ += [Mod_CodeColumns[codeCol][codeVal]]
-												# For this example record, QAC DNR and LOB would each add a
-												# numerical value to DQ. DQ might be [2, 3, 1]
-												# we continue to use DQ to collect all of the numberical values as we
-												#  iterate through all of the lists in Mod_CodeColumns
-										if codeCol == 'StationCode':
-											# if a record has 000NONPJ or any variants in the StationCode value,
-											# than add 0 to DQ.
-											# elif any values are in the StationCode list, add those values to DQ.
-											if bool(re.search('000NONPJ', recordDict[codeCol])):
-												DQ += [0]
-											elif codeVal in list(Mod_CodeColumns[codeCol]):
-												DQ += [Mod_CodeColumns[codeCol][codeVal]]
-										elif codeCol == 'Analyte' or codeCol == 'AnalyteName':
-											# search for surrogate and mark DQ with a 0
-											if bool(re.search('[Ss]urrogate', recordDict[codeCol])):
-												DQ += [0]
-										elif codeCol == 'ResultQualCode' or codeCol == 'ResQualCode':
-											for codeVal in [recordDict[codeCol]]:
-												# Special Rules
-												# for both IR2018_WQ and IR2018_Tissue, if the ResultQualCode has a
-												# DNQ, then we have to make sure the year is less than 2008 but
-												# dates for these datasets were reported as monthdayyear, so we need
-												# the last 4. If the year is less than 2008, we mark DQ with a reject
-												# number. If it is greater than 2008, we mark it with a pass value
-												if table == 'IR2018_WQ' or table == 'IR2018_Tissue' and codeVal == 'DNQ':
-													yearTest = int(recordDict['SampleDate'][-4:])
-													if isinstance(yearTest, int) and yearTest < 2008:
-														DQ += [6]
-														#add rule identifier so that we seen the quality indicator reflect this rule
-												elif codeVal == 'DNQ' and int(recordDict['SampleDate'][:4]) < 2008:
-													#### add rule identifier so that we seen the quality indicator reflect this rule
-													DQ += [6]
-												elif codeVal == 'ND':
-													# the Benthic dataset can have an ND value as long as the result
-													# is not positive. Record is a pass if less than or equal to zero
-													# reject if result is positive
-													try:
-														RQC = recordDict['Result']
-														if not isinstance(RQC, str) and RQC > 0:
-															DQ += [6]
-														else:
-															DQ += [1]
-													except KeyError:
-														DQ += [1]
-												elif codeVal in list(Mod_CodeColumns[codeCol]):
-													# End of Special Rules for ResultQualCode
-													# check each value an add numerical key to DQ
-													DQ += [Mod_CodeColumns[codeCol][codeVal]]
-										elif codeCol == 'Result':
-											# for the Result we just need to make sure that results can be empty if
-											# ND is the ResultQualCode or ResQualCode
-											# yes they have different names and yes I should have made a more generic
-											#  search for these terms.
-											#
-											for codeVal in recordDict[codeCol]:
-												if codeVal == '':
-													if 'ResultQualCode' in recordDict.keys():
-														if 'ND' == recordDict['ResultQualCode']:
-															DQ += [1]
-													if 'ResQualCode' in recordDict.keys():
-														if 'ND' == recordDict['ResQualCode']:
-															DQ += [1]
-												else:
-													if codeVal in list(Mod_CodeColumns[codeCol]):
-														DQ += [Mod_CodeColumns[codeCol][codeVal]]
-										else:
-											# for all other non Special Rules, check each values in the record column
-											#  to see if its in the dictionary of QA codes. if it is in the
-											# apropriate list, then add the numerical code to DQ
-											for codeVal in [recordDict[codeCol]]:
-												if codeVal in list(Mod_CodeColumns[codeCol]):
-													DQ += [Mod_CodeColumns[codeCol][codeVal]]
-									try:
-										# we get the max value of DQ
-										MaxDQ = max(DQ)
-									except ValueError:
-										# if DQ doesn't have any values, it means that it slipped through the cracks
-										# and is some kind of an error. Check it out
-										MaxDQ = 7
-										DQ += [MaxDQ, ]
-									## This marks the beginning of the Quality indicator column value generator
-									QInd = []
-									# now that we have DQ with all of the numerical codes that can up for that record...
-									for codeCol in list(Mod_CodeColumns.keys()):
-										# make sure codeValList is empty
-										codeValList = []
-										ValuesEqMaxDQ = []
-										# get the record specific values from each QA list and store
-										# them to codeValList
-										if codeCol == 'QACode':
-											codeValList = recordDict[codeCol].split(',')
-										else:
-											codeValList = [recordDict[codeCol], ]
-										# for each code in our new list for this particular record, we check to see
-										# if the corresponding numerical code value is equal to the max value of DQ.
-										# If it is we save the particular code to ValuesEqMaxDQ. IfValuesEqMaxDQ
-										# isn't empty, we save the QA code list name with the offending values to "QInd"
-										for codeVal in codeValList:
-											# This part is tricky.
-											if codeVal in Mod_CodeColumns[codeCol] and MaxDQ == int(Mod_CodeColumns[codeCol][codeVal]):
-												ValuesEqMaxDQ += [codeVal, ]
-										if not ValuesEqMaxDQ == []:
-											QInd += [codeCol + ':' + ','.join(str(instance) for instance in ValuesEqMaxDQ)]
-									# A word about that DQ variable.
-									# DQ might host a long list of numbers but if there is ever a zero, that whole
-									# record should be classified as a QC record. If there isnt a zero and the
-									# maximum value is a 1, then that record passed our data quality estimate
-									# unblemished. If there isn't a zero and the max DQ values is greater than 1,
-									# then ... we get the max value and store the corresponding value (from the
-									# DQ_Codes dictionary, defined above). If the Max DQ is 6 (which is a reject
-									# record) and QInd is empty, then this is a special rule case and we label it as
-									# such. Otherwise, we throw all of the QInd information into the Quality
-									# indicator column. QInd might look like:
-									#   ['ResQualCode:npr,kqed', 'BatchVerificationCode:lol,btw,omg', ]
-									# and the this gets converted and stored into the records new column called Data
-									# Quality indicator a:
-									# 'ResQualCode:npr,kqed; BatchVerificationCode:lol,btw,omg'
-									if min(DQ) == 0:
-										recordDict['DataQuality'] = DQ_Codes[0]
-									elif max(DQ) == 1:
-										recordDict['DataQuality'] = DQ_Codes[1]
-									else:
-										recordDict['DataQuality'] = DQ_Codes[MaxDQ]
-										if MaxDQ == 6 and QInd == []:
-											recordDict['DataQualityIndicator'] = 'ResultQualCode Special Rules'
-										else:
-											recordDict['DataQualityIndicator'] = '; '.join(str(ColVal) for ColVal in QInd)
-									# Now that we have something very special called
-									#
-									###############      recordDict     ##############
-									#
-									# we write its values to each of our open files... millions of times.
-									if not For_IR:
-										recordYear = int(recordDict['SampleDate'][:4])
-										if recordYear < 2000:
-											writer1950.writerow(list(recordDict.values()))
-										elif 1999 < recordYear < 2010:
-											writer2000.writerow(list(recordDict.values()))
-										elif recordYear > 2009:
-											writer2010.writerow(list(recordDict.values()))
-									writer.writerow(list(recordDict.values()))
-									# for each line that we process, all of the sites found in benthic, water chem,
-									# tissue, habitat, WQX, Toxicity we store the Stationname, Lat/Long and datum to
-									# this temporary thing called:
-									#                              AllSites
-									if recordDict['StationCode'] not in AllSites:
-										AllSites[recordDict['StationCode']] = [recordDict['StationName'],
-										                                       recordDict[Latitude], recordDict[Longitude],
-										                                       recordDict['Datum'], ]
-				# these lines remove files that do not have anything but headers
-				# Sometimes we create empty files to hold data but nothing ends up
-				# going into them. So we erase them based on # of bytes which is 2000
-				if os.stat(filename_1950).st_size < 2000:
-					os.remove(filename_1950)
-					writtenFiles.pop(filename + range_1950)
-				if os.stat(filename_2000).st_size < 2000:
-					os.remove(filename_2000)
-					writtenFiles.pop(filename + range_2000)
-				if os.stat(filename_2010).st_size < 2000:
-					os.remove(filename_2010)
-					writtenFiles.pop(filename + range_2010)
-				print("Finished data retrieval for the %s table" % filename)
+				remove_empty_ranges(tableFiles, filename)
+				if For_IR:
+					tableSites = read_sites(tableFiles[filename], sep, 'TargetLatitude', 'TargetLongitude')
+				else:
+					tableSites = read_sites(tableFiles[filename], sep, 'Latitude', 'Longitude')
+				# the records of the changed years are put at the end of the merged file. A station that was already
+				# in the table keeps the values of the last run rather than those of its first record in that file.
+				lastSites = state[table].get('sites', {})
+				tableSites = {StationCode: lastSites.get(StationCode, site) for StationCode, site in tableSites.items()}
+				results[filename] = (tableFiles, tableSites, count_records(tableFiles[filename]))
+				print("Merged the changed years into the %s table" % filename)
+		elif len(jobs[filename]) > 1:
+			tableFiles = stitch_shards([result[0] for result in tableResults],
+			                           [location for location, where, prune in jobs[filename]], saveLocation, sep)
+			remove_empty_ranges(tableFiles, filename)
+			# the first site of each station in the order of the shards, see stitch_shards
+			tableSites = {}
+			for result in tableResults:
+				for StationCode, site in result[1].items():
+					if StationCode not in tableSites:
+						tableSites[StationCode] = site
+			results[filename] = (tableFiles, tableSites, sum(result[2] for result in tableResults))
+			print("Stitched the %d shards of the %s table" % (len(tableResults), filename))
+		else:
+			results[filename] = tableResults[0]
+		finalized(filename)
+		phases['finishing'] += time.perf_counter() - started
+
+	# the results of the jobs that are done, by table and job number. A run that resumes starts with the tables and
+	# jobs of the checkpoint.
+	done = {filename: {} for filename in order}
+	if checkpoint:
+		for filename in order:
+			saved = checkpoint.table(filename)
+			if saved is not None:
+				results[filename] = saved
+				finalized(filename)
+				continue
+			for number in range(len(jobs[filename])):
+				saved = checkpoint.job(filename, number)
+				if saved is not None:
+					done[filename][number] = saved
+
+	# job_done keeps the result of a job, the table is finished once all of its jobs are done
+	def job_done(filename, number, result):
+		done[filename][number] = result
+		if checkpoint:
+			checkpoint.job_done(filename, number, result)
+		if len(done[filename]) == len(jobs[filename]):
+			finish_table(filename, [done[filename][number] for number in range(len(jobs[filename]))])
+
+	# tables with nothing left to extract (no year changed, or all of their jobs are in the checkpoint) are finished
+	# right away
+	for filename in order:
+		if filename not in results and len(done[filename]) == len(jobs[filename]):
+			finish_table(filename, [done[filename][number] for number in range(len(jobs[filename]))])
+	if parallel:
+		failed = []
+		with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+		                         initargs=(backend, printable, WQX_Sites, previous,
+		                                   profile.worker_prefix() if profile else None)) as pool:
+			futures = {}
+			for filename in order:
+				if filename in results:
+					continue
+				tableSubsets = [subset for subset in subsets if subset.table == filename]
+				# the workers get the column names with the query instead of each asking the DataMart for them
+				queries[filename].columns(link.cursor)
+				for number, (location, where, prune) in enumerate(jobs[filename]):
+					if number not in done[filename]:
+						futures[pool.submit(_extract_table_worker, filename, remaining[filename], location, sep,
+						                    extension, For_IR, DQ_cacheSize, tableSubsets, arraysize, prefetch,
+						                    autoTune, where, prune, queries[filename], writeBehind)] = (filename, number)
+			# a table is finished as soon as its last job is done, whatever the order. A job that failed doesn't stop
+			# the others, what they did is kept in the checkpoint.
+			for future in as_completed(futures):
+				filename, number = futures[future]
+				try:
+					result, digests, timings = future.result()
+				except Exception as error:
+					print("Extracting %s (job %d) failed: %r" % (filename, number, error))
+					failed += [error]
+					continue
+				record_digests(digests)
+				record_timings(timings)
+				job_done(filename, number, result)
+		if failed:
+			link.close()
+			connections.close()
+			raise failed[0]
+	else:
+		for filename in order:
+			if filename in results:
+				continue
+			for number, (location, where, prune) in enumerate(jobs[filename]):
+				if number not in done[filename]:
+					job_done(filename, number, extract_table(link.cursor, filename, remaining[filename], location,
+					                                         sep, extension, For_IR, WQX_Sites=WQX_Sites,
+					                                         DQ_cacheSize=DQ_cacheSize, subsets=subsets,
+					                                         arraysize=arraysize, prefetch=prefetch,
+					                                         autoTune=autoTune, where=where, prune=prune,
+					                                         query=queries[filename], reconnect=link.reconnect,
+					                                         writeBehind=writeBehind))
+	link.close()
+	connections.close()
+	phases['extraction'] = time.perf_counter() - since - phases['finishing']
+	# merge in the order of the tables dictionary. The first table a station shows up in sets its AllSites values.
+	for filename, table in tables.items():
+		tableFiles, tableSites, counts[table] = results[filename]
+		writtenFiles.update(published(tableFiles, subsets, hidden))
+		for StationCode, site in tableSites.items():
+			if StationCode not in AllSites:
+				AllSites[StationCode] = site
+	save_history(historyFile, counts)
+	# the fingerprints are the ones from before the extraction. Records loaded while it ran show up next time.
+	for filename, table in remaining.items():
+		if table in tableStates:
+			years, full = tableStates[table]
+			tableFiles, tableSites, records = results[filename]
+			tableStates[table] = table_state(years, table_key(table, shardKey), incremental[filename], tableFiles,
+			                                 saveLocation, full, tableSites, records)
+	save_state(stateFile, tableStates)
+	if parquet:
+		since = time.perf_counter()
+		writtenFiles.update(parquet_siblings(writtenFiles, sep, extension, workers=workers))
+		phases['parquet'] = time.perf_counter() - since
+	if profile:
+		profile.record(phases, take_timings())
+	# the run is complete, the next one starts from scratch
+	if checkpoint:
+		checkpoint.clear()
 	return writtenFiles, AllSites
 
 ####################################################################################
@@ -608,8 +1002,10 @@ def data_retrieval(tables, saveLocation, sep, extension, For_IR):
 ####################################################################################
 
 # this is a tool to subset the main CEDEN datasets using the Analyte column ( or whatever column you specify)
+# parquet=True also writes a Parquet copy of the subset (and of its sites file), see CEDEN_Parquet.py
+# publish is a PublishQueue (see CEDEN_Publish.py), the subset and its sites file are pushed on it once written
 def selectByAnalyte(path, fileName, analytes, newFileName, field_filter, sep,
-                    For_IR=False):
+                    For_IR=False, parquet=False, publish=None):
 	# we create a variable that store the entire path of the input file
 	file = os.path.join(path, fileName)
 	# we create a variable that store the entire path of the output file
@@ -617,44 +1013,48 @@ def selectByAnalyte(path, fileName, analytes, newFileName, field_filter, sep,
 	# we initialize the Analyte_Sites and columns so we can store stuff in it
 	Analyte_Sites = {}
 	columns = []
+	# a set makes the "in analytes" test a hash lookup instead of a scan through the list
+	analytes = frozenset(analytes)
 	# the IR tables use TargetLat/Long while we renamed the other tables.
 	if For_IR:
 		Latitude, Longitude = ['TargetLatitude', 'TargetLongitude', ]
 	else:
 		Latitude, Longitude = ['Latitude', 'Longitude', ]
 	# using with open..... again
-	with open(file, 'r', newline='', encoding='utf8') as txtfile:
+	with open_input(file) as txtfile:
 		reader = csv.reader(txtfile, delimiter=sep, lineterminator='\n')
-		with open(fileOut, 'w', newline='', encoding='utf8') as txtfileOut:
+		with open_output(fileOut) as txtfileOut:
 			writer = csv.writer(txtfileOut, csv.QUOTE_MINIMAL, delimiter=sep, lineterminator='\n')
-			count = 0
+			# the csv reader only gives strings, so the rows are used as they are. The header tells where each
+			# column is. A repeated name takes the value of its last column.
+			columns = next(reader, None)
+			if columns is not None:
+				writer.writerow(columns)
+				sources = {name: i for i, name in enumerate(columns)}
+				filterIndex = sources[field_filter]
+				siteIndices = [sources[name] for name in ('StationCode', 'StationName', Latitude, Longitude, 'Datum')]
 			for row in reader:
-				row = [str(word) if word is not None else '' for word in row]
-				if count == 0:
-					columns = row
-					writer.writerow(row)
-					count += 1
-					continue
-				rowDict = dict(zip(columns, row))
 				# here is the magic of this whole definition
 				# field_filter is how we extract the current records analyte and see if it is in the
 				# analytes list. If it is in the list then we write the row to fileout.
 				# we also add that row's location information to a Analyte_Sites variable
-				if rowDict[field_filter] in analytes:
+				if row[filterIndex] in analytes:
 					writer.writerow(row)
-					if rowDict['StationCode'] not in Analyte_Sites:
-						Analyte_Sites[rowDict['StationCode']] = [rowDict['StationName'], rowDict[Latitude],
-						                                         rowDict[Longitude], rowDict['Datum']]
+					StationCode, StationName, Lat, Long, Datum = [row[i] for i in siteIndices]
+					if StationCode not in Analyte_Sites:
+						Analyte_Sites[StationCode] = [StationName, Lat, Long, Datum]
+	if parquet:
+		write_parquet(fileOut, sep)
+	if publish:
+		publish.push(newFileName, fileOut)
 	# IR tables don't need a sites file
 	if not For_IR:
 		Sites = os.path.join(path, 'Sites_for_' + newFileName)
-		with open(Sites, 'w', newline='', encoding='utf8') as Sites_Out:
-			Sites_writer = csv.writer(Sites_Out, csv.QUOTE_MINIMAL, delimiter=sep, lineterminator='\n')
-			AllSites_dw = csv.DictWriter(Sites_Out, fieldnames=['StationName', 'SiteCode', 'Latitude', 'Longitude',
-			                                                    'Datum'], delimiter=sep, lineterminator='\n')
-			AllSites_dw.writeheader()
-			for key, value in Analyte_Sites.items():
-				Sites_writer.writerow([value[0], key, value[1], value[2], value[3]])
+		write_Sites(Sites, Analyte_Sites, sep)
+		if parquet:
+			write_parquet(Sites, sep)
+		if publish:
+			publish.push('Sites_for_' + newFileName, Sites)
 		return newFileName, fileOut, 'Sites_for_' + newFileName, Sites
 	else:
 		return newFileName, fileOut, 'Sites_for_' + newFileName
@@ -677,7 +1077,7 @@ if __name__ == "__main__":
 	For_IR = True
 	#  This is the filter that every cell in each dataset gets passed through. From the "string" library, we are only
 	# allowing printable characters except pipes, quotes, tabs, returns, control breaks, etc.
-	printable = set(string.printable) - set('|\"\t\r\n\f\v')
+	printable = printable_for('CEDEN')
 	# What type of delimiter should files have? "|" or "\t" are common
 	if not For_IR:
 		sep = ','
@@ -685,6 +1085,10 @@ if __name__ == "__main__":
 	else:
 		sep = '\t'
 		extension = '.txt'
+	# Compress the files as they are written? '' writes plain files, '.gz' gzip and '.zst' zstd (needs the zstandard
+	# library). The compressed files are what gets uploaded, see CEDEN_Compression.py
+	compression = ''
+	extension += compression
 	print('\n\n\n\n')
 	# This is the SWRCB internal server set as a local environmental variable for the user.
 	# Save the server address to the SERVER1 environmental variable for your account.
@@ -697,75 +1101,15 @@ if __name__ == "__main__":
 	# Choose a location to write files locally.
 	### you can change this to point to a different location but it does automatically get your user information.
 	first = 'C:\\Users\\%s\\Documents' % getpass.getuser()
-	# All output files will be saved in this folder
-	saveLocation = os.path.join(first, 'CEDEN_Datasets')
+	# All output files will be saved in this folder, or in the one of the CEDEN_SaveLocation environmental variable
+	# if it is set (ie. for WorkingScripts\Test_DataRefresh.py)
+	saveLocation = os.environ.get('CEDEN_SaveLocation') or os.path.join(first, 'CEDEN_Datasets')
 	if not os.path.isdir(saveLocation):
 		print('\tCreating the CEDEN_DataMart folder for datasets as \n\t\t%s\n' % saveLocation)
 		os.mkdir(saveLocation)
-	###############################################################################
-	##################        Dictionaries for QA codes below 		###############
-	###############################################################################
-	# The following python dictionaries refer to codes and their corresponding data quality value as determined by
-	# Melissa Morris of SWRCB, Office of Information Management and Analysis. 0: QC record, 1: Passed QC, 2: Needs some
-	# review, 3: Spatial Accuracy Unknown, 4: Needs extensive review, 5: unknown data quality, 6: reject data record  (as
-	#  of 1/22/18)
-	QA_Code_list = {"AWM": 1, "AY": 2, "BB": 2, "BBM": 2, "BCQ": 1, "BE": 2, "BH": 1, "BLM": 4, "BRKA": 2, "BS": 2,
-	                "BT": 6, "BV": 4, "BX": 4, "BY": 4, "BZ": 4, "BZ15": 2, "C": 1, "CE": 4, "CIN": 2, "CJ": 2, "CNP": 2,
-	                "CQA": 1, "CS": 2, "CSG": 2, "CT": 2, "CVH": 1, "CVHB": 4, "CVL": 1, "CVLB": 4, "CZM": 2, "D": 1,
-	                "DB": 2, "DBLOD": 2, "DBM": 2, "DF": 2, "DG": 1, "DO": 1, "DRM": 2, "DS": 1, "DT": 1, "ERV": 4, "EUM": 4,
-	                "EX": 4, "F": 2, "FCL": 2, "FDC": 2, "FDI": 2, "FDO": 6, "FDP": 2, "FDR": 1, "FDS": 1, "FEU": 6, "FIA": 6,
-	                "FIB": 4, "FIF": 6, "FIO": 4, "FIP": 4, "FIT": 2, "FIV": 6, "FLV": 6, "FNM": 6, "FO": 2, "FS": 6, "FTD": 6,
-	                "FTT": 6, "FUD": 6, "FX": 4, "GB": 2, "GBC": 4, "GC": 1, "GCA": 1, "GD": 1, "GN": 4, "GR": 4, "H": 2, "H22": 4,
-	                "H24": 4, "H8": 2, "HB": 2, "HD": 4, "HH": 2, "HNO2": 2, "HR": 1, "HS": 4, "HT": 1, "IE": 2, "IF": 2, "IL": 4,
-	                "ILM": 2, "ILN": 2, "ILO": 2, "IM": 2, "IP": 4, "IP5": 4, "IPMDL2": 4, "IPMDL3": 4, "IPRL": 4, "IS": 4,
-	                "IU": 4, "IZM": 2, "J": 2, "JA": 2, "JDL": 2, "LB": 2, "LC": 4, "LRGN": 6, "LRIL": 6, "LRIP": 6, "LRIU": 6,
-	                "LRJ": 6, "LRJA": 6, "LRM": 6, "LRQ": 6, "LST": 6, "M": 2, "MAL": 1, "MN": 4, "N": 2, "NAS": 2, "NBC": 2,
-	                "NC": 1, "NG": 1, "NMDL": 1, "None": 1, "NR": 5, "NRL": 1, "NTR": 1, "OA": 2, "OV": 2, "P": 4, "PG": 4,
-	                "PI": 4, "PJ": 1, "PJM": 1, "PJN": 1, "PP": 4, "PRM": 4, "Q": 4, "QAX": 1, "QG": 4, "R": 6, "RE": 1, "REL": 1,
-	                "RIP": 6, "RIU": 6, "RJ": 6, "RLST": 6, "RPV": 4, "RQ": 2, "RU": 4, "RY": 4, "SC": 1, "SCR": 2, "SLM": 1, "TA": 4,
-	                "TAC": 1, "TC": 4, "TCI": 4, "TCT": 4, "TD": 4, "TH": 4, "THS": 4, "TK": 4, "TL": 2, "TNC": 2, "TNS": 1, "TOQ": 4,
-	                "TP": 4, "TR": 6, "TS": 4, "TW": 2, "UF": 2, "UJ": 2, "UKM": 4, "ULM": 4, "UOL": 2, "VCQ": 2, "VQN": 2, "VC": 2,
-	                "VBB": 2, "VBS": 2, "VBY": 4, "VBZ": 4, "VBZ15": 2, "VCJ": 2, "VCO": 2, "VCR": 2, "VD": 1, "VDO": 1, "VDS": 1,
-	                "VELB": 1, "VEUM": 4, "VFDP": 2, "VFIF": 6, "VFNM": 6, "VFO": 2, "VGB": 2, "VGBC": 4, "VGN": 4, "VH": 2, "VH24": 4,
-	                "VH8": 2, "VHB": 2, "VIE": 2, "VIL": 4, "VILN": 4, "VILO": 2, "VIP": 4, "VIP5": 4, "VIPMDL2": 4, "VIPMDL3": 4,
-	                "VIPRL": 4, "VIS": 4, "VIU": 4, "VJ": 2, "VJA": 2, "VLB": 2, "VLMQO": 2, "VM": 2, "VNBC": 2, "VNC": 1, "VNMDL": 1,
-	                "VNTR": 1, "VPJM": 1, "VPMQO": 2, "VQAX": 1, "VQCA": 4, "VQCP": 4, "VR": 6, "VRBS": 6, "VRBZ": 6, "VRDO": 6,
-	                "VRE": 1, "VREL": 1, "VRGN": 6, "VRIL": 6, "VRIP": 6, "VRIU": 6, "VRJ": 6, "VRLB": 6, "VRLST": 6, "VRQ": 2,
-	                "VRVQ": 6, "VS": 2, "VSC": 1, "VSCR": 2, "VSD3": 1, "VTAC": 1, "VTCI": 4, "VTCT": 4, "VTNC": 2, "VTOQ": 4, "VTR": 6,
-	                "VTW": 4, "VVQ": 6, "WOQ": 4,  }
-	BatchVerificationCode_list = {"NA": 5, "NR": 5, "VAC": 1, "VAC,VCN": 6, "VAC,VMD": 2, "VAC,VMD,VQI": 4,
-	                              "VAC,VQI": 4, "VAC,VR": 6, "VAF": 1, "VAF,VMD": 2, "VAF,VQI": 4, "VAP": 1,
-	                              "VAP,VI": 4, "VAP,VQI": 4, "VCN": 6, "VLC": 1, "VLC,VMD": 2, "VLC,VMD,VQI": 4,
-	                              "VLC,VQI": 4, "VLF": 1, "VMD": 2, "VQI": 4, "VQI,VTC": 4, "VQN": 5, "VR": 6, "VTC": 2}
-	ResultQualCode_list = {"/oC": 4, "<": 1, "<=": 1, "=": 1, ">": 1, ">=": 1, "A": 1, "CG": 4, "COL": 1, "DNQ": 1,
-	                       "JF": 1, "NA": 6, "ND": 1, "NR": 6, "NRS": 6, "NRT": 6, "NSI": 1, "P": 1, "PA": 1, "w/C": 4,
-	                       "": 1, "Systematic Contamination": 4, }
-	Latitude_list = {"-88": 0, "": 6, '0.0': 6, }
-	Result_list = {"": 1, }
-	StationCode_list = {"LABQA": 0, "LABQA_SWAMP": 0, "000NONPJ": 0, "FIELDQA": 0, "Non Project QA Sample": 0,
-	                    "Laboratory QA Sample": 0, "Field QA sample": 0, "FIELDQA SWAMP": 0, "000NONSW": 0, }
-	SampleTypeCode_list = {"LabBlank": 0, "CompBLDup": 0, "LCS": 0, "CRM": 0, "FieldBLDup_Grab": 0, "FieldBLDup_Int": 0,
-	                       "FieldBLDup": 0, "FieldBlank": 0, "TravelBlank": 0, "EquipBlank": 0, "DLBlank": 0,
-	                       "FilterBlank": 0, "MS1": 0, "MS2": 0, "MS3": 0, "MSBLDup": 0, }
-	ProgramName_list = {}
-	SampleDate_list = {"Jan  1 1950 12:00AM": 0, }
-	Analyte_list = {"Surrogate": 0, }
-	MatrixName_list = {"blankwater": 0, "Blankwater": 0, "labwater": 0, "blankmatrix": 0, }
-	CollectionReplicate_list = {"0": 1, "1": 1, "2": 0, "3": 0, "4": 0, "5": 0, "6": 0, "7": 0, "8": 0, }
-	ResultsReplicate_list = {"0": 1, "1": 1, "2": 0, "3": 0, "4": 0, "5": 0, "6": 0, "7": 0, "8": 0, }
-	Datum_list = {"NR": 3, }
-	DQ_Codes = {0: "MetaData", 1: "Passed", 2: "Some review needed", 3: "Spatial accuracy unknown",
-	            4: "Extensive review needed", 5: "Unknown data quality", 6: "Reject record", 7: 'Error in data'}
-	# the CodeColumns variable is a dictionary template for each dataset. Some datasets do not have all of these columns
-	# and as such have to be removed with the DictionaryFixer definition below.
-	CodeColumns = {"QACode": QA_Code_list, "BatchVerification": BatchVerificationCode_list,
-	              "ResultQualCode": ResultQualCode_list, "Latitude": Latitude_list, "Result": Result_list,
-	              "StationCode": StationCode_list, "SampleTypeCode": SampleTypeCode_list, "SampleDate": SampleDate_list,
-	              "ProgramName": ProgramName_list, "Analyte": Analyte_list, "MatrixName": MatrixName_list,
-	              "CollectionReplicate": CollectionReplicate_list, "ResultsReplicate": ResultsReplicate_list,
-	              "Datum": Datum_list, }
 	# This is a Python dictionary of filenames and their Datamart names. This can be expanded by adding to the end of
-	#  the list. The FIRST key in this dictionary MUST be WQX_Stations. If For_IR is set to False, it will complete the
+	#  the list. WQX_Stations is always extracted before the other tables, wherever it is in this dictionary, since
+	# they need its datum values. If For_IR is set to False, it will complete the
 	# normal weekly 5 tables. If For_IR is set to True, this script will complete the IR tables.
 	tables = {}  # initializes tables variable
 	if not For_IR:
@@ -778,21 +1122,199 @@ if __name__ == "__main__":
 		          "IR_ToxicityData": "IR2018_Toxicity", "IR_BenthicData": "IR2018_Benthic",
 		          "IR_STORET_2010": "IR2018_Storet_2010_2012", "IR_STORET_2012": "IR2018_Storet_2012_2017",
 		          "IR_NWIS": "IR2018_NWIS", "IR_Field": "IR2018_Field", "IR_TissueData": "IR2018_Tissue", }
-	###########################################################################################################################
-	#########################        Dictionaries for QA codes above		###############################################
-	###########################################################################################################################
+
+	############## Subsets of the WQ dataset  ###
+	# Subsets are declared here and written by data_retrieval while the WaterChemistryData table is being
+	# extracted, so the full dataset is not read back in for each one. Add a new Subset to the list to create
+	# another subset of any table. See CEDEN_Subsets.py
+	subsets = []
+	if not For_IR:
+		############## Subsets of WQ dataset for Safe To Swim  ###
+		SafeToSwim_analytes = ['E. coli', 'Enterococcus', 'Coliform, Total', 'Coliform, Fecal', ]
+		subsets += [Subset(newFileName='SafeToSwim' + extension, table='WaterChemistryData', field_filter='Analyte',
+		                   analytes=SafeToSwim_analytes, sep=sep), ]
+		############## Subsets of WQ dataset for Pesticides
+		Pesticides_analytes = ["Acetamiprid", "Acibenzolar-S-methyl", "Aldicarb", "Aldicarb ", "Aldicarb Sulfone",
+		                       "Aldicarb Sulfoxide", "Aldrin", "Aldrin, Particulate", "Allethrin", "Ametryn", "Aminocarb", "AMPA",
+		                       "Anilazine", "Aspon", "Atraton", "Atrazine", "Azinphos Ethyl", "Azinphos Methyl", "Azoxystrobin",
+		                       "Barban", "Bendiocarb", "Benfluralin", "Benomyl", "Bensulfuron Methyl", "Bentazon", "Bifenox",
+		                       "Bifenthrin", "Bispyribac Sodium", "Bolstar", "Bromacil", "Captafol", "Captan", "Carbaryl",
+		                       "Carbendazim", "Carbofuran", "Carbophenothion", "Carfentrazone Ethyl", "Chlorantraniliprole",
+		                       "Chlordane", "Chlordane, cis-", "Chlordane, cis-, Particulate", "Chlordane, Technical",
+		                       "Chlordane, trans-", "Chlordane, trans-, Particulate", "Chlordene, cis-", "Chlordene, trans-",
+		                       "Chlorfenapyr", "Chlorfenvinphos", "Chlorobenzilate", "Chlorothalonil", "Chlorpropham",
+		                       "Chlorpyrifos", "Chlorpyrifos Methyl", "Chlorpyrifos Methyl, Particulate",
+		                       "Chlorpyrifos Methyl/Fenchlorphos", "Chlorpyrifos, Particulate", "Cinerin-2", "Ciodrin",
+		                       "Clomazone", "Clothianidin", "Coumaphos", "Cyanazine", "Cyantraniliprole", "Cycloate", "Cyfluthrin",
+		                       "Cyfluthrin, beta-", "Cyfluthrin-1", "Cyfluthrin-2", "Cyfluthrin-3", "Cyfluthrin-4",
+		                       "Cyhalofop-butyl", "Cyhalothrin", "Cyhalothrin lambda-", "Cyhalothrin, gamma-",
+		                       "Cyhalothrin, lambda-1", "Cyhalothrin, lambda-2", "Cypermethrin", "Cypermethrin-1",
+		                       "Cypermethrin-2", "Cypermethrin-3", "Cypermethrin-4", "Cyprodinil", "Dacthal",
+		                       "Dacthal, Particulate", "DCBP(p,p')", "DDD(o,p')", "DDD(o,p'), Particulate", "DDD(p,p')",
+		                       "DDD(p,p'), Particulate", "DDE(o,p')", "DDE(o,p'), Particulate", "DDE(p,p')",
+		                       "DDE(p,p'), Particulate", "DDMU(p,p')", "DDMU(p,p'), Particulate", "DDT(o,p')",
+		                       "DDT(o,p'), Particulate", "DDT(p,p')", "DDT(p,p'), Particulate", "Deltamethrin",
+		                       "Deltamethrin/Tralomethrin", "Demeton", "Demeton-O", "Demeton-s", "Desethyl-Atrazine",
+		                       "Desisopropyl-Atrazine", "Diazinon", "Diazinon, Particulate", "Dichlofenthion", "Dichlone",
+		                       "Dichloroaniline, 3,5-", "Dichlorobenzenamine, 3,4-", "Dichlorophenyl Urea, 3,4-",
+		                       "Dichlorophenyl-3-methyl Urea, 3,4-", "Dichlorvos", "Dichrotophos", "Dicofol", "Dicrotophos",
+		                       "Dieldrin", "Dieldrin, Particulate", "Diflubenzuron", "Dimethoate", "Dioxathion", "Diphenamid",
+		                       "Diphenylamine", "Diquat", "Disulfoton", "Dithiopyr", "Diuron", "Endosulfan I",
+		                       "Endosulfan I, Particulate", "Endosulfan II", "Endosulfan II, Particulate", "Endosulfan Sulfate",
+		                       "Endosulfan Sulfate, Particulate", "Endrin", "Endrin Aldehyde", "Endrin Ketone",
+		                       "Endrin, Particulate", "EPN", "EPTC", "Esfenvalerate", "Esfenvalerate/Fenvalerate",
+		                       "Esfenvalerate/Fenvalerate-1", "Esfenvalerate/Fenvalerate-2", "Ethafluralin", "Ethion", "Ethoprop",
+		                       "Famphur", "Fenamiphos", "Fenchlorphos", "Fenhexamid", "Fenitrothion", "Fenpropathrin",
+		                       "Fensulfothion", "Fenthion", "Fenuron", "Fenvalerate", "Fipronil", "Fipronil Amide",
+		                       "Fipronil Desulfinyl", "Fipronil Desulfinyl Amide", "Fipronil Sulfide", "Fipronil Sulfone",
+		                       "Flonicamid", "Fluometuron", "Fluridone", "Flusilazole", "Fluvalinate", "Fluxapyroxad", "Folpet",
+		                       "Fonofos", "Glyphosate", "Halosulfuron Methyl", "HCH, alpha-", "HCH, alpha-, Particulate",
+		                       "HCH, beta-", "HCH, beta-, Particulate", "HCH, delta-", "HCH, delta-, Particulate", "HCH, gamma-",
+		                       "HCH, gamma-, Particulate", "Heptachlor", "Heptachlor Epoxide", "Heptachlor Epoxide, Particulate",
+		                       "Heptachlor Epoxide/Oxychlordane", "Heptachlor Epoxide/Oxychlordane, Particulate",
+		                       "Heptachlor, Particulate", "Hexachlorobenzene", "Hexachlorobenzene, Particulate", "Hexazinone",
+		                       "Hydroxyatrazine, 2-", "Hydroxycarbofuran, 3- ", "Hydroxypropanal, 3-", "Imazalil", "Indoxacarb",
+		                       "Isofenphos", "Isoxaben", "Jasmolin-2", "Kepone", "Ketocarbofuran, 3-", "Leptophos", "Linuron",
+		                       "Malathion", "Merphos", "Methamidophos", "Methidathion", "Methiocarb", "Methomyl", "Methoprene",
+		                       "Methoxychlor", "Methoxychlor, Particulate", "Methoxyfenozide",
+		                       "Methyl (3,4-dichlorophenyl)carbamate", "Mevinphos", "Mexacarbate", "Mirex", "Mirex, Particulate",
+		                       "Molinate", "Monocrotophos", "Monuron", "Naled", "Neburon", "Nonachlor, cis-",
+		                       "Nonachlor, cis-, Particulate", "Nonachlor, trans-", "Nonachlor, trans-, Particulate",
+		                       "Norflurazon", "Oxadiazon", "Oxadiazon, Particulate", "Oxamyl", "Oxychlordane",
+		                       "Oxychlordane, Particulate", "Oxyfluorfen", "Paraquat", "Parathion, Ethyl", "Parathion, Methyl",
+		                       "PCNB", "Pebulate", "Pendimethalin", "Penoxsulam", "Permethrin", "Permethrin, cis-",
+		                       "Permethrin, trans-", "Perthane", "Phenothrin", "Phorate", "Phosalone", "Phosmet", "Phosphamidon",
+		                       "Piperonyl Butoxide", "Pirimiphos Methyl", "PrAllethrin", "Procymidone", "Profenofos",
+		                       "Profluralin", "Prometon", "Prometryn", "Propachlor", "Propanil", "Propargite", "Propazine",
+		                       "Propham", "Propoxur", "Pymetrozin", "Pyrethrin-2", "Pyrimethanil", "Quinoxyfen", "Resmethrin",
+		                       "Safrotin", "Secbumeton", "Siduron", "Simazine", "Simetryn", "Sulfallate", "Sulfotep",
+		                       "Tebuthiuron", "Tedion", "Terbufos", "Terbuthylazine", "Terbutryn", "Tetrachloro-m-xylene",
+		                       "Tetrachlorvinphos", "Tetraethyl Pyrophosphate", "Tetramethrin", "T-Fluvalinate", "Thiamethoxam",
+		                       "Thiobencarb", "Thionazin", "Tokuthion", "Total DDDs", "Total DDEs", "Total DDTs", "Total HCHs",
+		                       "Total Pyrethrins", "Toxaphene", "Tralomethrin", "Tributyl Phosphorotrithioate, S,S,S-",
+		                       "Trichlorfon", "Trichloronate", "Triclopyr", "Tridimephon", "Vinclozolin", ]
+		subsets += [Subset(newFileName='Pesticides' + extension, table='WaterChemistryData',
+		                   field_filter='DW_AnalyteName', analytes=Pesticides_analytes, sep=sep), ]
+	############## ^^^^^^^^^^^^  Subsets of the WQ dataset
+
+	############## Queries  ###
+	# Every table is selected with a TableQuery (see CEDEN_Query.py) that lists the columns to publish and their
+	# names. Add a column to exclude to stop publishing it, or give a table a where filter (in_clause, range_clause)
+	# to only extract part of it, ie.
+	#       where, params = range_clause('SampleDate', '2000-01-01')
+	#       queries['WaterChemistryData'] = TableQuery('WQDMart_MV', rename=RENAME_TARGET, where=where, params=params)
+	queries = {filename: default_query(table, For_IR) for filename, table in tables.items()}
+	# A table that is only needed for its subsets can be limited to their records by the DataMart (see subset_query in
+	# CEDEN_Subsets.py). Its own datasets are then written but not published, ie.
+	#       subsetOnly = ['WaterChemistryData', ]
+	subsetOnly = []
+	############## ^^^^^^^^^^^^  Queries
+
+	############## Subsets of the IR datasets by Regional Board  ###
+	# Each IR table (except STORET and NWIS) is also split into By_RB\<table>_RB_<N> files, one per Regional Board,
+	# while it is being extracted. They are written next to the datasets but not published, so they are not in FILES.
+	if For_IR:
+		for IR_table in tables:
+			if IR_table == 'IR_STORET_2010' or IR_table == 'IR_STORET_2012' or IR_table == 'IR_NWIS':
+				continue
+			if IR_table == 'IR_ToxicityData' or IR_table == 'IR_Field':
+				column_filter = 'RegionalBoard'
+			else:
+				column_filter = 'RegionalBoardID'
+			subsets += [RegionPartitioner(table=IR_table, field_filter=column_filter, sep=sep, extension=extension), ]
+	############## ^^^^^^^^^^^^  Subsets of the IR datasets by Regional Board
 
 	startTime = datetime.now()
 	# This line runs the functions defined above.
 	# The following line does the majority of this script
-	FILES, AllSites = data_retrieval(tables, saveLocation, sep=sep, extension=extension, For_IR=For_IR)
+	# how many distinct data quality outcomes to remember per table. Raise it for a better hit rate, lower it if
+	# memory is tight on the largest IR tables.
+	DQ_cacheSize = 50000
+	# how many tables to extract at the same time, each worker opens its own connection to the DataMart. Use 1 to
+	# extract the tables one after the other. The row counts of each run are saved in historyFile so the next run
+	# can start the largest tables first without counting them.
+	workers = 4
+	historyFile = os.path.join(saveLocation, 'DataMart_RowCounts.json')
+	# A table that takes much longer than everything else can be split into shards by SampleDate year and pulled
+	# over several connections at once (with workers greater than 1). The year is taken from the SampleDate of each
+	# view, see table_key in CEDEN_Shards.py. No table is split unless it is added here, ie.
+	#       shards = {'WaterChemistryData': 4, }
+	#       shards = {'IR_WaterChemistryData': 4, }
+	shards = {}
+	# Tables in incremental are only extracted for the SampleDate years that changed since the last run, the rest of
+	# the records are kept from the files of the last run. The value is the fingerprint of a year, a checksum of its
+	# records or 'MAX(<load date column>)' if the view has one (see CEDEN_Incremental.py). Every fullRebuildDays days
+	# the tables are extracted in full again. No table is refreshed incrementally unless it is added here, ie.
+	#       incremental = {'WaterChemistryData': FINGERPRINT, 'ToxicityData': FINGERPRINT, }
+	incremental = None
+	stateFile = os.path.join(saveLocation, 'DataMart_RefreshState.json')
+	# the station index is kept here between runs so unchanged stations are not extracted again
+	stationCache = os.path.join(saveLocation, 'WQX_Stations.cache')
+	fullRebuildDays = 7
+	# also write a Parquet copy of every dataset for analysts (needs pyarrow). data.ca.gov gets the csv files.
+	parquet = False
+	# the content hash of every file, files that didn't change since they were last published are not uploaded again
+	manifest = Manifest(os.path.join(saveLocation, 'CEDEN_Manifest.json'))
+	# the tables and shards that are done are kept here while the run goes on. If the run dies, run the script again
+	# within a day or two and it only extracts what is left.
+	checkpointFile = os.path.join(saveLocation, 'DataMart_Checkpoint.json')
+	# every run writes a profile, the time spent in each stage of each table, to the Profiles folder (see
+	# CEDEN_Profile.py). Compare them to find what got slower. deepProfile also runs cProfile and tracemalloc, which
+	# makes the run a lot slower.
+	deepProfile = False
+	profile = RunProfile(os.path.join(saveLocation, 'Profiles'), deep=deepProfile)
+
+	############## Publishing to data.ca.gov  ###
+	# nodes is a dictionary of the FILES key and the Node # on data.ca.gov of each file that is published. The files
+	# are uploaded as soon as they are written, while the next tables are being extracted. The uploads that didn't
+	# finish are kept in the publish queue file and resumed by the next run (see CEDEN_Publish.py).
+	publish = None
+	if not For_IR:
+		user = os.environ.get('DCG_user')
+		password = os.environ.get('DCG_pw')
+		URI = os.environ.get('URI')
+		nodes = {'BenthicData': 431, 'ToxicityData': 541, 'All_CEDEN_Sites': 2331,
+		         'TissueData_prior_to_1999': 2366, 'TissueData_2000-2009': 2361,
+		         'TissueData_2010-present': 2086, 'HabitatData_prior_to_1999': 2376,
+		         'HabitatData_2000-2009': 2371, 'HabitatData_2010-present': 2036,
+		         'WaterChemistryData_prior_to_1999': 2386, 'SafeToSwim' + extension: 2396,
+		         'Sites_for_SafeToSwim' + extension: 2401, }
+
+		# Troubles shooting lines below
+		#'WaterChemistryData_2000-2009': 2381, 'WaterChemistryData_2010-present': 2326,
+
+		# Waiting to add these to the automatic uploading above because of uploading size limits:
+		# 'WaterChemistryData_2000-2009': 2381, 'WaterChemistryData_2010-present': 2326,
+		# 'SafeToSwim.csv': 2186, 'Sites_for_SafeToSwim.csv': 2181,
+
+		# the files are sent uploadWorkers at a time, each thread logs in once with its own StreamingClient and keeps
+		# it. Dropped connections, timeouts and 429/5xx responses are tried again. The files are streamed from disk and
+		# files larger than portalLimit bytes are sent in numbered parts. See CEDEN_Upload.py
+		uploadWorkers = 3
+		portalLimit = 1900 * 1024 * 1024
+		scheduler = UploadScheduler(lambda: StreamingClient(URI, user, password, partLimit=portalLimit),
+		                            workers=uploadWorkers, manifest=manifest)
+		publish = PublishQueue(os.path.join(saveLocation, 'CEDEN_PublishQueue.json'), nodes, scheduler)
+		# the uploads a crashed run left behind are finished before their files can be written again
+		if publish.resume():
+			publish.wait()
+	############## ^^^^^^^^^^^^  Publishing to data.ca.gov
+
+	profile.start()
+	FILES, AllSites = data_retrieval(tables, saveLocation, sep=sep, extension=extension, For_IR=For_IR,
+	                                 DQ_cacheSize=DQ_cacheSize, subsets=subsets, workers=workers,
+	                                 historyFile=historyFile, shards=shards,
+	                                 incremental=incremental, stateFile=stateFile, fullRebuildDays=fullRebuildDays,
+	                                 queries=queries, stationCache=stationCache, parquet=parquet, manifest=manifest,
+	                                 publish=publish, checkpointFile=checkpointFile, profile=profile,
+	                                 subsetOnly=subsetOnly)
 	print("\n\n\t\tCompleted data retrieval and processing\n\t\t\tfrom internal DataMart\n\n")
 	print("this is the FILES object: \n", FILES, "\n\n")
 	# write out the All sites variable... This includes all sites in the Chemistry, benthic, toxicity, tissue and
 	# habitat datasets.
 	if not For_IR:
-		AllSites_path = os.path.join(saveLocation, 'All_CEDEN_Sites.csv')
-		with open(AllSites_path, 'w', newline='', encoding='utf8') as AllSites_csv_file:
+		AllSites_path = os.path.join(saveLocation, 'All_CEDEN_Sites' + extension)
+		with open_output(AllSites_path) as AllSites_csv_file:
 			AllSites_dw = csv.DictWriter(AllSites_csv_file,
 			                             fieldnames=['StationName', 'SiteCode', 'Latitude', 'Longitude',
 			                                         'Datum', ], delimiter=sep, lineterminator='\n')
@@ -801,11 +1323,15 @@ if __name__ == "__main__":
 			for key, value in AllSites.items():
 				AllSites_writer.writerow([value[0], key, value[1], value[2], value[3]])
 		FILES['All_CEDEN_Sites'] = AllSites_path
+		if parquet:
+			FILES['All_CEDEN_Sites.parquet'] = write_parquet(AllSites_path, sep)
 	totalTime = datetime.now() - startTime
 	seconds = totalTime.seconds
 	minutes = seconds // 60
 	seconds = seconds - minutes * 60
 	print("Data retrieval and processing took %d minutes and %d seconds" % (minutes, seconds))
+	profile.save(For_IR=For_IR, extension=extension, workers=workers, shards=shards, DQ_cacheSize=DQ_cacheSize,
+	             incremental=sorted(incremental or ()))
 	# if For_IR is False, saved datasets are likely:
 	# FILES["WQX_Stations"]
 	# FILES["WaterChemistryData"]
@@ -813,121 +1339,9 @@ if __name__ == "__main__":
 	# FILES["TissueData"]
 	# FILES["BenthicData"]
 	# FILES["HabitatData"]
-	# use FILES["TableKey"] to subset future datasets, as in example below...
-
-	############## Subsets of WQ dataset for Cyanotoxins  ###
-	if not For_IR:
-		############## Subsets of WQ dataset for Safe To Swim  ###
-		print("\nStarting data subset for Safe to Swim...")
-		WaterChem = FILES['WaterChemistryData']
-		path, fileName = os.path.split(WaterChem)
-		analytes = ['E. coli', 'Enterococcus', 'Coliform, Total', 'Coliform, Fecal', ]
-		newFileName = 'SafeToSwim' + extension
-		column_filter = 'Analyte'
-		name, location, sitesname, siteslocation = selectByAnalyte(path=path, fileName=fileName, newFileName=newFileName, analytes=analytes,
-		                field_filter=column_filter, sep=sep)
-		FILES[name] = location
-		FILES[sitesname] = siteslocation
-		#SafeToSwim_Sites = 'SafeToSwim_Sites' + extension
-		print("\t\tFinished writing data subset for Safe to Swim\n\n")
-		############## Subsets of WQ dataset for Safe To Swim  ###
-
-		############## Subsets of WQ dataset for Pesticides
-		print("\nStarting data subset for Pesticides....")
-		analytes = ["Acetamiprid", "Acibenzolar-S-methyl", "Aldicarb", "Aldicarb ", "Aldicarb Sulfone",
-		            "Aldicarb Sulfoxide", "Aldrin", "Aldrin, Particulate", "Allethrin", "Ametryn", "Aminocarb", "AMPA",
-		            "Anilazine", "Aspon", "Atraton", "Atrazine", "Azinphos Ethyl", "Azinphos Methyl", "Azoxystrobin",
-		            "Barban", "Bendiocarb", "Benfluralin", "Benomyl", "Bensulfuron Methyl", "Bentazon", "Bifenox",
-		            "Bifenthrin", "Bispyribac Sodium", "Bolstar", "Bromacil", "Captafol", "Captan", "Carbaryl",
-		            "Carbendazim", "Carbofuran", "Carbophenothion", "Carfentrazone Ethyl", "Chlorantraniliprole",
-		            "Chlordane", "Chlordane, cis-", "Chlordane, cis-, Particulate", "Chlordane, Technical",
-		            "Chlordane, trans-", "Chlordane, trans-, Particulate", "Chlordene, cis-", "Chlordene, trans-",
-		            "Chlorfenapyr", "Chlorfenvinphos", "Chlorobenzilate", "Chlorothalonil", "Chlorpropham",
-		            "Chlorpyrifos", "Chlorpyrifos Methyl", "Chlorpyrifos Methyl, Particulate",
-		            "Chlorpyrifos Methyl/Fenchlorphos", "Chlorpyrifos, Particulate", "Cinerin-2", "Ciodrin",
-		            "Clomazone", "Clothianidin", "Coumaphos", "Cyanazine", "Cyantraniliprole", "Cycloate", "Cyfluthrin",
-		            "Cyfluthrin, beta-", "Cyfluthrin-1", "Cyfluthrin-2", "Cyfluthrin-3", "Cyfluthrin-4",
-		            "Cyhalofop-butyl", "Cyhalothrin", "Cyhalothrin lambda-", "Cyhalothrin, gamma-",
-		            "Cyhalothrin, lambda-1", "Cyhalothrin, lambda-2", "Cypermethrin", "Cypermethrin-1",
-		            "Cypermethrin-2", "Cypermethrin-3", "Cypermethrin-4", "Cyprodinil", "Dacthal",
-		            "Dacthal, Particulate", "DCBP(p,p')", "DDD(o,p')", "DDD(o,p'), Particulate", "DDD(p,p')",
-		            "DDD(p,p'), Particulate", "DDE(o,p')", "DDE(o,p'), Particulate", "DDE(p,p')",
-		            "DDE(p,p'), Particulate", "DDMU(p,p')", "DDMU(p,p'), Particulate", "DDT(o,p')",
-		            "DDT(o,p'), Particulate", "DDT(p,p')", "DDT(p,p'), Particulate", "Deltamethrin",
-		            "Deltamethrin/Tralomethrin", "Demeton", "Demeton-O", "Demeton-s", "Desethyl-Atrazine",
-		            "Desisopropyl-Atrazine", "Diazinon", "Diazinon, Particulate", "Dichlofenthion", "Dichlone",
-		            "Dichloroaniline, 3,5-", "Dichlorobenzenamine, 3,4-", "Dichlorophenyl Urea, 3,4-",
-		            "Dichlorophenyl-3-methyl Urea, 3,4-", "Dichlorvos", "Dichrotophos", "Dicofol", "Dicrotophos",
-		            "Dieldrin", "Dieldrin, Particulate", "Diflubenzuron", "Dimethoate", "Dioxathion", "Diphenamid",
-		            "Diphenylamine", "Diquat", "Disulfoton", "Dithiopyr", "Diuron", "Endosulfan I",
-		            "Endosulfan I, Particulate", "Endosulfan II", "Endosulfan II, Particulate", "Endosulfan Sulfate",
-		            "Endosulfan Sulfate, Particulate", "Endrin", "Endrin Aldehyde", "Endrin Ketone",
-		            "Endrin, Particulate", "EPN", "EPTC", "Esfenvalerate", "Esfenvalerate/Fenvalerate",
-		            "Esfenvalerate/Fenvalerate-1", "Esfenvalerate/Fenvalerate-2", "Ethafluralin", "Ethion", "Ethoprop",
-		            "Famphur", "Fenamiphos", "Fenchlorphos", "Fenhexamid", "Fenitrothion", "Fenpropathrin",
-		            "Fensulfothion", "Fenthion", "Fenuron", "Fenvalerate", "Fipronil", "Fipronil Amide",
-		            "Fipronil Desulfinyl", "Fipronil Desulfinyl Amide", "Fipronil Sulfide", "Fipronil Sulfone",
-		            "Flonicamid", "Fluometuron", "Fluridone", "Flusilazole", "Fluvalinate", "Fluxapyroxad", "Folpet",
-		            "Fonofos", "Glyphosate", "Halosulfuron Methyl", "HCH, alpha-", "HCH, alpha-, Particulate",
-		            "HCH, beta-", "HCH, beta-, Particulate", "HCH, delta-", "HCH, delta-, Particulate", "HCH, gamma-",
-		            "HCH, gamma-, Particulate", "Heptachlor", "Heptachlor Epoxide", "Heptachlor Epoxide, Particulate",
-		            "Heptachlor Epoxide/Oxychlordane", "Heptachlor Epoxide/Oxychlordane, Particulate",
-		            "Heptachlor, Particulate", "Hexachlorobenzene", "Hexachlorobenzene, Particulate", "Hexazinone",
-		            "Hydroxyatrazine, 2-", "Hydroxycarbofuran, 3- ", "Hydroxypropanal, 3-", "Imazalil", "Indoxacarb",
-		            "Isofenphos", "Isoxaben", "Jasmolin-2", "Kepone", "Ketocarbofuran, 3-", "Leptophos", "Linuron",
-		            "Malathion", "Merphos", "Methamidophos", "Methidathion", "Methiocarb", "Methomyl", "Methoprene",
-		            "Methoxychlor", "Methoxychlor, Particulate", "Methoxyfenozide",
-		            "Methyl (3,4-dichlorophenyl)carbamate", "Mevinphos", "Mexacarbate", "Mirex", "Mirex, Particulate",
-		            "Molinate", "Monocrotophos", "Monuron", "Naled", "Neburon", "Nonachlor, cis-",
-		            "Nonachlor, cis-, Particulate", "Nonachlor, trans-", "Nonachlor, trans-, Particulate",
-		            "Norflurazon", "Oxadiazon", "Oxadiazon, Particulate", "Oxamyl", "Oxychlordane",
-		            "Oxychlordane, Particulate", "Oxyfluorfen", "Paraquat", "Parathion, Ethyl", "Parathion, Methyl",
-		            "PCNB", "Pebulate", "Pendimethalin", "Penoxsulam", "Permethrin", "Permethrin, cis-",
-		            "Permethrin, trans-", "Perthane", "Phenothrin", "Phorate", "Phosalone", "Phosmet", "Phosphamidon",
-		            "Piperonyl Butoxide", "Pirimiphos Methyl", "PrAllethrin", "Procymidone", "Profenofos",
-		            "Profluralin", "Prometon", "Prometryn", "Propachlor", "Propanil", "Propargite", "Propazine",
-		            "Propham", "Propoxur", "Pymetrozin", "Pyrethrin-2", "Pyrimethanil", "Quinoxyfen", "Resmethrin",
-		            "Safrotin", "Secbumeton", "Siduron", "Simazine", "Simetryn", "Sulfallate", "Sulfotep",
-		            "Tebuthiuron", "Tedion", "Terbufos", "Terbuthylazine", "Terbutryn", "Tetrachloro-m-xylene",
-		            "Tetrachlorvinphos", "Tetraethyl Pyrophosphate", "Tetramethrin", "T-Fluvalinate", "Thiamethoxam",
-		            "Thiobencarb", "Thionazin", "Tokuthion", "Total DDDs", "Total DDEs", "Total DDTs", "Total HCHs",
-		            "Total Pyrethrins", "Toxaphene", "Tralomethrin", "Tributyl Phosphorotrithioate, S,S,S-",
-		            "Trichlorfon", "Trichloronate", "Triclopyr", "Tridimephon", "Vinclozolin", ]
-		WaterChem = FILES["WaterChemistryData"]
-		path, fileName = os.path.split(WaterChem)
-		newFileName = 'Pesticides' + extension
-		column_filter = 'DW_AnalyteName'
-		name, location, sitesname, siteslocation = selectByAnalyte(path=path, fileName=fileName, newFileName=newFileName, analytes=analytes,
-		                field_filter=column_filter, sep=sep)
-		FILES[name] = location
-		FILES[sitesname] = siteslocation
-		print("\t\tFinished writing data subset for Pesticides\n\n")
-	############## ^^^^^^^^^^^^  Subsets of datasets for Pesticides
-
-	if For_IR:
-		RB = list(range(1, 10))
-		# add check to see if For_RB folder exists in path location
-		if not os.path.isdir(os.path.join(saveLocation, 'By_RB')):
-			os.mkdir(os.path.join(saveLocation, 'By_RB'))
-		for IR_file in FILES.values():
-			if not os.path.isfile(IR_file):
-				continue
-			for Region in RB:
-				path, fileName = os.path.split(IR_file)
-				file_parts, ext = os.path.splitext(fileName)
-				if file_parts == 'IR_STORET_2010' or file_parts == 'IR_STORET_2012' or file_parts == 'IR_NWIS':
-					continue
-				newFileName = 'By_RB\\' + file_parts + '_RB_' + str(Region) + ext
-				if file_parts == 'IR_ToxicityData' or file_parts == 'IR_Field':
-					column_filter = 'RegionalBoard'
-				else:
-					column_filter = 'RegionalBoardID'
-				analytes = [str(Region), ]
-				name, location, sitesname = selectByAnalyte(path=path, fileName=fileName, newFileName=newFileName,
-				                analytes=analytes, field_filter=column_filter, sep=sep, For_IR=True)
-				#FILES[name] = location
-				#FILES[sitesname] = siteslocation
-				print('Completed %s' % newFileName)
+	# FILES["SafeToSwim.csv"], FILES["Sites_for_SafeToSwim.csv"]
+	# FILES["Pesticides.csv"], FILES["Sites_for_Pesticides.csv"]
+	# use FILES["TableKey"] to subset future datasets with selectByAnalyte, or better, add a Subset above.
 
 
 	##########################################################################################################
@@ -938,41 +1352,7 @@ if __name__ == "__main__":
 
 
 	if not For_IR:
-		#### upload dataset to data.ca.gov
-		print("Starting to upload files to Data.ca.gov")
-		user = os.environ.get('DCG_user')
-		password = os.environ.get('DCG_pw')
-		URI = os.environ.get('URI')
-		api = DatasetAPI(URI, user, password, debug=False)
-		# the uploads variable is a dictionary that needs a file path and the Node # from data.ca.gov
-		# The FILES object has the file path information and we use it as a key for the Node # in the for loop below.
-		uploads = {FILES['BenthicData']: 431, FILES['ToxicityData']: 541, FILES['All_CEDEN_Sites']: 2331,
-		           FILES['TissueData_prior_to_1999']: 2366, FILES['TissueData_2000-2009']: 2361,
-		           FILES['TissueData_2010-present']: 2086, FILES['HabitatData_prior_to_1999']: 2376,
-		           FILES['HabitatData_2000-2009']: 2371, FILES['HabitatData_2010-present']: 2036,
-		           FILES['WaterChemistryData_prior_to_1999']: 2386, FILES['SafeToSwim.csv']: 2396,
-		           FILES['Sites_for_SafeToSwim.csv']: 2401, }
-
-		# Troubles shooting lines below
-		#FILES['WaterChemistryData_2000-2009']: 2381, FILES['WaterChemistryData_2010-present']: 2326,
-		#uploads = {'C:\\Users\\AHill\\Documents\\CEDEN_Datasets\\WaterChemistryData_2000-2009.csv': 2381, }
-
-		# Waiting to add these to the automatic uploading above because of uploading size limits:
-		# FILES['WaterChemistryData_2000-2009']: 2381, FILES['WaterChemistryData_2010-present']: 2326,
-		# FILES['SafeToSwim.csv']: 2186, FILES['Sites_for_SafeToSwim.csv']: 2181,
-
-		for file in uploads:
-			print("Starting to upload %s to Data.ca.gov" % os.path.basename(file))
-			r = api.attach_file_to_node(file=file, node_id=uploads[file], field='field_upload', update=0)
-			if r.ok:
-				print("Completed uploading %s to data.ca.gov" % os.path.split(file)[1])
-				r.close()
-				del r
-			else:
-				print("something went wrong\n")
-				print("with %s. Here is the response error code: %s " % (os.path.split(file)[1], r.status_code))
-				print("\nAlso, here is the response text")
-				print(r.text)
-				print(r.reason)
-				r.close()
-				del r
+		# the tables were uploaded while the extraction went on, All_CEDEN_Sites is the last file
+		publish.push('All_CEDEN_Sites', FILES['All_CEDEN_Sites'])
+		print("Waiting for the uploads to data.ca.gov to finish")
+		publish.close()
@@ -0,0 +1,102 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module keeps the content hash and number of lines of the files written by open_output
+(CEDEN_Compression.py). The output files hand every block of text to a ContentDigest on its way to the disk (the
+uncompressed text, so the hash doesn't depend on the compression), and the hash of each file is kept here once it is
+closed. The manifest (CEDEN_Manifest.py) and the checkpoint (CEDEN_Checkpoint.py) take the hashes from here so the
+files aren't read a second time. The worker processes hand theirs back to data_retrieval, see take_digests.
+	When keep_unchanged was given the hash a file had in the last run, the file is written in full next to the old
+one (.partial) and only replaces it if its content changed. The write isn't saved, only the replacement: an
+unchanged file keeps its modification time, so its Parquet copy and its upload are skipped.
+
+'''
+
+import os
+import hashlib
+
+# the hash of the content of the output files
+DIGEST = 'sha256'
+# the (hash, number of lines) of every file written by open_output in this process, by path
+_written = {}
+# the hash of the files of the last run, by path, see keep_unchanged
+_previous = {}
+
+
+# ContentDigest hashes the text of a file and counts its lines, block by block
+class ContentDigest:
+	def __init__(self):
+		self.hash = hashlib.new(DIGEST)
+		self.lines = 0
+
+	def update(self, block):
+		self.hash.update(block)
+		self.lines += block.count(b'\n')
+
+	# result returns the (hash, number of lines) of the blocks so far
+	def result(self):
+		return self.hash.hexdigest(), self.lines
+
+
+# keep_unchanged gives the hash of the files of the last run (path: hash). A file written again with the same hash is
+# left as it was.
+def keep_unchanged(previous):
+	_previous.clear()
+	_previous.update({os.path.abspath(path): digest for path, digest in previous.items()})
+
+
+# take_digests returns the (hash, number of lines) of the files written by this process since the last call, by
+# path. The worker processes hand them back to data_retrieval, which gives them to record_digests.
+def take_digests():
+	digests = dict(_written)
+	_written.clear()
+	return digests
+
+
+def record_digests(digests):
+	_written.update(digests)
+
+
+# digest_of returns the (hash, number of lines) of a file written by open_output, or None
+def digest_of(path):
+	return _written.get(os.path.abspath(path))
+
+
+# partial_path returns where a file is written: next to the old file when that one may be kept, see keep_unchanged
+def partial_path(path):
+	if os.path.abspath(path) in _previous and os.path.isfile(path):
+		return path + '.partial'
+	return path
+
+
+# finish_output keeps the (hash, number of lines) of a closed file and puts it in place, unless it is the same as the
+# old one
+def finish_output(path, partial, digest):
+	path = os.path.abspath(path)
+	if os.path.abspath(partial) != path:
+		if _previous.get(path) == digest[0] and os.path.isfile(path):
+			os.remove(partial)
+		else:
+			os.replace(partial, path)
+	_written[path] = tuple(digest)
+
+
+# abort_output removes what was written of a file that failed half way. The old file next to it (see keep_unchanged)
+# is left as it was and no hash is kept. A file written in place was already emptied when it was opened, it is left
+# as far as it got.
+def abort_output(path, partial):
+	if os.path.abspath(partial) != os.path.abspath(path) and os.path.isfile(partial):
+		os.remove(partial)
+
+
+# replace_output moves a file written by open_output to path, or drops it if path already has the same content (see
+# keep_unchanged). Used for the files that are written under a temporary name.
+def replace_output(source, path):
+	finish_output(path, source, _written.pop(os.path.abspath(source)))
@@ -0,0 +1,243 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module holds the incremental refresh used by data_retrieval (CEDEN_DataRefresh.py). Most of what changes
+in the DataMart between two runs is in the most recent SampleDate years, so re-extracting every view in full each
+night rewrites millions of records that did not change. Instead, one cheap GROUP BY query per table gives the
+number of records and a fingerprint (a checksum or the max of a load date column) for every SampleDate year. Those
+are saved in a state file next to the datasets. On the next run only the years whose count or fingerprint changed,
+or that disappeared, are extracted again. The new records of those years replace the old ones in the existing
+output files. Files without any of those years are left alone. A changed count catches deleted records too. Every
+fullRebuildDays days, or whenever something doesn't line up, the table is extracted in full again.
+	The output files have no record id, so a year is the smallest unit that can be replaced. The watermark of a
+year is its fingerprint.
+
+'''
+
+import os
+import csv
+import json
+import shutil
+from datetime import datetime
+from CEDEN_Subsets import write_Sites
+from CEDEN_Compression import open_output, open_input, compression_of
+from CEDEN_Digests import replace_output
+
+# a checksum of every column of every record in the year. It catches new, changed and deleted records without
+# needing a load date column. Use 'MAX(<load date column>)' instead when the view has one, it is cheaper.
+FINGERPRINT = 'CHECKSUM_AGG(BINARY_CHECKSUM(*))'
+# temporary folder, inside the save location, where the changed years are written before they are merged
+INCREMENTAL_FOLDER = 'Incremental'
+# how the date the last full extraction was made is saved in the state file
+DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+
+# load_state reads the state file. A missing or broken file means every table gets a full extraction.
+def load_state(stateFile):
+	if not stateFile or not os.path.isfile(stateFile):
+		return {}
+	try:
+		with open(stateFile, 'r', encoding='utf8') as state:
+			return json.load(state)
+	except ValueError:
+		return {}
+
+
+# save_state writes the state of the tables of this run, keeping the state of the other tables
+def save_state(stateFile, tableStates):
+	if not stateFile:
+		return
+	state = load_state(stateFile)
+	state.update(tableStates)
+	# written next to the state file and put in its place once complete, a run that dies while writing it leaves the
+	# state of the last run
+	with open(stateFile + '.tmp', 'w', encoding='utf8') as stateOut:
+		json.dump(state, stateOut, indent=1, sort_keys=True)
+	os.replace(stateFile + '.tmp', stateFile)
+
+
+# year_key makes the SampleDate year from the DataMart and from the output files look the same. No year is ''.
+def year_key(year):
+	if year is None or year == '':
+		return ''
+	return str(int(year))
+
+
+# year_fingerprints asks the DataMart for the number of records and the fingerprint of every SampleDate year of a
+# table. key is the SQL expression of the year (see table_key in CEDEN_Shards.py).
+def year_fingerprints(cursor, table, key, fingerprint=FINGERPRINT):
+	cursor.execute("SELECT %s, COUNT(*), %s FROM %s GROUP BY %s" % (key, fingerprint, table, key))
+	years = {}
+	for year, records, yearFingerprint in cursor.fetchall():
+		years[year_key(year)] = [int(records), str(yearFingerprint)]
+	return years
+
+
+# dirty_years compares the fingerprints saved by the last run with the new ones and returns the years that
+# changed, are new or are gone.
+def dirty_years(oldYears, newYears):
+	return sorted(year for year in set(oldYears) | set(newYears) if oldYears.get(year) != newYears.get(year))
+
+
+# year_clause is the WHERE clause that selects the records of the dirty years
+def year_clause(years, key):
+	clauses = []
+	known = [year for year in years if year != '']
+	if known:
+		clauses += ["%s IN (%s)" % (key, ', '.join(known))]
+	if '' in years:
+		clauses += ["%s IS NULL" % key]
+	return ' OR '.join(clauses)
+
+
+# full_rebuild_due is True when the table has no usable state or its last full extraction is too old
+def full_rebuild_due(tableState, key, fingerprint, fullRebuildDays, saveLocation):
+	if not tableState or tableState.get('key') != key or tableState.get('fingerprint') != fingerprint:
+		return True
+	if any(not os.path.isfile(os.path.join(saveLocation, relative)) for relative in tableState['files'].values()
+	       if not os.path.basename(relative).startswith('Sites_for_')):
+		# somebody removed an output file. It can't be merged into, so start over.
+		return True
+	lastFull = datetime.strptime(tableState['full'], DATE_FORMAT)
+	return (datetime.now() - lastFull).days >= fullRebuildDays
+
+
+# table_state is what gets saved for a table after a run. sites (StationCode: [StationName, Latitude, Longitude,
+# Datum]) and records (the number of records of the table) are used again as they are when no year changed.
+def table_state(years, key, fingerprint, writtenFiles, saveLocation, full, sites, records):
+	return {'key': key, 'fingerprint': fingerprint, 'years': years, 'full': full,
+	        'files': {name: os.path.relpath(path, saveLocation) for name, path in writtenFiles.items()},
+	        'sites': sites, 'records': records}
+
+
+# record_year returns the function that gives the year of a record of an output file. textDates is True for the
+# views that report SampleDate as monthdayyear (TEXT_DATES in CEDEN_Shards.py), the others are year-month-day.
+def record_year(columns, textDates):
+	index = columns.index('SampleDate')
+	if textDates:
+		return lambda record: year_key(record[index][-4:])
+	return lambda record: year_key(record[index][:4])
+
+
+# merge_file replaces the records of the dirty years in an existing output file by the records of the delta file.
+# It returns True if the file was rewritten and None if the two files don't have the same columns, which means the
+# view changed and the table needs a full extraction.
+def merge_file(existing, delta, dirty, sep, textDates):
+	if not dirty and not os.path.isfile(delta):
+		# nothing changed
+		return False
+	columns = None
+	rewrite = not os.path.isfile(existing)
+	merged = existing + '.merge'
+	with open_output(merged, compression=compression_of(existing)) as mergedOut:
+		writer = csv.writer(mergedOut, csv.QUOTE_MINIMAL, delimiter=sep, lineterminator='\n')
+		if os.path.isfile(existing):
+			with open_input(existing) as existingIn:
+				reader = csv.reader(existingIn, delimiter=sep, lineterminator='\n')
+				columns = next(reader)
+				writer.writerow(columns)
+				year = record_year(columns, textDates)
+				for record in reader:
+					if year(record) in dirty:
+						rewrite = True
+					else:
+						writer.writerow(record)
+		if os.path.isfile(delta):
+			with open_input(delta) as deltaIn:
+				reader = csv.reader(deltaIn, delimiter=sep, lineterminator='\n')
+				deltaColumns = next(reader)
+				if columns is None:
+					columns = deltaColumns
+					writer.writerow(columns)
+				elif columns != deltaColumns:
+					rewrite = None
+				if rewrite is not None:
+					for record in reader:
+						rewrite = True
+						writer.writerow(record)
+	if columns is None:
+		# neither file exists, there is nothing to merge
+		rewrite = False
+	if rewrite:
+		# an existing file that ends up with the same content is kept as it was, see keep_unchanged
+		replace_output(merged, existing)
+	else:
+		os.remove(merged)
+	return rewrite
+
+
+# read_sites collects the first StationName, Latitude, Longitude and Datum of every station in an output file
+def read_sites(path, sep, Latitude, Longitude):
+	Sites = {}
+	with open_input(path) as fileIn:
+		reader = csv.reader(fileIn, delimiter=sep, lineterminator='\n')
+		columns = next(reader)
+		positions = {name: i for i, name in enumerate(dict.fromkeys(columns))}
+		indices = [positions[name] for name in ('StationCode', 'StationName', Latitude, Longitude, 'Datum')]
+		for record in reader:
+			StationCode, StationName, Lat, Long, Datum = [record[i] for i in indices]
+			if StationCode not in Sites:
+				Sites[StationCode] = [StationName, Lat, Long, Datum]
+	return Sites
+
+
+# count_records returns the number of records in an output file
+def count_records(path):
+	with open_input(path) as fileIn:
+		return max(sum(1 for line in fileIn) - 1, 0)
+
+
+# merge_delta merges the files written for the dirty years of a table (deltaFiles, in deltaLocation) into the files
+# of the last run (tableState['files'], in saveLocation). The Sites_for_ file of a subset that changed is written
+# again from the merged subset. pruned are the files of the last run that were removed for being almost empty,
+# their old records are gone so nothing can be merged into them. It returns the files of the table in the same
+# format as the writtenFiles dictionary, or None if the table needs a full extraction. deltaLocation is removed
+# either way. textDates is True for a view with monthdayyear SampleDates, see record_year.
+def merge_delta(tableState, deltaFiles, deltaLocation, saveLocation, sep, dirty, textDates, pruned=()):
+	relatives = dict(tableState['files'])
+	for name, path in deltaFiles.items():
+		relatives.setdefault(name, os.path.relpath(path, deltaLocation))
+	writtenFiles = {}
+	rewritten = set()
+	try:
+		for name, relative in relatives.items():
+			if os.path.basename(relative).startswith('Sites_for_'):
+				continue
+			existing = os.path.join(saveLocation, relative)
+			delta = os.path.join(deltaLocation, relative)
+			if name in pruned and os.path.isfile(delta) and count_records(delta):
+				print("\t%s was removed in the last run and can't be merged into" % relative)
+				return None
+			rewrite = merge_file(existing, delta, dirty, sep, textDates)
+			if rewrite is None:
+				print("\tThe columns of %s changed since the last run" % relative)
+				return None
+			if rewrite:
+				rewritten.add(relative)
+			if os.path.isfile(existing):
+				writtenFiles[name] = existing
+		for name, relative in relatives.items():
+			if not os.path.basename(relative).startswith('Sites_for_'):
+				continue
+			Sites = os.path.join(saveLocation, relative)
+			subset = os.path.join(os.path.dirname(relative), os.path.basename(relative)[len('Sites_for_'):])
+			if subset in rewritten or not os.path.isfile(Sites):
+				write_Sites(Sites, read_sites(os.path.join(saveLocation, subset), sep, 'Latitude', 'Longitude'),
+				            sep)
+			writtenFiles[name] = Sites
+	finally:
+		shutil.rmtree(deltaLocation, ignore_errors=True)
+		try:
+			os.rmdir(os.path.dirname(deltaLocation))
+		except OSError:
+			# another table is still using the Incremental folder
+			pass
+	print("\tRewrote %d of %d files" % (len(rewritten), len(writtenFiles)))
+	return writtenFiles
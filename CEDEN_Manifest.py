@@ -0,0 +1,131 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module keeps a manifest of the published files: the content hash, number of records, size and modification
+time of every file in FILES, and the hash each resource node was last given. Every run used to upload all the
+resources, even when the data hadn't changed since the last run. With the manifest, an upload is skipped when the
+file has the hash that was last published to its node.
+	The hashes come from open_output (CEDEN_Compression.py), which hashes every file as it is written (see
+CEDEN_Digests.py), so the files aren't read a second time. A file that wasn't written in this run keeps its entry as
+long as its size and modification time didn't change. The manifest also gives data_retrieval the hashes of the last
+run so a date divided file written again with the same content isn't replaced (see keep_unchanged in
+CEDEN_Digests.py).
+
+'''
+
+import os
+import json
+import threading
+from CEDEN_Compression import BLOCK_SIZE, open_binary
+from CEDEN_Digests import DIGEST, ContentDigest, digest_of
+
+MANIFEST_VERSION = 1
+
+
+# content_digest reads a file, compressed or not, and returns the (hash, number of lines) open_output would have
+# given it
+def content_digest(path):
+	digest = ContentDigest()
+	with open_binary(path) as fileIn:
+		for block in iter(lambda: fileIn.read(BLOCK_SIZE), b''):
+			digest.update(block)
+	return digest.result()
+
+
+# Manifest is the manifest kept in manifestFile. The files are kept by their path relative to the folder of the
+# manifest, so the datasets can be moved along with it.
+class Manifest:
+	def __init__(self, manifestFile):
+		self.manifestFile = manifestFile
+		self.folder = os.path.dirname(os.path.abspath(manifestFile))
+		# the upload threads mark their files as published at the same time
+		self.lock = threading.Lock()
+		self.files = self._load()
+
+	# _load reads the manifest. A missing, broken or older manifest means every file is new.
+	def _load(self):
+		if not os.path.isfile(self.manifestFile):
+			return {}
+		try:
+			with open(self.manifestFile, 'r', encoding='utf8') as manifestIn:
+				manifest = json.load(manifestIn)
+		except ValueError:
+			return {}
+		if manifest.get('version') != MANIFEST_VERSION or manifest.get('digest') != DIGEST:
+			return {}
+		return manifest['files']
+
+	# save writes the manifest next to the old one and then replaces it, so a crash never leaves half a manifest and
+	# the published hashes are never lost
+	def save(self):
+		with open(self.manifestFile + '.tmp', 'w', encoding='utf8') as manifestOut:
+			json.dump({'version': MANIFEST_VERSION, 'digest': DIGEST, 'files': self.files}, manifestOut, indent=1,
+			          sort_keys=True)
+		os.replace(self.manifestFile + '.tmp', self.manifestFile)
+
+	def _key(self, path):
+		return os.path.relpath(os.path.abspath(path), self.folder)
+
+	# entry returns what the manifest knows of a file, or None if the file changed since
+	def entry(self, path):
+		entry = self.files.get(self._key(path))
+		if entry is None or not os.path.isfile(path):
+			return None
+		stat = os.stat(path)
+		if entry['size'] != stat.st_size or entry['mtime'] != stat.st_mtime_ns:
+			return None
+		return entry
+
+	# previous_digests returns the hash of every file that is still the one in the manifest, by path, for
+	# keep_unchanged (CEDEN_Digests.py)
+	def previous_digests(self):
+		previous = {}
+		for key in self.files:
+			path = os.path.join(self.folder, key)
+			entry = self.entry(path)
+			if entry is not None:
+				previous[path] = entry['hash']
+		return previous
+
+	# update adds the files in paths (ie. FILES.values()) to the manifest. Their hash is the one open_output made,
+	# or the one already in the manifest if the file didn't change. Any other file is read to hash it.
+	def update(self, paths):
+		with self.lock:
+			for path in paths:
+				if not os.path.isfile(path):
+					continue
+				key = self._key(path)
+				digest = digest_of(path)
+				if digest is None:
+					if self.entry(path) is not None:
+						continue
+					print("\tHashing %s, it wasn't written in this run" % os.path.basename(path))
+					digest = content_digest(path)
+				old = self.files.get(key, {})
+				stat = os.stat(path)
+				self.files[key] = {'hash': digest[0], 'rows': max(digest[1] - 1, 0), 'size': stat.st_size,
+				                   'mtime': stat.st_mtime_ns, 'published': old.get('published', {})}
+			self.save()
+
+	# unchanged is True when a file has the content that was last published to node
+	def unchanged(self, path, node):
+		with self.lock:
+			entry = self.entry(path)
+			return entry is not None and entry['published'].get(str(node)) == entry['hash']
+
+	# published marks a file as published to node with its current content
+	def published(self, path, node):
+		if self.entry(path) is None:
+			self.update([path])
+		with self.lock:
+			entry = self.entry(path)
+			if entry is not None:
+				entry['published'][str(node)] = entry['hash']
+				self.save()
@@ -0,0 +1,148 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module writes a Parquet copy of the published datasets next to the csv/txt files written by
+data_retrieval (CEDEN_DataRefresh.py), selectByAnalyte and the All_CEDEN_Sites writer. The delimited files stay the
+published format, data.ca.gov needs them for its preview. The Parquet files are for analysts: SampleDate is a
+timestamp and Result, Latitude and Longitude are numbers. Values that can't be read as such are left empty (null).
+Every row group has min/max statistics, so a reader that asks for one year or one analyte skips the rest of the
+file. The station, analyte and QA code columns are dictionary encoded.
+	The Parquet file is made from the finished delimited file, in blocks that become the row groups, after the
+shards are stitched and the incremental years merged. A file that didn't change since its Parquet copy was
+written is skipped. This needs pyarrow (pip install pyarrow). Without it, only asking for Parquet fails.
+
+'''
+
+import os
+import csv
+from concurrent.futures import ProcessPoolExecutor
+from CEDEN_Compression import open_input, strip_compression
+
+try:
+	import pyarrow as pa
+	import pyarrow.compute as pc
+	import pyarrow.csv as pa_csv
+	import pyarrow.parquet as pq
+except ImportError:
+	pa = None
+
+PARQUET_EXTENSION = '.parquet'
+# number of records in each row group
+ROW_GROUP_SIZE = 250000
+# the columns written as a timestamp and the formats SampleDate comes in. The non IR tables use year-month-day,
+# the IR tables monthdayyear.
+DATE_COLUMNS = ('SampleDate', )
+DATE_FORMATS = ('%Y-%m-%d %H:%M:%S', '%Y-%m-%d', '%m%d%Y', '%m/%d/%Y', )
+# the columns written as numbers
+NUMBER_COLUMNS = ('Result', 'Latitude', 'Longitude', 'TargetLatitude', 'TargetLongitude', )
+NUMBER = r'^[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?$'
+# the columns with few distinct values, they are dictionary encoded
+DICTIONARY_COLUMNS = ('StationCode', 'SiteCode', 'Analyte', 'AnalyteName', 'DW_AnalyteName', 'QACode',
+                      'ResultQualCode', 'ResQualCode', 'BatchVerification', 'MatrixName', 'SampleTypeCode',
+                      'DataQuality', 'Datum', 'RegionalBoardID', 'RegionalBoard', )
+
+
+# require_pyarrow raises an ImportError when pyarrow is not installed
+def require_pyarrow():
+	if pa is None:
+		raise ImportError("Parquet output needs the pyarrow library, pip install pyarrow")
+
+
+# parquet_path returns the path of the Parquet copy of a delimited file, compressed or not
+def parquet_path(path):
+	return os.path.splitext(strip_compression(path))[0] + PARQUET_EXTENSION
+
+
+# parquet_name returns the writtenFiles key of the Parquet copy of a file ('SafeToSwim.csv' -> 'SafeToSwim.parquet',
+# 'WaterChemistryData' -> 'WaterChemistryData.parquet')
+def parquet_name(name, extension):
+	if name.endswith(extension):
+		name = name[:-len(extension)]
+	return name + PARQUET_EXTENSION
+
+
+# schema returns the type of every column of a file
+def schema(columns):
+	fields = []
+	for name in columns:
+		if name in DATE_COLUMNS:
+			fields += [pa.field(name, pa.timestamp('s'))]
+		elif name in NUMBER_COLUMNS:
+			fields += [pa.field(name, pa.float64())]
+		else:
+			fields += [pa.field(name, pa.string())]
+	return pa.schema(fields)
+
+
+# typed converts the text columns of a block to their types, see schema()
+def typed(table, tableSchema):
+	columns = []
+	for field, column in zip(tableSchema, table.columns):
+		if field.name in DATE_COLUMNS:
+			column = pc.coalesce(*[pc.strptime(column, format=dateFormat, unit='s', error_is_null=True)
+			                       for dateFormat in DATE_FORMATS])
+		elif field.name in NUMBER_COLUMNS:
+			column = pc.utf8_trim_whitespace(column)
+			column = pc.if_else(pc.match_substring_regex(column, NUMBER), column, pa.scalar(None, pa.string()))
+			column = pc.cast(column, pa.float64())
+		columns += [column]
+	return pa.Table.from_arrays(columns, schema=tableSchema)
+
+
+# write_parquet writes the Parquet copy of a delimited file and returns its path. rowGroupSize is the number of
+# records per row group.
+def write_parquet(path, sep, rowGroupSize=ROW_GROUP_SIZE):
+	require_pyarrow()
+	parquetFile = parquet_path(path)
+	if os.path.isfile(parquetFile) and os.path.getmtime(parquetFile) >= os.path.getmtime(path):
+		# the file didn't change since its Parquet copy was written
+		return parquetFile
+	with open_input(path) as fileIn:
+		columns = next(csv.reader(fileIn, delimiter=sep, lineterminator='\n'))
+	tableSchema = schema(columns)
+	# every column is read as text, exactly as it is in the file, and converted by typed(). pyarrow uncompresses
+	# .gz and .zst files itself.
+	text = pa_csv.ConvertOptions(column_types={name: pa.string() for name in columns}, strings_can_be_null=False)
+	reader = pa_csv.open_csv(path, read_options=pa_csv.ReadOptions(block_size=16 * 1024 * 1024),
+	                         parse_options=pa_csv.ParseOptions(delimiter=sep), convert_options=text)
+	dictionary = [name for name in columns if name in DICTIONARY_COLUMNS]
+	with pq.ParquetWriter(parquetFile + '.tmp', tableSchema, use_dictionary=dictionary, compression='snappy',
+	                      write_statistics=True) as writer:
+		pending = []
+		pendingRows = 0
+		for batch in reader:
+			pending += [batch]
+			pendingRows += batch.num_rows
+			if pendingRows >= rowGroupSize:
+				block = pa.Table.from_batches(pending)
+				# full row groups are written, what is left over starts the next one
+				full = pendingRows - pendingRows % rowGroupSize
+				writer.write_table(typed(block.slice(0, full), tableSchema), row_group_size=rowGroupSize)
+				pending = block.slice(full).to_batches()
+				pendingRows -= full
+		if pendingRows:
+			writer.write_table(typed(pa.Table.from_batches(pending), tableSchema), row_group_size=rowGroupSize)
+	os.replace(parquetFile + '.tmp', parquetFile)
+	return parquetFile
+
+
+# parquet_siblings writes the Parquet copy of every file in writtenFiles (the dictionary returned by data_retrieval)
+# and returns them in the same format, with workers processes.
+def parquet_siblings(writtenFiles, sep, extension, workers=1, rowGroupSize=ROW_GROUP_SIZE):
+	require_pyarrow()
+	names = [name for name, path in writtenFiles.items() if path.endswith(extension) and os.path.isfile(path)]
+	if workers > 1:
+		with ProcessPoolExecutor(max_workers=workers) as pool:
+			paths = list(pool.map(write_parquet, [writtenFiles[name] for name in names], [sep] * len(names),
+			                      [rowGroupSize] * len(names)))
+	else:
+		paths = [write_parquet(writtenFiles[name], sep, rowGroupSize) for name in names]
+	print("\tWrote the Parquet copies of %d files" % len(paths))
+	return {parquet_name(name, extension): path for name, path in zip(names, paths)}
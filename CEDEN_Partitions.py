@@ -0,0 +1,138 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module splits the records of a table into files while the table is being extracted. A PartitionWriter
+takes a key function that gives the partition of a record (its date range, decade, region, program, analyte
+group, ...) and a path function that gives the file of a partition. It is used for the date divided files of
+data_retrieval (CEDEN_DataRefresh.py) and for the Partitioner subsets, ie. the By_RB files (CEDEN_Subsets.py).
+	A partition file is only created when its first record comes, so a partition without records never has a file.
+Each partition keeps bufferSize characters in memory and writes them in one go (see PooledOutput in
+CEDEN_Compression.py), and the open files are kept in a HandlePool. The pool closes the least recently used file when
+maxOpen are open and opens it again to append to the next time it is written. That way a table can be split in
+hundreds of partitions (ie. per analyte) in one pass without running out of file descriptors: windows gives a
+process 512 of them. Every PartitionWriter of a process shares the same pool unless it is given one.
+
+'''
+
+from collections import OrderedDict
+from CEDEN_Compression import PooledOutput
+from CEDEN_Serializer import RecordWriter
+
+# the most partition files a process keeps open at once
+MAX_OPEN = 64
+# the text a partition keeps in memory before it is written, in characters. A PartitionWriter holds up to this much
+# for every partition.
+BUFFER_SIZE = 256 * 1024
+
+
+# HandlePool keeps the open files of the PooledOutputs, up to maxOpen of them. opened counts how many times a file
+# was opened, more than the number of files means they didn't all fit.
+class HandlePool:
+	def __init__(self, maxOpen=MAX_OPEN):
+		self.maxOpen = maxOpen
+		self.files = OrderedDict()
+		self.opened = 0
+
+	# handle returns the open file of output, and closes the least recently used one to make room for it
+	def handle(self, output):
+		fileOut = self.files.get(output)
+		if fileOut is not None:
+			self.files.move_to_end(output)
+			return fileOut
+		if len(self.files) >= self.maxOpen:
+			oldest, oldFile = self.files.popitem(last=False)
+			oldFile.close()
+		fileOut = self.files[output] = output.open_file()
+		self.opened += 1
+		return fileOut
+
+	# release closes the file of output, if it is open
+	def release(self, output):
+		fileOut = self.files.pop(output, None)
+		if fileOut is not None:
+			fileOut.close()
+
+
+# the pool of the PartitionWriters that aren't given one
+_handles = HandlePool()
+
+
+# PartitionWriter writes the records of a table in a file per partition. columns are the column names written as
+# the header of every file. key(record) returns the partition of a record, or None to leave it out. path(partition)
+# returns the file of a partition, its extension sets the compression (see CEDEN_Compression.py). rows is the number
+# of records of each partition.
+#       with PartitionWriter(columns, lambda record: record[ProgramSlot] or None,
+#                            lambda Program: os.path.join(folder, Program + '.csv'), ',') as programs:
+#           for record in records:
+#               programs.write(record)
+class PartitionWriter:
+	def __init__(self, columns, key, path, sep, handles=None, bufferSize=BUFFER_SIZE):
+		self.columns = columns
+		self.key = key
+		self.path = path
+		self.sep = sep
+		self.handles = handles or _handles
+		self.bufferSize = bufferSize
+		# the lines of every partition are made by the same RecordWriter, see CEDEN_Serializer.py
+		self.line = RecordWriter(None, sep).line
+		self.partitions = {}
+		self.rows = {}
+
+	# create starts the file of a partition with the header and returns it with the memory its lines are written in.
+	# write calls it for the first record of a partition, call it first for a partition that must have a file even
+	# without records.
+	def create(self, partition):
+		output = PooledOutput(self.path(partition), self.handles, bufferSize=self.bufferSize, report=False)
+		# the lines are written in the memory of the file, write spills it when it is full
+		output.text.write(self.line(self.columns))
+		self.partitions[partition] = (output, output.text.write)
+		self.rows[partition] = 0
+		return output, output.text.write
+
+	# write writes the record to its partition and returns the partition, or None when the record was left out
+	def write(self, record):
+		partition = self.key(record)
+		if partition is None:
+			return None
+		output, write = self.partitions.get(partition) or self.create(partition)
+		write(self.line(record))
+		if output.text.tell() >= self.bufferSize:
+			output.spill()
+		self.rows[partition] += 1
+		return partition
+
+	# close finishes every partition and returns their files (partition: path), in the order they were created. The
+	# compression of all the partitions is reported on one line.
+	def close(self):
+		written = {}
+		raw = compressed = seconds = 0
+		for partition, (output, write) in self.partitions.items():
+			output.close()
+			written[partition] = output.path
+			if output.compression:
+				raw, compressed, seconds = raw + output.raw, compressed + output.compressed, seconds + output.seconds
+		if compressed:
+			print("\tCompressed %d partitions: %.1f MB to %.1f MB (%.1fx) at %.1f MB/s" %
+			      (len(written), raw / 1e6, compressed / 1e6, raw / compressed, raw / 1e6 / max(seconds, 1e-6)))
+		return written
+
+	# abort leaves every partition unfinished, for a table that failed (see abort in CEDEN_Compression.py)
+	def abort(self):
+		for output, write in self.partitions.values():
+			output.abort()
+
+	def __enter__(self):
+		return self
+
+	def __exit__(self, excType, exc, traceback):
+		if excType is None:
+			self.close()
+		else:
+			self.abort()
@@ -0,0 +1,239 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module profiles a run of data_retrieval (CEDEN_DataRefresh.py). Every extraction job (a whole table, a
+shard or the changed years of an incremental table) is timed by stage:
+	query      running the query, until the DataMart answers with the columns
+	fetch      waiting on the DataMart for the next batch of rows (see CEDEN_Reader.py)
+	sanitize   cleaning the rows with decodeAndStrip and padding them into records (CEDEN_Sanitizer.py)
+	datum      looking up the datum of the station and keeping the sites (AllSites), or filling the station index for
+	           the WQX table
+	score      the data quality estimate (CEDEN_DataQuality.py)
+	serialize  turning the records into csv lines, for the main file, the date divided files and the subsets
+	io         hashing, compressing and writing the files (see io_seconds in CEDEN_Compression.py)
+	other      everything else: opening the files, the subsets, closing the files, ...
+with the number of rows and rows per second. When the records are written behind, on a thread of their own (see
+CEDEN_Writer.py), serialize is the time the job waited for that thread and io is 0. The time the thread spent
+writing and in the files is kept apart, in writeBehind, since it overlaps the other stages. The phases of the run (the stations, planning the jobs, the
+extraction, finishing the tables, the Parquet copies) are timed as well.
+	Every run writes a JSON report, <folder>\\DataMart_Profile_<date>.json, so runs can be compared between releases
+ie. to catch a change that made the data quality estimate slower. With deep=True the run is also profiled with
+cProfile and tracemalloc, in the worker processes as well. The report then holds the functions that took the most
+time, the peak memory and the lines that allocated the most, and the cProfile statistics are kept in .prof files
+next to the report (open them with pstats or snakeviz). A deep profile makes the run a lot slower, use it on a
+test run.
+
+'''
+
+import os
+import glob
+import json
+import time
+import platform
+import cProfile
+import pstats
+import tracemalloc
+from CEDEN_Compression import io_seconds
+
+PROFILE_VERSION = 1
+# the stages of a job in the order they are reported
+STAGES = ('query', 'fetch', 'sanitize', 'datum', 'score', 'serialize', 'io', 'other')
+# how many functions and allocation sites a deep profile keeps
+TOP = 25
+
+# the timings of the jobs this process ran, see take_timings
+_timings = []
+
+
+# take_timings returns the timings of the jobs this process ran since the last call, and forgets them. A worker
+# process hands them back with its result.
+def take_timings():
+	global _timings
+	timings, _timings = _timings, []
+	return timings
+
+
+# record_timings adds the timings of the jobs of a worker process to the ones of this process
+def record_timings(timings):
+	_timings.extend(timings)
+
+
+# TableTiming times one job of extract_table. The hot loop works on a batch of rows at a time, one stage after the
+# other, and calls lap at the end of each stage so the clock is only read a few times per batch:
+#       since = time.perf_counter()
+#       ... clean the batch ...
+#       since = timing.lap('sanitize', since)
+# finish adds the time waited on the reader and keeps the timing for the report.
+class TableTiming:
+	def __init__(self, filename, table, where=None):
+		self.filename = filename
+		self.table = table
+		self.where = where
+		self.stages = dict.fromkeys(('query', 'sanitize', 'datum', 'score', 'write'), 0.)
+		# the time spent in the files while the records were written, it is taken out of the write stage
+		self.writeIo = 0.
+		self.start = time.perf_counter()
+		self.io = self.lastIo = io_seconds()
+
+	# lap adds the time since since to stage and returns the time now, where the next stage starts
+	def lap(self, stage, since):
+		now = time.perf_counter()
+		self.stages[stage] += now - since
+		io = io_seconds()
+		if stage == 'write':
+			self.writeIo += io - self.lastIo
+		self.lastIo = io
+		return now
+
+	# finish keeps the timing of the job, reader is the BatchedReader the rows came from. behind is the WriteBehind
+	# (CEDEN_Writer.py) the records were written with, if any. Then serialize is only the time this thread waited for
+	# the writer thread and the time of the writer thread goes in writeBehind.
+	def finish(self, reader, behind=None):
+		seconds = time.perf_counter() - self.start
+		stages = {'query': self.stages['query'], 'fetch': reader.waitSeconds, 'sanitize': self.stages['sanitize'],
+		          'datum': self.stages['datum'], 'score': self.stages['score'],
+		          'serialize': max(self.stages['write'] - self.writeIo, 0.),
+		          'io': io_seconds() - self.io}
+		writeBehind = None
+		if behind is not None:
+			writeBehind = {'seconds': behind.writeSeconds, 'waited': behind.waitSeconds, 'io': stages['io']}
+			stages['serialize'], stages['io'] = behind.waitSeconds, 0.
+		stages['other'] = max(seconds - sum(stages.values()), 0.)
+		_timings.append({'table': self.filename, 'source': self.table, 'where': self.where, 'process': os.getpid(),
+		                 'rows': reader.rows, 'batches': reader.batches, 'arraysize': reader.arraysize,
+		                 'seconds': seconds, 'rowsPerSecond': reader.rows / seconds if seconds else 0.,
+		                 'stages': {stage: stages[stage] for stage in STAGES}, 'fetchmany': reader.fetchSeconds,
+		                 'reconnects': reader.dropped, 'writeBehind': writeBehind})
+
+
+# profiled runs function(*args, **kwargs) under cProfile and tracemalloc, for the jobs of the worker processes of a
+# deep profile. The statistics are dumped in prefix_<process>_<n>.prof and the peak memory goes with the timings of
+# the job.
+def profiled(prefix, function, *args, **kwargs):
+	count = len(_timings)
+	profiler = cProfile.Profile()
+	tracing = not tracemalloc.is_tracing()
+	if tracing:
+		tracemalloc.start()
+	tracemalloc.reset_peak()
+	profiler.enable()
+	try:
+		return function(*args, **kwargs)
+	finally:
+		profiler.disable()
+		peak = tracemalloc.get_traced_memory()[1]
+		if tracing:
+			tracemalloc.stop()
+		number = len(glob.glob('%s_%d_*.prof' % (prefix, os.getpid())))
+		profiler.dump_stats('%s_%d_%d.prof' % (prefix, os.getpid(), number))
+		for timing in _timings[count:]:
+			timing['memoryPeak'] = peak
+
+
+# RunProfile is the profile of a run, saved in folder. Call start before data_retrieval, hand it over, and save once
+# the run is done. deep=True also profiles the run with cProfile and tracemalloc, see above.
+class RunProfile:
+	def __init__(self, folder, deep=False, top=TOP):
+		self.folder = folder
+		self.deep = deep
+		self.top = top
+		self.started = time.time()
+		self.start_time = time.perf_counter()
+		# every file of the profile starts with prefix, the report is prefix.json
+		self.prefix = os.path.join(folder, 'DataMart_Profile_%s' % time.strftime('%Y%m%d_%H%M%S',
+		                                                                           time.localtime(self.started)))
+		self.phases = {}
+		self.jobs = []
+		self.profiler = None
+
+	def start(self):
+		os.makedirs(self.folder, exist_ok=True)
+		self.started = time.time()
+		self.start_time = time.perf_counter()
+		if self.deep:
+			tracemalloc.start()
+			self.profiler = cProfile.Profile()
+			self.profiler.enable()
+
+	# worker_prefix is handed to the worker processes, they profile their jobs when it isn't None
+	def worker_prefix(self):
+		return self.prefix if self.deep else None
+
+	# record keeps the time of the phases of data_retrieval (name: seconds) and the timings of its jobs
+	def record(self, phases, timings):
+		for name, seconds in phases.items():
+			self.phases[name] = self.phases.get(name, 0.) + seconds
+		self.jobs += timings
+
+	# tables adds up the jobs of each table
+	def tables(self):
+		tables = {}
+		for job in self.jobs:
+			table = tables.setdefault(job['table'], {'jobs': 0, 'rows': 0, 'seconds': 0.,
+			                                         'stages': dict.fromkeys(STAGES, 0.)})
+			table['jobs'] += 1
+			table['rows'] += job['rows']
+			table['seconds'] += job['seconds']
+			for stage in STAGES:
+				table['stages'][stage] += job['stages'][stage]
+		for table in tables.values():
+			table['rowsPerSecond'] = table['rows'] / table['seconds'] if table['seconds'] else 0.
+		return tables
+
+	# _deep stops the profilers and returns what they found: the functions with the most time of their own (this
+	# process and the workers), the peak memory of this process and the lines that allocated the most
+	def _deep(self):
+		self.profiler.disable()
+		snapshot = tracemalloc.take_snapshot()
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+		mainProfile = self.prefix + '_main.prof'
+		self.profiler.dump_stats(mainProfile)
+		profiles = [mainProfile] + sorted(glob.glob(self.prefix + '_[0-9]*.prof'))
+		stats = pstats.Stats(*profiles)
+		functions = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)[:self.top]
+		allocations = snapshot.statistics('lineno')[:self.top]
+		return {'memoryPeak': peak,
+		        'allocations': [{'line': str(statistic.traceback[0]), 'bytes': statistic.size,
+		                         'count': statistic.count} for statistic in allocations],
+		        'functions': [{'function': '%s:%d(%s)' % (os.path.basename(file), line, name), 'calls': calls,
+		                       'seconds': own, 'cumulative': cumulative}
+		                      for (file, line, name), (primitive, calls, own, cumulative, callers) in functions],
+		        'profiles': profiles}
+
+	# save writes the report, prints a summary and returns the path of the report. settings are the settings of
+	# the run worth comparing runs by (workers, arraysize, ...), they have to be JSON.
+	def save(self, **settings):
+		report = {'version': PROFILE_VERSION, 'started': time.strftime('%Y-%m-%d %H:%M:%S',
+		                                                                 time.localtime(self.started)),
+		          'seconds': time.perf_counter() - self.start_time, 'python': platform.python_version(),
+		          'platform': platform.platform(), 'settings': settings, 'phases': self.phases,
+		          'tables': self.tables(), 'jobs': self.jobs}
+		if self.deep:
+			report['deep'] = self._deep()
+		os.makedirs(self.folder, exist_ok=True)
+		with open(self.prefix + '.json', 'w', encoding='utf8') as reportOut:
+			json.dump(report, reportOut, indent=1)
+		print_profile(report)
+		print("The profile of this run is in %s" % (self.prefix + '.json'))
+		return self.prefix + '.json'
+
+
+# print_profile prints the time of each table by stage and the phases of the run
+def print_profile(report):
+	print("\n%-30s %11s %8s %8s " % ('table', 'rows', 'sec', 'rows/s') + ' '.join('%9s' % stage for stage in STAGES))
+	for filename, table in report['tables'].items():
+		print("%-30s %11d %8.1f %8.0f " % (filename[:30], table['rows'], table['seconds'], table['rowsPerSecond']) +
+		      ' '.join('%9.1f' % table['stages'][stage] for stage in STAGES))
+	print(', '.join('%s %.1f sec' % (name, seconds) for name, seconds in report['phases'].items()))
+	if 'deep' in report:
+		print("Peak memory %.1f MB, the slowest functions:" % (report['deep']['memoryPeak'] / 1e6))
+		for function in report['deep']['functions'][:10]:
+			print("\t%8.2f sec %10d calls  %s" % (function['seconds'], function['calls'], function['function']))
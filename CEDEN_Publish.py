@@ -0,0 +1,143 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module uploads the datasets while the rest are still being made. The uploads used to start once every
+table, subset and the All_CEDEN_Sites file were written, so the network time added up with the extraction time.
+data_retrieval (CEDEN_DataRefresh.py) and selectByAnalyte push each file on a PublishQueue as soon as it is final,
+and a few background threads upload it right away with an UploadScheduler (CEDEN_Upload.py).
+	The queue is kept in a file. A file is written to it when it is pushed and taken off once it was uploaded, so
+after a crash the queue file holds the uploads that didn't finish. The next run resumes them, or they can be sent
+on their own, without making the datasets again:
+
+	python CEDEN_Publish.py <save location>\\CEDEN_PublishQueue.json [<save location>\\CEDEN_Manifest.json]
+
+with the DCG_user, DCG_pw and URI environment variables set like for CEDEN_DataRefresh.py.
+
+'''
+
+import os
+import sys
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from CEDEN_Upload import UploadScheduler, StreamingClient, print_report
+from CEDEN_Manifest import Manifest
+
+QUEUE_VERSION = 1
+
+
+# PublishQueue uploads the files pushed on it in the background. nodes is a dictionary of FILES key: node number
+# (ie. {'BenthicData': 431, }), files that are not in it are not published. scheduler is the UploadScheduler that
+# sends them, it sets the number of threads.
+class PublishQueue:
+	def __init__(self, queueFile, nodes, scheduler):
+		self.queueFile = queueFile
+		self.nodes = nodes
+		self.scheduler = scheduler
+		self.lock = threading.Lock()
+		# the uploads that didn't finish, path: node. The ones left over from the last run are resumed by resume().
+		self.pending = self._load()
+		self.leftover = dict(self.pending)
+		self.pool = ThreadPoolExecutor(max_workers=scheduler.workers)
+		self.futures = []
+		self.start = time.perf_counter()
+
+	def _load(self):
+		if not self.queueFile or not os.path.isfile(self.queueFile):
+			return {}
+		try:
+			with open(self.queueFile, 'r', encoding='utf8') as queueIn:
+				queue = json.load(queueIn)
+		except ValueError:
+			return {}
+		if queue.get('version') != QUEUE_VERSION:
+			return {}
+		return queue['uploads']
+
+	# _save writes the queue next to the old one and then replaces it, so a crash never leaves half a queue
+	def _save(self):
+		if not self.queueFile:
+			return
+		with open(self.queueFile + '.tmp', 'w', encoding='utf8') as queueOut:
+			json.dump({'version': QUEUE_VERSION, 'uploads': self.pending}, queueOut, indent=1, sort_keys=True)
+		os.replace(self.queueFile + '.tmp', self.queueFile)
+
+	# resume uploads what was left in the queue by the last run and returns the number of files
+	def resume(self):
+		for path, node in self.leftover.items():
+			if os.path.isfile(path):
+				print("Resuming the upload of %s from the last run" % os.path.basename(path))
+				self._submit(path, node)
+			else:
+				with self.lock:
+					self.pending.pop(path, None)
+					self._save()
+		count = len(self.leftover)
+		self.leftover = {}
+		return count
+
+	# push uploads the file of a FILES key if it has a node
+	def push(self, name, path):
+		node = self.nodes.get(name)
+		if node is None or not os.path.isfile(path):
+			return
+		path = os.path.abspath(path)
+		# the manifest needs the file to tell if it changed since it was last published
+		if self.scheduler.manifest is not None:
+			self.scheduler.manifest.update([path])
+		with self.lock:
+			self.pending[path] = node
+			self._save()
+		self._submit(path, node)
+
+	# push_files pushes every file of a writtenFiles dictionary
+	def push_files(self, files):
+		for name, path in files.items():
+			self.push(name, path)
+
+	def _submit(self, path, node):
+		print("\tQueued %s for node %s" % (os.path.basename(path), node))
+		self.futures += [self.pool.submit(self._upload, path, node)]
+
+	def _upload(self, path, node):
+		report = self.scheduler.upload(path, node)
+		if report['ok']:
+			with self.lock:
+				self.pending.pop(path, None)
+				self._save()
+		return report
+
+	# wait returns once every upload pushed so far is done, with their reports
+	def wait(self):
+		return [future.result() for future in list(self.futures)]
+
+	# close waits for the uploads, prints their report and returns it. The failed ones stay in the queue file.
+	def close(self):
+		reports = self.wait()
+		self.pool.shutdown()
+		print_report(reports, time.perf_counter() - self.start)
+		with self.lock:
+			if self.pending:
+				print("%d uploads didn't finish, they are still in %s" % (len(self.pending), self.queueFile))
+		return reports
+
+
+# sends what is left in a queue file, see above. With the manifest, the files are marked as published in it.
+if __name__ == "__main__":
+	queueFile = sys.argv[1]
+	manifest = Manifest(sys.argv[2]) if len(sys.argv) > 2 else None
+	user = os.environ.get('DCG_user')
+	password = os.environ.get('DCG_pw')
+	URI = os.environ.get('URI')
+	scheduler = UploadScheduler(lambda: StreamingClient(URI, user, password), workers=3, manifest=manifest)
+	publish = PublishQueue(queueFile, {}, scheduler)
+	print("%d uploads left in %s" % (publish.resume(), queueFile))
+	publish.close()
@@ -0,0 +1,134 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module builds the SELECT statements used by data_retrieval (CEDEN_DataRefresh.py). Instead of
+"SELECT * FROM table" and renaming the columns in python afterwards, every table is declared with a TableQuery:
+which columns are left out, how columns are renamed and, optionally, a filter that is applied by the server. The
+column list, the aliases and the filters all end up in the SQL so the DataMart only sends what is published.
+	Names are quoted with [brackets] and values are passed as ? parameters, which both SQL Server (pyodbc) and
+SQLite understand, so the queries can be tried against a SQLite copy of a few DataMart tables (see
+WorkingScripts/Test_QueryBuilder.py).
+
+'''
+
+# The non IR datasets publish TargetLatitude and TargetLongitude as Latitude and Longitude
+RENAME_TARGET = (('TargetL', 'L'), )
+# data_retrieval works out the data quality of every record but the WQX stations and adds these columns itself. A
+# view that carries its own copy of them would publish them twice, so they are never selected.
+COMPUTED_COLUMNS = ('DataQuality', 'DataQualityIndicator')
+
+
+# quote_name puts a column or table name in brackets so names with spaces or reserved words are safe
+def quote_name(name):
+	return '[%s]' % name.replace(']', ']]')
+
+
+# in_clause returns a "column IN (?, ?, ...)" filter and its parameters, ie. to only get some analytes
+def in_clause(column, values):
+	values = list(values)
+	if not values:
+		# nothing can match an empty list
+		return '1 = 0', []
+	return '%s IN (%s)' % (quote_name(column), ', '.join('?' for value in values)), values
+
+
+# range_clause returns a "start <= column < end" filter and its parameters. Either end can be None to leave it open.
+def range_clause(column, start=None, end=None):
+	clauses = []
+	params = []
+	if start is not None:
+		clauses += ['%s >= ?' % quote_name(column)]
+		params += [start]
+	if end is not None:
+		clauses += ['%s < ?' % quote_name(column)]
+		params += [end]
+	return ' AND '.join(clauses) or '1 = 1', params
+
+
+# and_clauses joins filters (clause, params) with AND, leaving out the empty ones
+def and_clauses(*filters):
+	clauses = []
+	params = []
+	for clause, clauseParams in filters:
+		if clause:
+			clauses += ['(%s)' % clause]
+			params += list(clauseParams)
+	return ' AND '.join(clauses), params
+
+
+# or_clauses joins filters (clause, params) with OR, ie. the filters of the subsets of a table. No filter at all
+# matches nothing.
+def or_clauses(*filters):
+	clauses = []
+	params = []
+	for clause, clauseParams in filters:
+		clauses += ['(%s)' % clause]
+		params += list(clauseParams)
+	return ' OR '.join(clauses) or '1 = 0', params
+
+
+# TableQuery declares how one DataMart table is queried.
+#   table is the DataMart name, exclude are the columns that are not published, aliases renames whole column names
+#   ({'DataMartName': 'PublishedName'}) and rename replaces part of every column name (RENAME_TARGET turns
+#   TargetLatitude into Latitude). where and params are a filter applied to every query of the table, for example
+#   in_clause('Analyte', SafeToSwim_analytes) or range_clause('SampleDate', '2000-01-01').
+class TableQuery:
+	def __init__(self, table, exclude=(), aliases=None, rename=(), where=None, params=()):
+		self.table = table
+		self.exclude = frozenset(exclude)
+		self.aliases = aliases or {}
+		self.rename = tuple(rename)
+		self.where = where
+		self.params = list(params)
+		self.available = None
+
+	# columns asks the DataMart for the column names of the table without reading any record. They are only asked for
+	# once, the query keeps them for when it runs again (a dropped connection, another shard or the worker processes
+	# it is handed to, see data_retrieval).
+	def columns(self, cursor):
+		if self.available is None:
+			cursor.execute("SELECT * FROM %s WHERE 1 = 0" % self.table)
+			self.available = [desc[0] for desc in cursor.description]
+		return self.available
+
+	# alias returns the published name of a DataMart column
+	def alias(self, column):
+		if column in self.aliases:
+			return self.aliases[column]
+		for old, new in self.rename:
+			column = column.replace(old, new)
+		return column
+
+	# select returns the SELECT statement and its parameters. where and params are an extra filter for this query
+	# only (a shard or the years of an incremental refresh). available are the columns of the table, see columns().
+	def select(self, available, where=None, params=()):
+		projection = []
+		for column in available:
+			if column in self.exclude:
+				continue
+			if self.alias(column) == column:
+				projection += [quote_name(column)]
+			else:
+				projection += ['%s AS %s' % (quote_name(column), quote_name(self.alias(column)))]
+		sql = 'SELECT %s FROM %s' % (', '.join(projection), self.table)
+		clause, clauseParams = and_clauses((self.where, self.params), (where, params))
+		if clause:
+			sql += ' WHERE %s' % clause
+		return sql, clauseParams
+
+	# execute runs the query of the table on cursor and returns the published column names
+	def execute(self, cursor, where=None, params=()):
+		sql, sqlParams = self.select(self.columns(cursor), where, params)
+		# pyodbc and sqlite3 both take the parameters as a single list
+		if sqlParams:
+			cursor.execute(sql, sqlParams)
+		else:
+			cursor.execute(sql)
+		return [desc[0] for desc in cursor.description]
@@ -0,0 +1,227 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module holds the BatchedReader used by CEDEN_DataRefresh.py and FHAB_BloomReport.py to read rows
+from a pyodbc cursor. Instead of asking the DataMart for one row at a time with "for row in cursor", rows are
+pulled with cursor.fetchmany() in batches of arraysize rows. The next batch is fetched on a background thread
+while the current one is being cleaned and scored so the ODBC round trips and the python work overlap.
+pyodbc lets go of the GIL while it waits on the server which is what makes the thread worthwhile.
+	When the connection to the DataMart drops while the rows are read, the reader can connect again, run the query
+again and skip the rows it already has, so a table that was read for hours doesn't have to start over. See
+reconnect in BatchedReader and Reconnecting.
+	The reader keeps the time spent in fetchmany (fetchSeconds) and the time the rows were waited for (waitSeconds)
+for the profile of a run, see CEDEN_Profile.py. With prefetch the wait is what the background thread didn't hide.
+
+'''
+
+import sys
+import time
+import threading
+import queue
+
+# default number of rows per fetchmany call
+ARRAYSIZE = 5000
+# never go outside of these when auto tuning the arraysize
+MIN_ARRAYSIZE = 100
+MAX_ARRAYSIZE = 20000
+# default memory we are willing to hold in fetched batches (the batch in use plus the ones waiting in line)
+MEMORY_CEILING = 256 * 1024 * 1024
+# how many times a reader connects again after the connection dropped before it gives up
+RECONNECTS = 3
+# the SQLSTATE of the errors that mean the connection is gone: the 08 class (connection exception) and the timeouts
+DISCONNECTED = ('08', 'HYT00', 'HYT01')
+
+
+# row_width estimates how many bytes a row takes in memory. It is only used to pick a batch size so it does
+# not need to be exact.
+def row_width(row):
+	return sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row)
+
+
+# is_disconnect is True when a database error means the connection dropped. pyodbc gives the SQLSTATE as the first
+# argument of its errors, ie. ('08S01', '[08S01] ... Communication link failure').
+def is_disconnect(error):
+	if isinstance(error, (ConnectionError, TimeoutError)):
+		return True
+	state = str(error.args[0]) if error.args else ''
+	return len(state) == 5 and state.startswith(DISCONNECTED)
+
+
+# Reconnecting keeps the connection made by connect, a function that returns a connection and its cursor like
+# DataMart_connect (CEDEN_DataRefresh.py), and makes a new one when the old one dropped. Use its cursor attribute
+# after a reconnect, the old cursor is gone.
+class Reconnecting:
+	def __init__(self, connect):
+		self.connect = connect
+		self.cnxn, self.cursor = connect()
+
+	# reconnect closes what is left of the connection and returns the cursor of a new one. A connection of a
+	# ConnectionPool (CEDEN_Backend.py) that dropped is thrown away instead of being given back to the pool.
+	def reconnect(self):
+		discard = getattr(self.cnxn, 'discard', None)
+		if discard is not None:
+			discard()
+		else:
+			self.close()
+		self.cnxn, self.cursor = self.connect()
+		return self.cursor
+
+	def close(self):
+		try:
+			self.cnxn.close()
+		except Exception:
+			# the connection is already gone
+			pass
+
+
+# BatchedReader wraps a cursor that has already been executed. Iterate over it just like the cursor itself:
+#       for row in BatchedReader(cursor):
+#   arraysize is the number of rows per fetchmany call. prefetch=False fetches on the calling thread, which is
+#   useful to measure what the background thread buys us. autoTune=True resizes the batches after the first
+#   one from the observed row width so that the batches waiting in line, the one being fetched and the one in
+#   use (prefetchDepth + 2) all fit in memoryCeiling bytes.
+#   reconnect is a function that connects again, runs the query again and returns the new cursor. When the
+#   connection drops, the reader calls it (up to reconnects times) and skips the rows it read before, so the
+#   rows keep coming from where they stopped. That needs the query to give the rows in the same order, the last row
+#   read is checked against the new cursor to be sure.
+#   fetchSeconds is the time spent in fetchmany, waitSeconds the time iter_batches waited for a batch.
+class BatchedReader:
+	def __init__(self, cursor, arraysize=ARRAYSIZE, prefetch=True, prefetchDepth=2, autoTune=False,
+	             memoryCeiling=MEMORY_CEILING, reconnect=None, reconnects=RECONNECTS):
+		self.cursor = cursor
+		self.arraysize = arraysize
+		self.prefetch = prefetch
+		self.prefetchDepth = prefetchDepth
+		self.autoTune = autoTune
+		self.memoryCeiling = memoryCeiling
+		self.rows = 0
+		self.batches = 0
+		self.rowWidth = None
+		self.reconnect = reconnect
+		self.reconnects = reconnects
+		self.dropped = 0
+		self.fetchSeconds = 0.
+		self.waitSeconds = 0.
+		self._skip = 0
+		self._last = None
+		self._thread = None
+		self._stop = threading.Event()
+
+	def __iter__(self):
+		for batch in self.iter_batches():
+			yield from batch
+
+	# iter_batches yields lists of rows. Use it when the whole batch is processed at once.
+	def iter_batches(self):
+		if not self.prefetch:
+			while True:
+				start = time.perf_counter()
+				batch = self._fetch()
+				self.waitSeconds += time.perf_counter() - start
+				if not batch:
+					return
+				yield batch
+		# the queue is bounded so the fetching thread can't get more than prefetchDepth batches ahead of us
+		batches = queue.Queue(maxsize=self.prefetchDepth)
+		self._stop.clear()
+		self._thread = threading.Thread(target=self._fetcher, args=(batches, ), daemon=True)
+		self._thread.start()
+		try:
+			while True:
+				start = time.perf_counter()
+				batch = batches.get()
+				self.waitSeconds += time.perf_counter() - start
+				if batch is None:
+					return
+				if isinstance(batch, BaseException):
+					# something went wrong on the fetching thread, raise it here where it can be handled
+					raise batch
+				yield batch
+		finally:
+			# stop the fetching thread if we were not iterated to the end
+			self._stop.set()
+			while self._thread.is_alive():
+				try:
+					batches.get_nowait()
+				except queue.Empty:
+					self._thread.join(0.05)
+
+	# _fetch gets the next batch from the cursor and keeps count of what was read. A dropped connection is
+	# connected again, see reconnect above.
+	def _fetch(self):
+		start = time.perf_counter()
+		while True:
+			try:
+				if self._skip:
+					self._skip_read()
+				batch = self.cursor.fetchmany(self.arraysize)
+				break
+			except Exception as error:
+				if self.reconnect is None or not is_disconnect(error) or self.dropped >= self.reconnects:
+					raise
+				self.dropped += 1
+				print("\tThe connection dropped after %d rows (%s), connecting again" % (self.rows, error))
+				self.cursor = self.reconnect()
+				self._skip = self.rows
+		self.fetchSeconds += time.perf_counter() - start
+		if batch:
+			self.rows += len(batch)
+			self.batches += 1
+			self._last = batch[-1]
+			if self.autoTune and self.batches == 1:
+				self.tune(batch)
+		return batch
+
+	# _skip_read reads past the rows that were read before the connection dropped
+	def _skip_read(self):
+		last = None
+		while self._skip:
+			batch = self.cursor.fetchmany(min(self._skip, self.arraysize))
+			if not batch:
+				break
+			self._skip -= len(batch)
+			last = batch[-1]
+		if self._skip or tuple(last) != tuple(self._last):
+			raise RuntimeError("The rows didn't come back in the same order after connecting again, the query has "
+			                   "to be read from the start")
+		print("\tSkipped the %d rows read before the connection dropped" % self.rows)
+
+	# _fetcher runs on the background thread. It puts batches on the queue until the cursor runs out, then
+	# puts None. Errors are put on the queue so they get raised on the reading thread.
+	def _fetcher(self, batches):
+		try:
+			while not self._stop.is_set():
+				batch = self._fetch()
+				if not batch:
+					break
+				while not self._stop.is_set():
+					try:
+						batches.put(batch, timeout=0.1)
+						break
+					except queue.Full:
+						continue
+			else:
+				return
+			batches.put(None)
+		except BaseException as error:
+			batches.put(error)
+
+	# tune picks a new arraysize from the average row width of a batch and the memory ceiling
+	def tune(self, batch):
+		sample = batch[:100]
+		self.rowWidth = sum(row_width(row) for row in sample) / len(sample)
+		fits = int(self.memoryCeiling / (self.rowWidth * (self.prefetchDepth + 2)))
+		self.arraysize = max(MIN_ARRAYSIZE, min(MAX_ARRAYSIZE, fits))
+		try:
+			# let the driver know as well, pyodbc uses it as the default for fetchmany
+			self.cursor.arraysize = self.arraysize
+		except AttributeError:
+			pass
+		return self.arraysize
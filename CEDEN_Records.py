@@ -0,0 +1,51 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module holds the record layout used by data_retrieval (CEDEN_DataRefresh.py), selectByAnalyte and the FHAB
+scripts. Those used to turn every row into a dictionary with dict(zip(columns, row)), look the values up by name
+and turn the dictionary back into a list with list(recordDict.values()) for each writer. That is two new objects
+per row, on tables with tens of millions of rows. A RecordLayout works out once per table where each column sits in
+the record, so the cleaned row list itself is the record: it is changed in place by index and handed to the
+writers as is.
+	A record is exactly what list(dict(zip(columns, row)).values()) used to give. When a column name is repeated
+the record keeps the name in its first position with the value of its last position, and missing values at the
+end are ''. Almost no table has a repeated name, then the row is used without any copy.
+
+'''
+
+
+# RecordLayout is built once per table from its column names. slots gives the position of a column in a record and
+# record() turns a row in the order of columns into a record.
+class RecordLayout:
+	def __init__(self, columns):
+		# the header of the written files, one entry per name like the keys of the old recordDict
+		self.columns = list(dict.fromkeys(columns))
+		self.slots = {name: i for i, name in enumerate(self.columns)}
+		self.width = len(columns)
+		# where a row keeps the value of each name, the last one when a name is repeated
+		sources = {name: i for i, name in enumerate(columns)}
+		if len(self.columns) == len(columns):
+			self.take = None
+		else:
+			self.take = [sources[name] for name in self.columns]
+
+	# slot returns the position of a column in a record, it raises a KeyError for a missing column like
+	# recordDict[name] did
+	def slot(self, name):
+		return self.slots[name]
+
+	# record pads a row with '' up to the number of columns and returns it as a record. The row list is reused
+	# when it can be so it must be a list that isn't needed afterwards (the output of Sanitizer.clean_row).
+	def record(self, row):
+		if len(row) < self.width:
+			row += [''] * (self.width - len(row))
+		if self.take is None:
+			return row
+		return [row[i] for i in self.take]
@@ -0,0 +1,75 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module strips every character that is not in the printable filter from the values written by
+CEDEN_DataRefresh.py, FHAB_BloomReport.py and WorkingScripts/FHAB_update.py. It replaces the decodeAndStrip
+function each of those scripts had, which did ''.join(filter(lambda x: x in printable, str(t))), a python call for
+every character of every value. The Sanitizer gives the exact same result but compiles the filter into a single
+regular expression character class, so the scan happens in C. Almost every value in the DataMart is already clean,
+so a whole row is checked at once and returned as is when nothing needs to be removed. Only rows with something to
+strip are cleaned value by value.
+	The scripts don't all remove the same characters. Each one is a profile below; printable_for returns the
+printable filter of a profile. See WorkingScripts/Benchmark_Sanitizer.py for the speed up.
+
+'''
+
+import re
+import string
+
+# the characters each script removes from string.printable
+PROFILES = {
+	# pipes, quotes, tabs, returns, control breaks, etc.
+	'CEDEN': '|"\t\r\n\f\v',
+	# the same plus backslash and back quote. The original filter was written '|"\`\t\r\n\f\v', where \` is a
+	# backslash followed by a back quote, so both were removed.
+	'FHAB_BloomReport': '|"\\`\t\r\n\f\v',
+	# the same as CEDEN plus single and back quotes
+	'FHAB_update': '|"\'`\t\r\n\f\v',
+}
+
+
+# printable_for returns the printable filter (a set of characters) of a profile
+def printable_for(profile):
+	return set(string.printable) - set(PROFILES[profile])
+
+
+# Sanitizer removes the characters that are not in printable, a set of characters like the printable variable of
+# the scripts.
+class Sanitizer:
+	def __init__(self, printable):
+		self.printable = frozenset(printable)
+		# matches any character that is not allowed
+		pattern = re.compile('[^%s]' % ''.join(re.escape(character) for character in sorted(self.printable)))
+		self._search = pattern.search
+		self._sub = pattern.sub
+
+	# clean returns the value as a string without the characters that are not allowed. A clean string is returned
+	# untouched.
+	def clean(self, value):
+		text = value if type(value) is str else str(value)
+		if self._search(text) is None:
+			return text
+		return self._sub('', text)
+
+	# clean_row cleans every value of a row at once and returns them as a list. None becomes '', like the scripts
+	# did so that None isn't written as 'None'.
+	def clean_row(self, row):
+		values = ['' if value is None else value if type(value) is str else str(value) for value in row]
+		# one scan of the whole row, nearly every row is already clean
+		if self._search(''.join(values)) is None:
+			return values
+		search = self._search
+		sub = self._sub
+		return [value if search(value) is None else sub('', value) for value in values]
+
+	# clean_rows cleans a batch of rows, ie. what BatchedReader or fetchmany returns
+	def clean_rows(self, rows):
+		clean_row = self.clean_row
+		return [clean_row(row) for row in rows]
@@ -0,0 +1,72 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module decides the order in which data_retrieval (CEDEN_DataRefresh.py) hands tables to the worker
+processes when it runs in parallel. The tables are very uneven in size (WaterChemistry is many times larger than
+Benthic or Habitat) so the largest tables are started first. That way a big table never starts last and
+keeps a single worker busy long after the others are done. Table sizes come from the row counts of the previous
+run, which are saved next to the datasets, or from a COUNT(*) on the DataMart when there is no history yet.
+
+'''
+
+import os
+import json
+
+
+# load_history reads the row counts of the previous run. A missing or broken file just means no history.
+def load_history(historyFile):
+	if not historyFile or not os.path.isfile(historyFile):
+		return {}
+	try:
+		with open(historyFile, 'r', encoding='utf8') as history:
+			return {table: int(rows) for table, rows in json.load(history).items()}
+	except (ValueError, AttributeError, TypeError):
+		return {}
+
+
+# save_history adds the row counts of this run to the history file, keeping the counts of tables that were not
+# part of this run (ie. the IR tables when running the weekly tables)
+def save_history(historyFile, counts):
+	if not historyFile:
+		return
+	history = load_history(historyFile)
+	history.update(counts)
+	with open(historyFile, 'w', encoding='utf8') as historyOut:
+		json.dump(history, historyOut, indent=1, sort_keys=True)
+
+
+# preflight_counts asks the DataMart how many rows are in each table. It is only used for the tables that are
+# not in the history since a COUNT(*) on the largest views is not free.
+def preflight_counts(cursor, tables):
+	counts = {}
+	for table in tables:
+		try:
+			cursor.execute("SELECT COUNT(*) FROM %s" % table)
+			counts[table] = int(cursor.fetchone()[0])
+		except Exception:
+			# we can still run without a count, the table will just be scheduled last
+			print("\tCouldn't count the rows in %s" % table)
+	return counts
+
+
+# table_counts returns the known or counted number of rows for every table in the tables dictionary
+def table_counts(cursor, tables, historyFile=None):
+	counts = load_history(historyFile)
+	missing = [table for table in tables.values() if table not in counts]
+	if missing and cursor is not None:
+		counts.update(preflight_counts(cursor, missing))
+	return {table: counts[table] for table in tables.values() if table in counts}
+
+
+# largest_first returns the filenames of the tables dictionary ordered from the largest to the smallest table.
+# Tables with the same (or no) count keep the order they have in the tables dictionary.
+def largest_first(tables, counts):
+	order = list(tables)
+	return sorted(order, key=lambda filename: (-counts.get(tables[filename], -1), order.index(filename)))
@@ -0,0 +1,101 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module turns the records of data_retrieval (CEDEN_DataRefresh.py) into lines of text. It replaces the
+csv.writer(fileOut, csv.QUOTE_MINIMAL, delimiter=sep, lineterminator='\\n') of the full files, the date divided files
+and the subsets, and writes exactly the same bytes.
+	The csv module looks at every character of every value to find what needs quoting, then the text layer encodes
+every line on its own. But the values of a record went through the Sanitizer (CEDEN_Sanitizer.py) so there are no
+quotes, tabs, returns or new lines left in them. The only thing that can need quoting is the delimiter, ie. the
+commas of 'Oxygen, Dissolved, Total' or of a DataQualityIndicator in a CEDEN file, and since there are no quotes in
+the value it only needs a quote on each side. A RecordWriter checks a whole record at once, joins its values with the
+delimiter and only quotes the values that have one. The rare record with a quote, a return or a new line, or with a
+value that isn't a string (a Longitude made negative is a float), is written by the csv module like before. A batch
+of records is encoded in one go and written to a binary file, see open_output(..., binary=True) in
+CEDEN_Compression.py.
+	See WorkingScripts/Benchmark_Serializer.py for the speed up.
+
+'''
+
+import io
+import re
+import csv
+
+# the most lines encoded and written at once by writerows
+CHUNK = 1000
+
+
+# RecordWriter writes records (lists of values) to fileOut, a binary file, as lines of values separated by sep.
+#       writer = RecordWriter(fileOut, ',')
+#       writer.writerow(columns)
+#       writer.writerows(records)
+# fileOut can be None when only line is used. quoted is the number of records that went through the csv module.
+class RecordWriter:
+	def __init__(self, fileOut, sep):
+		self.fileOut = fileOut
+		self.sep = sep
+		# matches what the csv module quotes other than the delimiter
+		self._search = re.compile('["\r\n]').search
+		self._text = io.StringIO()
+		self._csv = csv.writer(self._text, csv.QUOTE_MINIMAL, delimiter=sep, lineterminator='\n')
+		self.quoted = 0
+
+	# line returns the text of a record, with its '\n'
+	def line(self, record):
+		try:
+			text = ''.join(record)
+			# a single value is left to the csv module, it writes an empty one as ""
+			if len(record) > 1 and self._search(text) is None:
+				sep = self.sep
+				if sep not in text:
+					return sep.join(record) + '\n'
+				return sep.join(['"%s"' % value if sep in value else value for value in record]) + '\n'
+		except TypeError:
+			# a value that isn't a string
+			pass
+		return self._quote(record)
+
+	# _quote returns the text the csv module writes for a record
+	def _quote(self, record):
+		self.quoted += 1
+		self._text.seek(0)
+		self._text.truncate()
+		self._csv.writerow(record)
+		return self._text.getvalue()
+
+	def writerow(self, record):
+		self.fileOut.write(self.line(record).encode('utf8'))
+
+	# writerows writes a batch of records, CHUNK lines per write. It does what line does for every record, without a
+	# call for each.
+	def writerows(self, records):
+		for start in range(0, len(records), CHUNK):
+			self._write_chunk(records[start:start + CHUNK])
+
+	def _write_chunk(self, records):
+		sep = self.sep
+		join = sep.join
+		search = self._search
+		lines = []
+		add = lines.append
+		for record in records:
+			try:
+				text = ''.join(record)
+				if len(record) > 1 and search(text) is None:
+					if sep not in text:
+						add(join(record))
+					else:
+						add(join(['"%s"' % value if sep in value else value for value in record]))
+					continue
+			except TypeError:
+				pass
+			add(self._quote(record)[:-1])
+		lines.append('')
+		self.fileOut.write('\n'.join(lines).encode('utf8'))
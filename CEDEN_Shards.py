@@ -0,0 +1,132 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module lets data_retrieval (CEDEN_DataRefresh.py) split one very large table (WQDMart_MV, IR2018_WQ)
+into shards that are extracted at the same time over separate connections. A cheap GROUP BY query on a numeric
+key (the SampleDate year by default) gives a histogram of the table, the histogram is cut into ranges with about
+the same number of records and each range becomes the WHERE clause of one shard. Every shard writes its own copy
+of the table's files in a temporary folder and stitch_shards puts them back together, in the order of the ranges,
+as the usual WaterChemistryData, _prior_to_1999, _2000-2009, _2010-present and subset files.
+
+'''
+
+import os
+import csv
+import shutil
+from CEDEN_Compression import open_output, open_input
+
+# the default key used to split a table. It has to be numeric so the ranges can be written as < and >=.
+SHARD_KEY = 'YEAR(SampleDate)'
+# the IR views that report SampleDate as monthdayyear text (ie. '06012015') instead of a datetime. Their year is the
+# last four characters, cast to a number so it compares as one on every backend.
+TEXT_DATES = ('IR2018_WQ', 'IR2018_Tissue')
+TEXT_DATE_KEY = 'CAST(RIGHT(SampleDate, 4) AS INT)'
+# temporary folder, inside the save location, where the shards are written
+SHARD_FOLDER = 'Shards'
+
+
+# table_key is the key of a table (a view of the DataMart): shardKey when one is given, otherwise the SampleDate year
+# in the format of the view
+def table_key(table, shardKey=None):
+	if shardKey:
+		return shardKey
+	return TEXT_DATE_KEY if table in TEXT_DATES else SHARD_KEY
+
+
+# histogram runs a GROUP BY on the key and returns a dictionary of key value: number of records. Records with a
+# NULL key are counted under None.
+def histogram(cursor, table, key=SHARD_KEY):
+	cursor.execute("SELECT %s, COUNT(*) FROM %s GROUP BY %s" % (key, table, key))
+	counts = {}
+	for keyValue, records in cursor.fetchall():
+		counts[keyValue] = counts.get(keyValue, 0) + int(records)
+	return counts
+
+
+# split_histogram cuts the sorted key values of a histogram into at most shards ranges holding about the same
+# number of records. It returns the lower bound of every range after the first one. A single key value is never
+# split so a table with fewer distinct values than shards gets fewer ranges.
+def split_histogram(counts, shards):
+	keys = sorted(keyValue for keyValue in counts if keyValue is not None)
+	total = sum(counts[keyValue] for keyValue in keys)
+	boundaries = []
+	running = 0
+	for keyValue in keys:
+		if running >= total * (len(boundaries) + 1) / shards and len(boundaries) < shards - 1:
+			boundaries += [keyValue]
+		running += counts[keyValue]
+	return boundaries
+
+
+# shard_clauses turns the boundaries from split_histogram into one WHERE clause per shard. NULL keys go to the
+# first shard so that together the clauses cover every record of the table exactly once.
+def shard_clauses(boundaries, key=SHARD_KEY):
+	if not boundaries:
+		return [None]
+	clauses = ["(%s < %s OR %s IS NULL)" % (key, boundaries[0], key)]
+	for lower, upper in zip(boundaries, boundaries[1:]):
+		clauses += ["%s >= %s AND %s < %s" % (key, lower, key, upper)]
+	clauses += ["%s >= %s" % (key, boundaries[-1])]
+	return clauses
+
+
+# shard_location is the temporary folder of one shard of a table
+def shard_location(saveLocation, filename, shard):
+	return os.path.join(saveLocation, SHARD_FOLDER, '%s_%d' % (filename, shard))
+
+
+# stitch_shards puts the files written by each shard back together in saveLocation. shardFiles is a list with
+# the writtenFiles dictionary of each shard, in the order of the shards. Every file keeps the header of the first
+# shard that has it and the records of each shard, in order. Sites_for_ files only keep the first record of each
+# site in the order of the shards. The DataMart gives no order to the records of a table, so for a station with
+# records in more than one shard that can be another record than the one a run in one go writes first (see
+# WorkingScripts/Test_Shards.py). It returns the stitched files in the same format as the writtenFiles dictionary
+# and removes the shard folders.
+def stitch_shards(shardFiles, shardLocations, saveLocation, sep):
+	keys = {}
+	for shard, written in enumerate(shardFiles):
+		for key, path in written.items():
+			keys.setdefault(key, os.path.relpath(path, shardLocations[shard]))
+	writtenFiles = {}
+	for key, relative in keys.items():
+		fileOut = os.path.join(saveLocation, relative)
+		if not os.path.isdir(os.path.dirname(fileOut)):
+			os.mkdir(os.path.dirname(fileOut))
+		isSites = os.path.basename(relative).startswith('Sites_for_')
+		seen = set()
+		header = False
+		with open_output(fileOut) as stitched:
+			for shardLocation in shardLocations:
+				shardFile = os.path.join(shardLocation, relative)
+				if not os.path.isfile(shardFile):
+					continue
+				with open_input(shardFile) as shardIn:
+					first = shardIn.readline()
+					if not header:
+						stitched.write(first)
+						header = True
+					if isSites:
+						# SiteCode is the second column of a Sites_for_ file
+						for line in shardIn:
+							SiteCode = next(csv.reader([line], delimiter=sep))[1]
+							if SiteCode not in seen:
+								seen.add(SiteCode)
+								stitched.write(line)
+					else:
+						shutil.copyfileobj(shardIn, stitched, 1024 * 1024)
+		writtenFiles[key] = fileOut
+	for shardLocation in shardLocations:
+		shutil.rmtree(shardLocation, ignore_errors=True)
+	try:
+		os.rmdir(os.path.dirname(shardLocations[0]))
+	except OSError:
+		# another table is still using the Shards folder
+		pass
+	return writtenFiles
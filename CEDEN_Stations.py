@@ -0,0 +1,87 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module keeps the station index (WQX_Sites, a dictionary of StationCode: Datum) between runs of
+data_retrieval in CEDEN_DataRefresh.py. The index is built while the WQX_Stations table is written. It is then
+saved in a small compressed cache file, together with a fingerprint of DM_WQX_Stations_MV and a hash of the
+WQX_Stations file it came from. The station list barely changes from one day to the next, so when the fingerprint
+of the view and the hash of the file still match, the next run uses the cache and doesn't read the view at all.
+	A run that resumes from a checkpoint (see CEDEN_Checkpoint.py) builds the index again from the WQX_Stations
+file it already wrote, see read_stations.
+
+'''
+
+import os
+import csv
+import pickle
+import zlib
+import hashlib
+from CEDEN_Compression import open_input
+
+# bump this if the content of the cache changes so old caches are not used
+CACHE_VERSION = 1
+
+
+# stations_fingerprint returns the number of records and a checksum of the whole station view. It is one
+# aggregate query, no record is sent over.
+def stations_fingerprint(cursor, table, fingerprint):
+	cursor.execute("SELECT COUNT(*), %s FROM %s" % (fingerprint, table))
+	records, checksum = cursor.fetchone()
+	return '%s:%s' % (records, checksum)
+
+
+# file_hash returns the sha256 of a file, read in blocks
+def file_hash(path):
+	sha = hashlib.sha256()
+	with open(path, 'rb') as fileIn:
+		for block in iter(lambda: fileIn.read(1024 * 1024), b''):
+			sha.update(block)
+	return sha.hexdigest()
+
+
+# save_station_cache writes the station index along with the fingerprint of the view and the hash of the
+# WQX_Stations file
+def save_station_cache(cacheFile, fingerprint, WQXfile, WQX_Sites, rows):
+	if not cacheFile or fingerprint is None:
+		return
+	cache = {'version': CACHE_VERSION, 'fingerprint': fingerprint, 'file': file_hash(WQXfile), 'rows': rows,
+	         'sites': WQX_Sites}
+	with open(cacheFile + '.tmp', 'wb') as cacheOut:
+		cacheOut.write(zlib.compress(pickle.dumps(cache, pickle.HIGHEST_PROTOCOL)))
+	os.replace(cacheFile + '.tmp', cacheFile)
+
+
+# load_station_cache returns the cached station index and the number of records of the view, or None if the view
+# changed, the WQX_Stations file is missing or was changed, or there is no usable cache.
+def load_station_cache(cacheFile, fingerprint, WQXfile):
+	if not cacheFile or fingerprint is None or not os.path.isfile(cacheFile) or not os.path.isfile(WQXfile):
+		return None
+	try:
+		with open(cacheFile, 'rb') as cacheIn:
+			cache = pickle.loads(zlib.decompress(cacheIn.read()))
+	except (OSError, zlib.error, pickle.UnpicklingError, EOFError):
+		return None
+	if cache.get('version') != CACHE_VERSION or cache.get('fingerprint') != fingerprint:
+		return None
+	if cache.get('file') != file_hash(WQXfile):
+		return None
+	return cache['sites'], cache['rows']
+
+
+# read_stations builds the station index (StationCode: Datum) from a WQX_Stations file written by data_retrieval
+def read_stations(WQXfile, sep):
+	WQX_Sites = {}
+	with open_input(WQXfile) as fileIn:
+		reader = csv.reader(fileIn, delimiter=sep, lineterminator='\n')
+		positions = {name: i for i, name in enumerate(dict.fromkeys(next(reader)))}
+		StationSlot, DatumSlot = positions['StationCode'], positions['Datum']
+		for record in reader:
+			WQX_Sites[record[StationSlot]] = record[DatumSlot]
+	return WQX_Sites
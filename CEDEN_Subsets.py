@@ -0,0 +1,222 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module holds the subset writers used by data_retrieval in CEDEN_DataRefresh.py. A subset
+(SafeToSwim, Pesticides, etc) is declared up front with the table it comes from, the column to filter on and
+the list of analytes to keep. While data_retrieval is writing a table, every record is also handed to the
+subsets of that table so the subset files and their Sites_for_ files are written in the same pass instead of
+re-reading the full dataset afterwards with selectByAnalyte.
+	A Partitioner splits a table into a file per value of a column (ie. By_RB, a file per Regional Board) with a
+PartitionWriter, see CEDEN_Partitions.py.
+
+'''
+
+import os
+import re
+import csv
+from CEDEN_Compression import open_output
+from CEDEN_Serializer import RecordWriter
+from CEDEN_Query import TableQuery, in_clause, and_clauses, or_clauses
+from CEDEN_Partitions import PartitionWriter, BUFFER_SIZE
+
+
+# normalize_analyte is used when a subset is declared with normalize=True. It makes the membership test
+# ignore case and leading/trailing spaces ("Aldicarb " and "aldicarb" both match "Aldicarb").
+def normalize_analyte(value):
+	return value.strip().casefold()
+
+
+# write_Sites writes a Sites_for_ file from a dictionary of StationCode: [StationName, Latitude, Longitude, Datum]
+def write_Sites(Sites, Sites_dict, sep):
+	with open_output(Sites) as Sites_Out:
+		Sites_writer = csv.writer(Sites_Out, csv.QUOTE_MINIMAL, delimiter=sep, lineterminator='\n')
+		AllSites_dw = csv.DictWriter(Sites_Out, fieldnames=['StationName', 'SiteCode', 'Latitude', 'Longitude',
+		                                                    'Datum'], delimiter=sep, lineterminator='\n')
+		AllSites_dw.writeheader()
+		for key, value in Sites_dict.items():
+			Sites_writer.writerow([value[0], key, value[1], value[2], value[3]])
+
+
+# Subset describes one subset of a table and writes it while the table is being extracted.
+#   newFileName is the name of the subset file (ie. 'SafeToSwim.csv'), table is the filename key of the table
+#   in the tables dictionary (ie. 'WaterChemistryData'), field_filter is the column to filter on and analytes
+#   are the values to keep. Sites_for_<newFileName> is written as well unless For_IR is True.
+class Subset:
+	def __init__(self, newFileName, table, field_filter, analytes, sep, For_IR=False, normalize=False):
+		self.newFileName = newFileName
+		self.table = table
+		self.field_filter = field_filter
+		self.sep = sep
+		self.For_IR = For_IR
+		self.normalize = normalize
+		# a frozenset makes the membership test a single hash lookup instead of a scan through the list
+		if normalize:
+			self.analytes = frozenset(normalize_analyte(analyte) for analyte in analytes)
+		else:
+			self.analytes = frozenset(analytes)
+		self.fileOut = None
+		self.Sites = None
+		self.rows = 0
+
+	# open creates the subset file in path and writes the header. columns is the list of column names of the
+	# table and every record handed to route() must be a list of values in the same order.
+	def open(self, path, columns):
+		self.fileOut = os.path.join(path, self.newFileName)
+		self.Sites = os.path.join(path, 'Sites_for_' + self.newFileName)
+		# the IR tables use TargetLat/Long while we renamed the other tables.
+		if self.For_IR:
+			Latitude, Longitude = ['TargetLatitude', 'TargetLongitude', ]
+		else:
+			Latitude, Longitude = ['Latitude', 'Longitude', ]
+		positions = {name: i for i, name in enumerate(dict.fromkeys(columns))}
+		self.filterIndex = positions[self.field_filter]
+		self.siteIndices = (positions['StationCode'], positions['StationName'], positions[Latitude],
+		                    positions[Longitude], positions['Datum'])
+		self.Analyte_Sites = {}
+		self.rows = 0
+		self.txtfileOut = open_output(self.fileOut, binary=True)
+		# writes what csv.writer did, see CEDEN_Serializer.py
+		self.writer = RecordWriter(self.txtfileOut, self.sep)
+		self.writer.writerow(columns)
+
+	# route writes the record to the subset file if its field_filter value is one of the analytes
+	def route(self, record):
+		value = record[self.filterIndex]
+		if self.normalize:
+			value = normalize_analyte(value)
+		if value in self.analytes:
+			self.writer.writerow(record)
+			self.rows += 1
+			StationCode, StationName, Lat, Long, Datum = [record[i] for i in self.siteIndices]
+			if StationCode not in self.Analyte_Sites:
+				self.Analyte_Sites[StationCode] = [StationName, Lat, Long, Datum]
+
+	# where returns the filter of this subset as a (clause, params) pair that the DataMart can apply itself (see
+	# subset_query), for a table that is only extracted for its subsets. field_filter has to be the DataMart name of
+	# the column as well. The server compares the values as they are, so it can't be used with normalize=True.
+	def where(self):
+		if self.normalize:
+			raise ValueError("%s normalizes its analytes and can't be filtered by the DataMart" % self.newFileName)
+		return in_clause(self.field_filter, sorted(self.analytes))
+
+	# close finishes the subset file, writes the Sites_for_ file and returns the new files in the same format
+	# as the writtenFiles dictionary of data_retrieval.
+	def close(self):
+		self.txtfileOut.close()
+		written = {self.newFileName: self.fileOut}
+		# IR tables don't need a sites file
+		if not self.For_IR:
+			write_Sites(self.Sites, self.Analyte_Sites, self.sep)
+			written['Sites_for_' + self.newFileName] = self.Sites
+		return written
+
+
+# file_part makes a value safe to use in a file name, anything but letters, digits, spaces, '-' and '.' becomes '_'.
+# Values that only differ by those characters go in the same file.
+def file_part(value):
+	return re.sub(r'[^\w\-. ]', '_', value).strip()
+
+
+# Partitioner splits one table into a file per value of a column (<folder>\<table>_<name>_<value>) while the table
+# is being extracted, ie. a file per Program or per Analyte. The files are only created when their first record
+# comes.
+#   table is the filename key of the table in the tables dictionary, field_filter is the column to split on and
+#   bucket, if given, turns its value into the partition (ie. a SampleDate into its decade). With more than one
+#   worker the subsets go to the worker processes, so bucket has to be a function defined at the top of a module,
+#   not a lambda. Records with an empty value (or a bucket of None) are skipped. expected are the partitions that
+#   are always written, even if they end up with only a header. bufferSize is the text kept in memory for every
+#   partition, see CEDEN_Partitions.py.
+class Partitioner:
+	def __init__(self, table, field_filter, sep, extension, name=None, bucket=None, expected=(), folder=None,
+	             bufferSize=BUFFER_SIZE):
+		self.table = table
+		self.name = name or field_filter
+		self.folder = folder or 'By_' + self.name
+		self.newFileName = os.path.join(self.folder, '%s_%s_*%s' % (table, self.name, extension))
+		# the writtenFiles key of every partition starts with it, see published
+		self.prefix = '%s_%s_' % (table, self.name)
+		self.field_filter = field_filter
+		self.sep = sep
+		self.extension = extension
+		self.bucket = bucket
+		self.expected = [str(partition) for partition in expected]
+		self.bufferSize = bufferSize
+		self.rows = 0
+
+	# open creates the folder and the files of the expected partitions
+	def open(self, path, columns):
+		self.path = os.path.join(path, self.folder)
+		if not os.path.isdir(self.path):
+			os.mkdir(self.path)
+		self.filterIndex = {name: i for i, name in enumerate(dict.fromkeys(columns))}[self.field_filter]
+		self.partitions = PartitionWriter(columns, self._key, self._file, self.sep, bufferSize=self.bufferSize)
+		self.keys = {}
+		self.rows = 0
+		for partition in self.expected:
+			self.partitions.create(partition)
+
+	# _key returns the partition of a record. The partition of each value is kept, there are only so many of them.
+	def _key(self, record):
+		value = record[self.filterIndex]
+		if value in self.keys:
+			return self.keys[value]
+		partition = self.bucket(value) if value and self.bucket is not None else value
+		partition = self.keys[value] = (file_part(partition) or None) if partition else None
+		return partition
+
+	def _file(self, partition):
+		return os.path.join(self.path, '%s_%s_%s%s' % (self.table, self.name, partition, self.extension))
+
+	# route writes the record to its partition
+	def route(self, record):
+		if self.partitions.write(record) is not None:
+			self.rows += 1
+
+	# close finishes every partition and returns them in the same format as the writtenFiles dictionary
+	def close(self):
+		return {self.prefix + partition: fileOut for partition, fileOut in self.partitions.close().items()}
+
+
+# RegionPartitioner splits one table into a file per Regional Board (By_RB\<table>_RB_<N>) while the table is
+# being extracted. It replaces running selectByAnalyte once per region, which read every IR file nine times.
+#   field_filter is the column holding the region (RegionalBoardID or RegionalBoard) and regions are the
+#   partitions that are always written, even if they end up with only a header. Any other non-empty region value
+#   gets its own file the first time it shows up.
+class RegionPartitioner(Partitioner):
+	def __init__(self, table, field_filter, sep, extension, regions=range(1, 10), folder='By_RB',
+	             bufferSize=BUFFER_SIZE):
+		super().__init__(table, field_filter, sep, extension, name='RB', expected=regions, folder=folder,
+		                 bufferSize=bufferSize)
+
+
+# published leaves the partition files of the Partitioner subsets out of a writtenFiles dictionary. They are put
+# back together with the rest of their table's files when shards are stitched or changed years are merged, but like
+# the By_RB files of the original script they are not published: they stay out of FILES, the manifest, the Parquet
+# copies and the publish queue, and no node is mapped to them. hidden are other writtenFiles keys to leave out, ie.
+# the datasets of a table that is only extracted for its subsets (see subset_query).
+def published(writtenFiles, subsets, hidden=()):
+	prefixes = tuple(subset.prefix for subset in subsets if isinstance(subset, Partitioner))
+	return {name: path for name, path in writtenFiles.items() if not name.startswith(prefixes) and name not in hidden}
+
+
+# subset_query limits the TableQuery of a table to the records of its subsets, for a table that is only extracted for
+# them (see subsetOnly in data_retrieval). The DataMart applies the filter of every subset (see Subset.where), so it
+# only sends the records that go in at least one of them. A Partitioner needs every record of its table and can't be
+# used with it.
+def subset_query(query, subsets):
+	for subset in subsets:
+		if isinstance(subset, Partitioner):
+			raise ValueError("%s needs every record of %s, the table can't be limited to its subsets"
+			                 % (subset.newFileName, subset.table))
+	if not subsets:
+		raise ValueError("%s has no subsets to limit it to" % query.table)
+	where, params = and_clauses((query.where, query.params), or_clauses(*[subset.where() for subset in subsets]))
+	return TableQuery(query.table, exclude=query.exclude, aliases=query.aliases, rename=query.rename, where=where,
+	                  params=params)
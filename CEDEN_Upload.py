@@ -0,0 +1,311 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module publishes the files written by data_retrieval (CEDEN_DataRefresh.py) to their resource nodes on
+data.ca.gov. The files used to be sent one after another and a failed upload was only printed. upload_files sends a
+few files at the same time, each worker thread with its own client (a StreamingClient, see below), which logs
+in once and keeps its connection open for every file the thread sends. The number of threads is kept small so the
+portal isn't flooded. Uploads that fail for a reason that can go away (a dropped connection, a timeout, 429 or a 5xx
+response) are tried again after a growing pause. When every file is done a report gives the time, throughput,
+number of tries and result of each one. With a manifest (CEDEN_Manifest.py), a file that has the content last
+published to its node is not sent again.
+	The DatasetAPI builds the whole request in memory before sending it, which is why uploads of the multi GB files
+(the Habitat file, once it passed 2 GB) failed. StreamingClient does the same login and attach_file calls with
+http.client, and streams the file from disk CHUNK_SIZE bytes at a time, so the memory it uses doesn't depend on the
+size of the file. A file larger than the portal limit (PORTAL_LIMIT) is sent in numbered parts, see part_ranges().
+	WorkingScripts/Test_Uploads.py runs the scheduler against a local stand-in for the DKAN attach_file endpoint and
+WorkingScripts/Test_StreamingUpload.py measures the memory used to send a 3 GB file.
+
+'''
+
+import os
+import json
+import time
+import uuid
+import random
+import threading
+import http.client
+from urllib.parse import urlsplit
+from concurrent.futures import ThreadPoolExecutor
+from CEDEN_Compression import compression_of
+
+# the response codes worth trying again
+TRANSIENT = (408, 429, 500, 502, 503, 504, )
+# the response codes of an expired login, the client logs in again
+LOGIN = (401, 403, )
+# the size of the pieces a file is read and sent in, in bytes
+CHUNK_SIZE = 1024 * 1024
+# the largest file sent in one upload, in bytes. Larger files are sent in numbered parts.
+PORTAL_LIMIT = 1900 * 1024 * 1024
+
+
+# _pause returns how long to wait before try number attempt (1 is the first retry). It doubles every time, with a
+# random part so the threads don't all come back at the same moment.
+def _pause(attempt, backoff, maxPause):
+	return min(backoff * 2 ** (attempt - 1), maxPause) * random.uniform(0.5, 1.)
+
+
+# _response_text returns what the portal answered, for the report
+def _response_text(r):
+	return '%s %s %s' % (r.status_code, getattr(r, 'reason', ''), getattr(r, 'text', '')[:500])
+
+
+# UploadScheduler sends files to their nodes with workers threads.
+#   client_factory returns a new logged in client, ie. lambda: StreamingClient(URI, user, password). Each
+# thread makes one and keeps it. A client needs attach_file_to_node(file, node_id, field, update) returning a
+# response with ok, status_code, reason, text and close(), like DatasetAPI does.
+#   retries is the number of tries after the first one, backoff the pause before the first retry in seconds (it
+# doubles each time, up to maxPause).
+#   manifest is a Manifest (CEDEN_Manifest.py). Files that didn't change since they were last published to their
+# node are skipped, and the ones sent are marked as published.
+class UploadScheduler:
+	def __init__(self, client_factory, workers=3, retries=4, backoff=5., maxPause=120., field='field_upload',
+	             update=0, manifest=None):
+		self.client_factory = client_factory
+		self.workers = workers
+		self.retries = retries
+		self.backoff = backoff
+		self.maxPause = maxPause
+		self.field = field
+		self.update = update
+		self.manifest = manifest
+		self._local = threading.local()
+
+	# _client returns the client of the current thread, it is made the first time. fresh=True logs in again.
+	def _client(self, fresh=False):
+		if fresh or getattr(self._local, 'client', None) is None:
+			self._local.client = self.client_factory()
+		return self._local.client
+
+	# upload sends one file, trying again when it makes sense, and returns its line of the report
+	def upload(self, file, node_id):
+		report = {'file': file, 'node': node_id, 'size': os.path.getsize(file), 'tries': 0, 'ok': False,
+		          'seconds': 0., 'error': '', 'skipped': False}
+		if self.manifest is not None and self.manifest.unchanged(file, node_id):
+			print("%s hasn't changed since it was last published, skipping it" % os.path.basename(file))
+			report.update(ok=True, skipped=True)
+			return report
+		start = time.perf_counter()
+		fresh = False
+		for attempt in range(self.retries + 1):
+			if attempt:
+				time.sleep(_pause(attempt, self.backoff, self.maxPause))
+			report['tries'] += 1
+			try:
+				r = self._client(fresh).attach_file_to_node(file=file, node_id=node_id, field=self.field,
+				                                            update=self.update)
+			except (OSError, http.client.HTTPException) as error:
+				# dropped connections and timeouts (requests' exceptions are OSErrors too). Start over with a
+				# new client, the old connection is likely dead.
+				report['error'] = '%s: %s' % (type(error).__name__, error)
+				fresh = True
+				print("\tUploading %s failed (%s), try %d of %d" % (os.path.basename(file), report['error'],
+				                                                    attempt + 1, self.retries + 1))
+				continue
+			try:
+				if r.ok:
+					report['ok'] = True
+					report['error'] = ''
+					break
+				report['error'] = _response_text(r)
+				print("\tUploading %s failed (%s), try %d of %d" % (os.path.basename(file), r.status_code,
+				                                                    attempt + 1, self.retries + 1))
+				if r.status_code in LOGIN:
+					fresh = True
+				elif r.status_code not in TRANSIENT:
+					break
+			finally:
+				r.close()
+		report['seconds'] = time.perf_counter() - start
+		if report['ok']:
+			print("Completed uploading %s to data.ca.gov" % os.path.basename(file))
+			if self.manifest is not None:
+				self.manifest.published(file, node_id)
+		else:
+			print("something went wrong with %s. Here is the last response or error:\n%s" %
+			      (os.path.basename(file), report['error']))
+		return report
+
+	# run sends every file of uploads, a dictionary of file path: node number, and returns the report in the same
+	# order. The largest files go first so a big one doesn't start last.
+	def run(self, uploads):
+		order = sorted(uploads, key=lambda file: -os.path.getsize(file))
+		start = time.perf_counter()
+		with ThreadPoolExecutor(max_workers=self.workers) as pool:
+			futures = {file: pool.submit(self.upload, file, uploads[file]) for file in order}
+		reports = [futures[file].result() for file in uploads]
+		print_report(reports, time.perf_counter() - start)
+		return reports
+
+
+# print_report prints the time, throughput and result of every upload
+def print_report(reports, seconds):
+	print("\n%-45s %6s %10s %8s %8s %6s  %s" % ('file', 'node', 'MB', 'sec', 'MB/s', 'tries', 'result'))
+	for report in reports:
+		MB = report['size'] / 1e6
+		rate = MB / report['seconds'] if report['seconds'] else 0.
+		result = 'unchanged' if report['skipped'] else 'ok' if report['ok'] else 'FAILED'
+		print("%-45s %6s %10.1f %8.1f %8.2f %6d  %s" % (os.path.basename(report['file'])[:45], report['node'], MB,
+		                                               report['seconds'], rate, report['tries'], result))
+	sent = [report for report in reports if not report['skipped']]
+	total = sum(report['size'] for report in sent) / 1e6
+	print("%d of %d files uploaded, %d unchanged, %.1f MB in %.1f sec (%.2f MB/s)\n" %
+	      (sum(report['ok'] for report in sent), len(sent), len(reports) - len(sent), total, seconds,
+	       total / max(seconds, 1e-6)))
+
+
+# upload_files sends uploads, a dictionary of file path: node number, see UploadScheduler
+def upload_files(uploads, client_factory, workers=3, **options):
+	return UploadScheduler(client_factory, workers=workers, **options).run(uploads)
+
+
+# part_ranges returns the (start, end, header) of each part a file is sent in: the bytes from start to end, after the
+# header. A file up to limit bytes is sent whole. A larger text file is cut at the end of a line and every part but
+# the first starts with the header line of the file, so each part is a complete csv/txt file. A compressed file is
+# cut every limit bytes, its parts have to be put back together (ie. cat or copy /b) before it is uncompressed.
+def part_ranges(file, limit=PORTAL_LIMIT):
+	size = os.path.getsize(file)
+	if size <= limit:
+		return [(0, size, b'')]
+	if compression_of(file):
+		return [(start, min(start + limit, size), b'') for start in range(0, size, limit)]
+	ranges = []
+	with open(file, 'rb') as fileIn:
+		header = fileIn.readline()
+		start = 0
+		while start < size:
+			partHeader = header if start else b''
+			end = start + limit - len(partHeader)
+			if end < size:
+				end = _line_end(fileIn, start, end)
+			ranges += [(start, min(end, size), partHeader)]
+			start = end
+	return ranges
+
+
+# _line_end returns the position after the last end of line between start and end
+def _line_end(fileIn, start, end):
+	position = end
+	while position > start:
+		read = min(CHUNK_SIZE, position - start)
+		fileIn.seek(position - read)
+		newline = fileIn.read(read).rfind(b'\n')
+		if newline >= 0:
+			return position - read + newline + 1
+		position -= read
+	raise ValueError("%s has a line longer than the portal limit" % fileIn.name)
+
+
+# part_name returns the file name of part number of a file sent in parts ('WaterChemistryData.csv', 2 ->
+# 'WaterChemistryData_part2.csv', 'WaterChemistryData.csv.gz', 2 -> 'WaterChemistryData.csv.gz.002')
+def part_name(name, number):
+	if compression_of(name):
+		return '%s.%03d' % (name, number)
+	root, extension = os.path.splitext(name)
+	return '%s_part%d%s' % (root, number, extension)
+
+
+# _multipart_body yields the request body of one part: head, header, the bytes of the file from start to end, read
+# chunkSize bytes at a time, and tail
+def _multipart_body(file, start, end, head, header, tail, chunkSize):
+	yield head + header
+	with open(file, 'rb') as fileIn:
+		fileIn.seek(start)
+		left = end - start
+		while left:
+			chunk = fileIn.read(min(chunkSize, left))
+			if not chunk:
+				raise OSError("%s got shorter while it was sent" % file)
+			left -= len(chunk)
+			yield chunk
+	yield tail
+
+
+# Response holds what the portal answered, with the parts of a requests.Response the scheduler uses
+class Response:
+	def __init__(self, response):
+		self.status_code = response.status
+		self.reason = response.reason
+		# the whole answer is read so the connection can be used again
+		self.content = response.read()
+		self.text = self.content.decode('utf8', errors='replace')
+		self.ok = self.status_code < 400
+
+	def json(self):
+		return json.loads(self.text)
+
+	def close(self):
+		pass
+
+
+# StreamingClient logs in to data.ca.gov like the DatasetAPI (the DKAN services login, then its session cookie and
+# CSRF token on every request) and sends files with attach_file_to_node, streamed, see above. It keeps one
+# connection open. chunkSize is the size of the pieces the file is sent in, partLimit the largest part.
+class StreamingClient:
+	def __init__(self, URI, user, password, chunkSize=CHUNK_SIZE, partLimit=PORTAL_LIMIT, timeout=600):
+		url = urlsplit(URI)
+		self.base = url.path.rstrip('/')
+		self.chunkSize = chunkSize
+		self.partLimit = partLimit
+		if url.scheme == 'https':
+			self.connection = http.client.HTTPSConnection(url.netloc, timeout=timeout)
+		else:
+			self.connection = http.client.HTTPConnection(url.netloc, timeout=timeout)
+		self.headers = {'Accept': 'application/json'}
+		self.login(user, password)
+
+	def _request(self, method, path, body=None, headers=None):
+		self.connection.request(method, self.base + path, body=body, headers=dict(self.headers, **(headers or {})))
+		return Response(self.connection.getresponse())
+
+	def login(self, user, password):
+		r = self._request('POST', '/api/dataset/user/login', json.dumps({'username': user, 'password': password}),
+		                  {'Content-Type': 'application/json'})
+		if not r.ok:
+			raise ConnectionError("Logging in to data.ca.gov failed: %s" % _response_text(r))
+		session = r.json()
+		self.headers['Cookie'] = '%s=%s' % (session['session_name'], session['sessid'])
+		token = session.get('token')
+		if not token:
+			token = self._request('POST', '/services/session/token').text.strip()
+		self.headers['X-CSRF-Token'] = token
+
+	# attach_file_to_node sends file to the resource node_id, in parts when it is larger than partLimit. The first
+	# part replaces the file of the node when update is 0, the next ones are attached next to it. Returns the first
+	# failed response, or the last one.
+	def attach_file_to_node(self, file, node_id, field, update=0):
+		parts = part_ranges(file, self.partLimit)
+		name = os.path.basename(file)
+		for number, (start, end, header) in enumerate(parts):
+			if len(parts) > 1:
+				print("\tSending part %d of %d of %s" % (number + 1, len(parts), name))
+				r = self._send(file, start, end, header, part_name(name, number + 1), node_id, field,
+				               update if number == 0 else 1)
+			else:
+				r = self._send(file, start, end, header, name, node_id, field, update)
+			if not r.ok or number == len(parts) - 1:
+				return r
+			r.close()
+
+	# _send sends the bytes of file from start to end after header, as a file named name
+	def _send(self, file, start, end, header, name, node_id, field, update):
+		boundary = uuid.uuid4().hex
+		head = ''.join(['--%s\r\nContent-Disposition: form-data; name="%s"\r\n\r\n%s\r\n' % (boundary, key, value)
+		                for key, value in (('field_name', field), ('attach', update))])
+		head += '--%s\r\nContent-Disposition: form-data; name="files[%s]"; filename="%s"\r\n' \
+		        'Content-Type: application/octet-stream\r\n\r\n' % (boundary, field, name)
+		head = head.encode('utf8')
+		tail = ('\r\n--%s--\r\n' % boundary).encode('utf8')
+		# the length is known beforehand, so the body is sent as it is read, without chunked encoding
+		length = len(head) + len(header) + end - start + len(tail)
+		return self._request('POST', '/api/dataset/node/%d/attach_file' % node_id,
+		                     _multipart_body(file, start, end, head, header, tail, self.chunkSize),
+		                     {'Content-Type': 'multipart/form-data; boundary=%s' % boundary,
+		                      'Content-Length': str(length)})
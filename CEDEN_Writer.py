@@ -0,0 +1,106 @@
+'''
+
+Author:
+	Andrew Dix Hill; https://github.com/AndrewDixHill/CEDEN_to_DataCAGov ; andrew.hill@waterboards.ca.gov
+
+Agency:
+	California State Water Resource Control Board (SWRCB)
+	Office of Information Management and Analysis (OIMA)
+
+Purpose:
+	This module holds the WriteBehind stage used by extract_table in CEDEN_DataRefresh.py. It is the other end of
+the BatchedReader (CEDEN_Reader.py): once a batch of records is cleaned and scored, it is put on a queue and a writer
+thread turns it into csv lines and writes it (the full file, the date divided files and the subsets) while the main
+thread goes on with the next batch. The files are opened with WRITE_BUFFER bytes of buffer so the disk is written in
+a few big writes.
+	The queue holds depth batches. When the writer falls behind, put waits for room on the queue so no more than
+depth batches are ever waiting in memory. The writer thread only gets the GIL back while the disk (or the
+compression threads) work, so how much it buys depends on the machine. Benchmark_Pipeline.py measures a run with
+and without it.
+	An error on the writer thread is raised on the main thread by the next put or by close.
+
+'''
+
+import time
+import queue
+import threading
+
+# how many batches can wait for the writer thread
+WRITE_DEPTH = 1
+# the buffer of the files written behind, in bytes
+WRITE_BUFFER = 4 * 1024 * 1024
+
+
+# WriteBehind runs write(batch) on a thread of its own for every batch that is put, in the order they are put.
+# depth=0 writes on the calling thread instead, like there was no write behind. Use it with "with" so the thread is
+# stopped when something goes wrong on the main thread:
+#       with WriteBehind(write_records) as behind:
+#           for batch in reader.iter_batches():
+#               ... clean and score the batch ...
+#               behind.put(records)
+# The records of a batch belong to the writer thread once they are put, they must not be changed after.
+#   waitSeconds is the time put waited for room on the queue, writeSeconds the time the writer spent writing.
+class WriteBehind:
+	def __init__(self, write, depth=WRITE_DEPTH):
+		self.write = write
+		self.depth = depth
+		self.waitSeconds = 0.
+		self.writeSeconds = 0.
+		self.error = None
+		self._thread = None
+		if depth:
+			self._batches = queue.Queue(maxsize=depth)
+			self._thread = threading.Thread(target=self._writer, daemon=True)
+			self._thread.start()
+
+	# put hands a batch to the writer, it waits while depth batches are already waiting
+	def put(self, batch):
+		start = time.perf_counter()
+		if self._thread is None:
+			self.write(batch)
+			self.writeSeconds += time.perf_counter() - start
+			return
+		if self.error is not None:
+			raise self.error
+		self._batches.put(batch)
+		self.waitSeconds += time.perf_counter() - start
+
+	# _writer runs on the writer thread until it gets None. After an error it keeps emptying the queue so put
+	# doesn't wait forever, the error is raised on the main thread.
+	def _writer(self):
+		while True:
+			batch = self._batches.get()
+			if batch is None:
+				return
+			if self.error is not None:
+				continue
+			start = time.perf_counter()
+			try:
+				self.write(batch)
+			except BaseException as error:
+				self.error = error
+			self.writeSeconds += time.perf_counter() - start
+
+	# close waits until every batch is written and raises the error of the writer thread, if there was one
+	def close(self):
+		if self._thread is not None:
+			start = time.perf_counter()
+			self._batches.put(None)
+			self._thread.join()
+			self._thread = None
+			self.waitSeconds += time.perf_counter() - start
+		if self.error is not None:
+			raise self.error
+
+	def __enter__(self):
+		return self
+
+	# when the main thread failed, the writer is stopped and its own error, if any, is left out
+	def __exit__(self, excType, exc, traceback):
+		if excType is None:
+			self.close()
+		else:
+			try:
+				self.close()
+			except BaseException:
+				pass
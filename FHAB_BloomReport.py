@@ -12,7 +12,8 @@ Purpose:
 	filter all data for a set of printable characters and then publish the data to a resource node on data.ca.gov.
 	It will convert positive longitude values to negative and replace Latitude or Longitude values that only only
 	empty spaces. The file extension and delimiters are chosen specificaly to work with data.ca.gov's preview
-	function.
+	function. The content hash of the file is kept in a manifest (see CEDEN_Manifest.py) and the file is only
+	published when it changed since it was last published.
 
 How to use this script:
 	You must be connected to the internal waternet
@@ -21,7 +22,7 @@ How to use this script:
 	with the filename:
 	python C:\\Users\\User***\\Downloads\\XXXXXXX.py
 	You must also set the SERVER, UID as environmental variables in your windows account
-	You may also have to set the SQL driver on the pyodbc.connect line to your available drivers.
+	You may also have to set the driver of the SQLServerBackend line to your available drivers.
 		Use pyodbc.drivers() to see a list of available drivers.
 
 Prerequisites:
@@ -36,19 +37,17 @@ Prerequisites:
 '''
 
 # Import the necessary libraries of python code
-import pyodbc
 import os
 import csv
-import re
 from datetime import datetime
-import string
 from dkan.client import DatasetAPI
 import getpass
-
-# decodeAndStrip takes a string and filters each character through the printable variable. It returns a filtered string.
-def decodeAndStrip(t):
-	filter1 = ''.join(filter(lambda x: x in printable, str(t)))
-	return filter1
+from CEDEN_Reader import BatchedReader
+from CEDEN_Backend import SQLServerBackend
+from CEDEN_Sanitizer import Sanitizer, printable_for
+from CEDEN_Records import RecordLayout
+from CEDEN_Compression import open_output
+from CEDEN_Manifest import Manifest
 
 if __name__ == "__main__":
 	###########################
@@ -65,7 +64,8 @@ if __name__ == "__main__":
 	###########################
 	############   CHange these ##########
 	###########################
-	printable = set(string.printable) - set('|"\`\t\r\n\f\v')
+	printable = printable_for('FHAB_BloomReport')
+	sanitizer = Sanitizer(printable)
 	### you can change this to point to a different location
 	first = 'C:\\Users\\%s\\Documents' % getpass.getuser()
 	path = os.path.join(first, 'FHAB_BloomReport')
@@ -79,7 +79,8 @@ if __name__ == "__main__":
 	### delimiter type.
 	sep = ','
 	file = os.path.join(path, FHAB + ext)
-	cnxn = pyodbc.connect(Driver='ODBC Driver 11 for SQL Server', Server=SERVER, uid=UID, Trusted_Connection='Yes')
+	# the FHAB database, logged in with the windows account. Connecting is tried again when it fails, see CEDEN_Backend.py
+	cnxn = SQLServerBackend(SERVER, uid=UID, trusted=True).connect()
 	cursor = cnxn.cursor()
 	sql = "SELECT dbo.AlgaeBloomReport.AlgaeBloomReportID, dbo.AlgaeBloomReport.RegionalBoardID, dbo.AlgaeBloomReport.CountyID," \
 	      " dbo.AlgaeBloomReport.Latitude, dbo.AlgaeBloomReport.Longitude, dbo.AlgaeBloomReport.ObservationDate, CASE WHEN " \
@@ -93,22 +94,32 @@ if __name__ == "__main__":
 	      "WHERE (((dbo.AlgaeBloomReport.ApprovedforPost)= 1))"
 	cursor.execute(sql)
 	columns = [desc[0] for desc in cursor.description]
-	with open(file, 'w', newline='', encoding='utf8') as writer:
+	# open_output hashes the file as it is written, see CEDEN_Compression.py
+	with open_output(file) as writer:
 		dw = csv.DictWriter(writer, fieldnames=columns, delimiter=sep, lineterminator='\n')
 		dw.writeheader()
 		FHAB_writer = csv.writer(writer, csv.QUOTE_MINIMAL, delimiter=sep, lineterminator='\n')
-		for row in cursor:
-			row = [str(word) if word is not None else '' for word in row]
-			filtered = [decodeAndStrip(t) for t in list(row)]
-			newDict = dict(zip(columns, filtered))
+		layout = RecordLayout(columns)
+		LongitudeSlot = layout.slot('Longitude')
+		# rows are fetched in batches, the next batch is fetched while we work on this one
+		for row in BatchedReader(cursor):
+			# the cleaned row is the record that gets written, see CEDEN_Records.py
+			record = layout.record(sanitizer.clean_row(row))
 			try:
-				long = float(newDict['Longitude'])
+				long = float(record[LongitudeSlot])
 				if long > 0:
-					newDict['Longitude'] = -long
+					record[LongitudeSlot] = -long
 			except ValueError:
 				pass
-			FHAB_writer.writerow(list(newDict.values()))
+			FHAB_writer.writerow(record)
 	# 2446 FHAB portal data (previously 2156)
 	NODE = 2446
-	api = DatasetAPI(URI, user, password, debug=False)
-	r = api.attach_file_to_node(file=file, node_id=NODE, field='field_upload', update=0)
\ No newline at end of file
+	manifest = Manifest(os.path.join(path, 'FHAB_Manifest.json'))
+	manifest.update([file])
+	if manifest.unchanged(file, NODE):
+		print("%s hasn't changed since it was last published" % os.path.basename(file))
+	else:
+		api = DatasetAPI(URI, user, password, debug=False)
+		r = api.attach_file_to_node(file=file, node_id=NODE, field='field_upload', update=0)
+		if r.ok:
+			manifest.published(file, NODE)
\ No newline at end of file
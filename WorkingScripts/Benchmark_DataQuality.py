@@ -0,0 +1,157 @@
+'''
+This is a testing script to compare the compiled DataQualityPlan (CEDEN_DataQuality.py) against the original
+per-record data quality logic that used to live in data_retrieval. It builds random records for a few tables,
+makes sure both give the exact same DataQuality and DataQualityIndicator values and prints rows/sec for each.
+
+	python WorkingScripts\\Benchmark_DataQuality.py [number of rows]
+'''
+
+import os, sys, re, random, time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from CEDEN_DataRefresh import CodeColumns, DQ_Codes, DictionaryFixer
+from CEDEN_DataQuality import DataQualityPlan
+
+
+# legacy_DQ is the original data quality logic from data_retrieval, copied here so we can compare against it.
+def legacy_DQ(recordDict, Mod_CodeColumns, table):
+	DQ = []
+	for codeCol in list(Mod_CodeColumns):
+		if codeCol == 'QACode':
+			for codeVal in recordDict[codeCol].split(','):
+				if codeVal in list(Mod_CodeColumns[codeCol]):
+					DQ += [Mod_CodeColumns[codeCol][codeVal]]
+		if codeCol == 'StationCode':
+			if bool(re.search('000NONPJ', recordDict[codeCol])):
+				DQ += [0]
+			elif codeVal in list(Mod_CodeColumns[codeCol]):
+				DQ += [Mod_CodeColumns[codeCol][codeVal]]
+		elif codeCol == 'Analyte' or codeCol == 'AnalyteName':
+			if bool(re.search('[Ss]urrogate', recordDict[codeCol])):
+				DQ += [0]
+		elif codeCol == 'ResultQualCode' or codeCol == 'ResQualCode':
+			for codeVal in [recordDict[codeCol]]:
+				if table == 'IR2018_WQ' or table == 'IR2018_Tissue' and codeVal == 'DNQ':
+					yearTest = int(recordDict['SampleDate'][-4:])
+					if isinstance(yearTest, int) and yearTest < 2008:
+						DQ += [6]
+				elif codeVal == 'DNQ' and int(recordDict['SampleDate'][:4]) < 2008:
+					DQ += [6]
+				elif codeVal == 'ND':
+					try:
+						RQC = recordDict['Result']
+						if not isinstance(RQC, str) and RQC > 0:
+							DQ += [6]
+						else:
+							DQ += [1]
+					except KeyError:
+						DQ += [1]
+				elif codeVal in list(Mod_CodeColumns[codeCol]):
+					DQ += [Mod_CodeColumns[codeCol][codeVal]]
+		elif codeCol == 'Result':
+			for codeVal in recordDict[codeCol]:
+				if codeVal == '':
+					if 'ResultQualCode' in recordDict.keys():
+						if 'ND' == recordDict['ResultQualCode']:
+							DQ += [1]
+					if 'ResQualCode' in recordDict.keys():
+						if 'ND' == recordDict['ResQualCode']:
+							DQ += [1]
+				else:
+					if codeVal in list(Mod_CodeColumns[codeCol]):
+						DQ += [Mod_CodeColumns[codeCol][codeVal]]
+		else:
+			for codeVal in [recordDict[codeCol]]:
+				if codeVal in list(Mod_CodeColumns[codeCol]):
+					DQ += [Mod_CodeColumns[codeCol][codeVal]]
+	try:
+		MaxDQ = max(DQ)
+	except ValueError:
+		MaxDQ = 7
+		DQ += [MaxDQ, ]
+	QInd = []
+	for codeCol in list(Mod_CodeColumns.keys()):
+		ValuesEqMaxDQ = []
+		if codeCol == 'QACode':
+			codeValList = recordDict[codeCol].split(',')
+		else:
+			codeValList = [recordDict[codeCol], ]
+		for codeVal in codeValList:
+			if codeVal in Mod_CodeColumns[codeCol] and MaxDQ == int(Mod_CodeColumns[codeCol][codeVal]):
+				ValuesEqMaxDQ += [codeVal, ]
+		if not ValuesEqMaxDQ == []:
+			QInd += [codeCol + ':' + ','.join(str(instance) for instance in ValuesEqMaxDQ)]
+	if min(DQ) == 0:
+		recordDict['DataQuality'] = DQ_Codes[0]
+	elif max(DQ) == 1:
+		recordDict['DataQuality'] = DQ_Codes[1]
+	else:
+		recordDict['DataQuality'] = DQ_Codes[MaxDQ]
+		if MaxDQ == 6 and QInd == []:
+			recordDict['DataQualityIndicator'] = 'ResultQualCode Special Rules'
+		else:
+			recordDict['DataQualityIndicator'] = '; '.join(str(ColVal) for ColVal in QInd)
+	return recordDict['DataQuality'], recordDict['DataQualityIndicator']
+
+
+# random_value picks mostly "normal" values for a column with a good share of QA codes mixed in
+def random_value(column, codes, irDate):
+	if column == 'QACode':
+		# real data is mostly 'None' with a long tail of code combinations
+		if random.random() < 0.85:
+			return 'None'
+		return ','.join(random.choice(list(codes)) for i in range(random.choice([1, 1, 1, 2, 3])))
+	if column == 'SampleDate':
+		year = random.randint(1950, 2018)
+		if irDate:
+			return '%02d%02d%d' % (random.randint(1, 12), random.randint(1, 28), year)
+		return '%d-%02d-%02d 00:00:00' % (year, random.randint(1, 12), random.randint(1, 28))
+	if column in ('Analyte', 'AnalyteName'):
+		return random.choice(['E. coli', 'Diazinon', 'Oxygen, Dissolved', 'pH'] * 5 + ['Surrogate: DBOB'])
+	if column == 'StationCode':
+		return random.choice(['204ALP100', '801ORDC01', '514FC1166'] * 10 + ['000NONPJ', 'LABQA', 'FIELDQA'])
+	if column == 'Result':
+		return random.choice(['', '0.5', '12', '-88'])
+	if column == 'Latitude' or column == 'TargetLatitude':
+		return random.choice(['', '37.123', '0.0', '-88', '38.5'])
+	if codes and random.random() < 0.1:
+		return random.choice(list(codes))
+	return random.choice(['', 'NR', 'Something else', 'Something else', 'Something else'])
+
+
+def make_records(Mod_CodeColumns, columns, rows, irDate):
+	records = []
+	for i in range(rows):
+		records += [dict((column, random_value(column, Mod_CodeColumns.get(column, {}), irDate)
+		                  if column not in ('DataQuality', 'DataQualityIndicator') else '') for column in columns)]
+	return records
+
+
+if __name__ == "__main__":
+	rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+	random.seed(42)
+	for filename, table, irDate in [('WaterChemistryData', 'WQDMart_MV', False), ('ToxicityData', 'ToxDmart_MV', False),
+	                                 ('TissueData', 'TissueDMart_MV', False), ('HabitatData', 'HabitatDMart_MV', False),
+	                                 ('IR_WaterChemistryData', 'IR2018_WQ', True),
+	                                 ('IR_TissueData', 'IR2018_Tissue', True), ]:
+		Mod_CodeColumns = DictionaryFixer(CodeColumns, filename)
+		columns = list(Mod_CodeColumns) + ['StationName', 'SampleDate', 'Result', 'DataQuality',
+		                                   'DataQualityIndicator']
+		columns = list(dict.fromkeys(columns))
+		records = make_records(Mod_CodeColumns, columns, rows, irDate)
+		start = time.perf_counter()
+		before = [legacy_DQ(dict(record), Mod_CodeColumns, table) for record in records]
+		legacyTime = time.perf_counter() - start
+		for cacheSize in (0, 50000):
+			plan = DataQualityPlan(Mod_CodeColumns, columns, table, DQ_Codes, cacheSize=cacheSize)
+			start = time.perf_counter()
+			after = []
+			for record in records:
+				DataQuality, DataQualityIndicator = plan.score(list(record.values()))
+				after += [(DataQuality, record['DataQualityIndicator'] if DataQualityIndicator is None
+				           else DataQualityIndicator)]
+			planTime = time.perf_counter() - start
+			mismatches = sum(1 for a, b in zip(before, after) if a != b)
+			stats = plan.cache_stats()
+			print('%-22s legacy %10.0f rows/sec   compiled (cache %5d) %10.0f rows/sec   %.1fx   mismatches: %d'
+			      '   hits: %d misses: %d' % (filename, rows / legacyTime, cacheSize, rows / planTime,
+			                                  legacyTime / planTime, mismatches, stats['hits'], stats['misses']))
@@ -0,0 +1,287 @@
+'''
+This is the benchmark suite of the whole pipeline, run against the synthetic DataMart of Synthetic_DataMart.py so it
+can be measured without the internal server. Every benchmark runs in its own process, at each number of rows, and
+reports rows/sec, the peak memory (RSS) of the process and the bytes written:
+	data_retrieval   the weekly tables (CEDEN_DataRefresh.py) with the SafeToSwim and Pesticides subsets. The
+	                 number of rows is shared between the tables like in the DataMart, most of it is water chemistry.
+	                 The records are written behind, on a writer thread (CEDEN_Writer.py).
+	data_retrieval_direct
+	                 the same without the writer thread (writeBehind=0), to see what the write behind stage buys
+	data_retrieval_SQLite
+	                 the same tables read from a SQLite copy of the synthetic DataMart (SQLiteBackend in
+	                 CEDEN_Backend.py) by 4 worker processes, water chemistry in 4 shards. It measures the parallel
+	                 extraction, which the fake cursor can't shard.
+	selectByAnalyte  the SafeToSwim subset of a water chemistry file
+	decodeAndStrip   cleaning the rows with the Sanitizer (CEDEN_Sanitizer.py), which replaced decodeAndStrip
+	By_RB            splitting IR water chemistry records into a file per Regional Board (RegionPartitioner in
+	                 CEDEN_Subsets.py)
+	The results are kept in a baseline file. The first run writes it, the next runs are compared to it and the
+suite fails when a benchmark got slower (rows/sec) or bigger (peak memory) by more than threshold percent. Remove
+the baseline file after a change that is meant to be slower, or on another machine, to take a new one.
+
+	python WorkingScripts\\Benchmark_Pipeline.py [numbers of rows] [baseline file] [threshold percent] [benchmarks]
+	python WorkingScripts\\Benchmark_Pipeline.py 100000,1000000 Benchmark_Baseline.json 10 data_retrieval,By_RB
+
+10^8 rows take hours and tens of GB of disk for data_retrieval, start with 10^5 and 10^6 (the default).
+'''
+
+import os, sys, csv, json, time, shutil, tempfile, platform, multiprocessing
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import CEDEN_DataRefresh
+from CEDEN_DataRefresh import data_retrieval, selectByAnalyte, WQX_table
+from CEDEN_Subsets import Subset, RegionPartitioner
+from CEDEN_Sanitizer import Sanitizer, printable_for
+from CEDEN_Records import RecordLayout
+from CEDEN_Backend import SQLiteBackend
+from CEDEN_Writer import WRITE_DEPTH
+from Synthetic_DataMart import SyntheticDataMart, NON_IR
+
+SAFE_TO_SWIM = ['E. coli', 'Enterococcus', 'Coliform, Total', 'Coliform, Fecal', ]
+PESTICIDES = ['Diazinon', 'Chlorpyrifos', 'Aldicarb ', 'Bifenthrin', ]
+# the share of the rows of each view in data_retrieval, roughly the sizes of the DataMart views
+SHARES = {'WQDMart_MV': 0.7, 'ToxDmart_MV': 0.1, 'TissueDMart_MV': 0.08, 'BenthicDMart_MV': 0.07,
+          'HabitatDMart_MV': 0.05, }
+
+
+# peak_rss is the most memory this process had, in bytes. resource is only there on linux and mac, psutil gives it on
+# windows if it is installed.
+def peak_rss():
+	try:
+		import resource
+		peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+		# linux gives KB, mac bytes
+		return peak if sys.platform == 'darwin' else peak * 1024
+	except ImportError:
+		pass
+	try:
+		import psutil
+		return psutil.Process().memory_info().peak_wset
+	except (ImportError, AttributeError):
+		return None
+
+
+def folder_size(folder):
+	return sum(os.path.getsize(os.path.join(path, name)) for path, folders, names in os.walk(folder)
+	           for name in names)
+
+
+# quietly runs function without its prints, the pipeline prints a few lines per table
+def quietly(function, *args, **kwargs):
+	with open(os.devnull, 'w') as devnull:
+		stdout, sys.stdout = sys.stdout, devnull
+		try:
+			return function(*args, **kwargs)
+		finally:
+			sys.stdout = stdout
+
+
+# synthetic_cursor returns a cursor on every row of a view
+def synthetic_cursor(datamart, view):
+	cursor = datamart.connect().cursor()
+	cursor.execute('SELECT * FROM %s WHERE 1 = 0' % view)
+	cursor.execute('SELECT %s FROM %s' % (', '.join('[%s]' % column[0] for column in cursor.description), view))
+	return cursor
+
+
+# synthetic_records returns the column names of a view and its records, cleaned like extract_table does. The
+# records are made as they are read.
+def synthetic_records(datamart, view, rename=()):
+	cursor = synthetic_cursor(datamart, view)
+	names = [column[0] for column in cursor.description]
+	for old, new in rename:
+		names = [name.replace(old, new) for name in names]
+	sanitizer = Sanitizer(printable_for('CEDEN'))
+	layout = RecordLayout(names)
+
+	def records():
+		while True:
+			batch = cursor.fetchmany(5000)
+			if not batch:
+				return
+			for row in batch:
+				yield layout.record(sanitizer.clean_row(row))
+	return names, records()
+
+
+# Each benchmark takes the number of rows and an empty folder to write in. It gets everything ready (the synthetic
+# rows are made then) and returns the function that is timed, which returns the rows it handled and the bytes it
+# wrote.
+def synthetic_subsets():
+	return [Subset(newFileName='SafeToSwim.csv', table='WaterChemistryData', field_filter='Analyte',
+	               analytes=SAFE_TO_SWIM, sep=','),
+	        Subset(newFileName='Pesticides.csv', table='WaterChemistryData', field_filter='DW_AnalyteName',
+	               analytes=PESTICIDES, sep=',')]
+
+
+def bench_data_retrieval(rows, folder, writeBehind=WRITE_DEPTH):
+	datamart = SyntheticDataMart({view: int(rows * share) for view, share in SHARES.items()})
+	datamart.install(CEDEN_DataRefresh)
+	for view in list(SHARES) + [WQX_table]:
+		datamart.pool(view)
+	subsets = synthetic_subsets()
+
+	def run():
+		quietly(data_retrieval, NON_IR, folder, ',', '.csv', False, subsets=subsets, writeBehind=writeBehind)
+		return sum(datamart.count(view) for view in SHARES) + datamart.count(WQX_table), folder_size(folder)
+	return run
+
+
+def bench_data_retrieval_direct(rows, folder):
+	return bench_data_retrieval(rows, folder, writeBehind=0)
+
+
+# the files are written in a folder of their own so the SQLite file isn't counted in the bytes written
+def bench_data_retrieval_SQLite(rows, folder):
+	datamart = SyntheticDataMart({view: int(rows * share) for view, share in SHARES.items()})
+	datamart.install(CEDEN_DataRefresh)
+	database = datamart.to_sqlite(os.path.join(folder, 'DataMart.sqlite'), list(SHARES) + [WQX_table])
+	output = os.path.join(folder, 'output')
+	os.mkdir(output)
+	subsets = synthetic_subsets()
+
+	def run():
+		quietly(data_retrieval, NON_IR, output, ',', '.csv', False, subsets=subsets, workers=4,
+		        shards={'WaterChemistryData': 4}, shardKey='YEAR(SampleDate)', backend=SQLiteBackend(database))
+		return sum(datamart.count(view) for view in SHARES) + datamart.count(WQX_table), folder_size(output)
+	return run
+
+
+def bench_selectByAnalyte(rows, folder):
+	names, records = synthetic_records(SyntheticDataMart(rows), 'WQDMart_MV', rename=(('TargetL', 'L'), ))
+	with open(os.path.join(folder, 'WaterChemistryData.csv'), 'w', newline='', encoding='utf8') as fileOut:
+		writer = csv.writer(fileOut, lineterminator='\n')
+		writer.writerow(names)
+		writer.writerows(records)
+	size = folder_size(folder)
+
+	def run():
+		quietly(selectByAnalyte, folder, 'WaterChemistryData.csv', SAFE_TO_SWIM, 'SafeToSwim.csv', 'Analyte', ',')
+		return rows, folder_size(folder) - size
+	return run
+
+
+def bench_decodeAndStrip(rows, folder):
+	cursor = synthetic_cursor(SyntheticDataMart(rows), 'WQDMart_MV')
+	sanitizer = Sanitizer(printable_for('CEDEN'))
+
+	def run():
+		count = 0
+		while True:
+			batch = cursor.fetchmany(5000)
+			if not batch:
+				return count, 0
+			sanitizer.clean_rows(batch)
+			count += len(batch)
+	return run
+
+
+# the records are cleaned as they are read, like in extract_table, so the cleaning is part of the time
+def bench_By_RB(rows, folder):
+	names, records = synthetic_records(SyntheticDataMart({'IR2018_WQ': rows}), 'IR2018_WQ')
+	partitioner = RegionPartitioner(table='IR_WaterChemistryData', field_filter='RegionalBoardID', sep='\t',
+	                                extension='.txt')
+
+	def run():
+		partitioner.open(folder, names)
+		count = 0
+		for record in records:
+			partitioner.route(record)
+			count += 1
+		partitioner.close()
+		return count, folder_size(folder)
+	return run
+
+
+BENCHMARKS = {'data_retrieval': bench_data_retrieval, 'data_retrieval_direct': bench_data_retrieval_direct,
+              'data_retrieval_SQLite': bench_data_retrieval_SQLite, 'selectByAnalyte': bench_selectByAnalyte,
+              'decodeAndStrip': bench_decodeAndStrip, 'By_RB': bench_By_RB, }
+
+
+# measure runs in its own process so the peak memory is the one of the benchmark alone
+def measure(name, rows, results):
+	folder = tempfile.mkdtemp()
+	try:
+		benchmark = BENCHMARKS[name](rows, folder)
+		start = time.perf_counter()
+		count, written = benchmark()
+		seconds = time.perf_counter() - start
+		results.put({'rows': count, 'seconds': seconds, 'rowsPerSecond': count / seconds, 'peakRSS': peak_rss(),
+		             'outputBytes': written})
+	except BaseException as error:
+		results.put({'error': repr(error)})
+		raise
+	finally:
+		shutil.rmtree(folder, ignore_errors=True)
+
+
+def run(name, rows):
+	results = multiprocessing.Queue()
+	process = multiprocessing.Process(target=measure, args=(name, rows, results))
+	process.start()
+	result = results.get()
+	process.join()
+	return result
+
+
+# compare returns the benchmarks that got worse than the baseline by more than threshold (a fraction)
+def compare(results, baseline, threshold):
+	worse = []
+	print('\n%-30s %14s %14s %9s %12s %12s %9s' % ('benchmark', 'rows/sec', 'baseline', 'change', 'peak MB',
+	                                                'baseline', 'change'))
+	for key, result in results.items():
+		before = baseline.get(key)
+		if before is None or 'error' in result:
+			continue
+		speed = result['rowsPerSecond'] / before['rowsPerSecond'] - 1
+		memory = result['peakRSS'] / before['peakRSS'] - 1 if result['peakRSS'] and before['peakRSS'] else 0.
+		slower = speed < -threshold or memory > threshold
+		print('%-30s %14.0f %14.0f %8.1f%% %12.1f %12.1f %8.1f%% %s' % (key, result['rowsPerSecond'],
+		                                                              before['rowsPerSecond'], speed * 100,
+		                                                              (result['peakRSS'] or 0) / 1e6,
+		                                                              (before['peakRSS'] or 0) / 1e6, memory * 100,
+		                                                              'REGRESSION' if slower else ''))
+		if slower:
+			worse += [key]
+	return worse
+
+
+if __name__ == "__main__":
+	sizes = [int(float(size)) for size in (sys.argv[1] if len(sys.argv) > 1 else '1e5,1e6').split(',')]
+	baselineFile = sys.argv[2] if len(sys.argv) > 2 else os.path.join(os.path.dirname(os.path.abspath(__file__)),
+	                                                                  'Benchmark_Baseline.json')
+	threshold = float(sys.argv[3]) / 100 if len(sys.argv) > 3 else 0.1
+	names = sys.argv[4].split(',') if len(sys.argv) > 4 else list(BENCHMARKS)
+	print('%-30s %12s %9s %14s %10s %12s' % ('benchmark', 'rows', 'sec', 'rows/sec', 'peak MB', 'output MB'))
+	results = {}
+	for rows in sizes:
+		for name in names:
+			key = '%s %d' % (name, rows)
+			results[key] = result = run(name, rows)
+			if 'error' in result:
+				print('%-30s FAILED %s' % (key, result['error']))
+				continue
+			print('%-30s %12d %9.1f %14.0f %10.1f %12.1f' % (key, result['rows'], result['seconds'],
+			                                                  result['rowsPerSecond'], (result['peakRSS'] or 0) / 1e6,
+			                                                  result['outputBytes'] / 1e6))
+	failed = [key for key, result in results.items() if 'error' in result]
+	machine = {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count()}
+	if os.path.isfile(baselineFile):
+		with open(baselineFile, 'r', encoding='utf8') as baselineIn:
+			baseline = json.load(baselineIn)
+		if baseline['machine'] != machine:
+			print('\nThe baseline was taken on %s, the numbers may not compare' % baseline['machine'])
+		worse = compare(results, baseline['results'], threshold)
+		missing = [key for key in results if key not in baseline['results']]
+		if missing:
+			print('Not in the baseline: %s' % ', '.join(missing))
+		print('\n%d benchmarks got more than %.0f%% worse than the baseline' % (len(worse), threshold * 100)
+		      if worse else '\nno regression against the baseline')
+		failed += worse
+	else:
+		with open(baselineFile, 'w', encoding='utf8') as baselineOut:
+			json.dump({'machine': machine, 'taken': time.strftime('%Y-%m-%d %H:%M'),
+			           'results': {key: result for key, result in results.items() if 'error' not in result}},
+			          baselineOut, indent=1)
+		print('\nSaved the baseline in %s' % baselineFile)
+	sys.exit(1 if failed else 0)
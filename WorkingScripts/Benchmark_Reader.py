@@ -0,0 +1,93 @@
+'''
+This is a testing script for the BatchedReader (CEDEN_Reader.py). It uses a FakeCursor that serves synthetic
+CEDEN rows with a made up network delay per round trip, so we can measure how much the background fetching
+overlaps with the row cleaning without a SQL Server.
+
+	python WorkingScripts\\Benchmark_Reader.py [number of rows] [delay per round trip in ms]
+'''
+
+import os, sys, time, random, string
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from CEDEN_Reader import BatchedReader
+
+
+# FakeCursor acts like an executed pyodbc cursor. Every fetchone/fetchmany is a round trip that costs
+# roundTrip seconds plus perRow seconds for each row returned. time.sleep lets go of the GIL like pyodbc does.
+class FakeCursor:
+	def __init__(self, rows, columns, roundTrip=0.002, perRow=0.00001):
+		self.description = [(column, str, None, None, None, None, True) for column in columns]
+		self._rows = rows
+		self._position = 0
+		self.roundTrip = roundTrip
+		self.perRow = perRow
+		self.arraysize = 1
+		self.calls = 0
+
+	def fetchmany(self, size=None):
+		size = size or self.arraysize
+		batch = self._rows[self._position:self._position + size]
+		self._position += len(batch)
+		self.calls += 1
+		time.sleep(self.roundTrip + self.perRow * len(batch))
+		return batch
+
+	def fetchone(self):
+		batch = self.fetchmany(1)
+		return batch[0] if batch else None
+
+	def __iter__(self):
+		while True:
+			row = self.fetchone()
+			if row is None:
+				return
+			yield row
+
+
+COLUMNS = ['StationCode', 'StationName', 'SampleDate', 'Analyte', 'Result', 'ResultQualCode', 'QACode',
+           'TargetLatitude', 'TargetLongitude']
+
+
+# synthetic_rows makes rows that look like WQDMart_MV rows, with a few non-printable characters mixed in
+def synthetic_rows(count, seed=42):
+	rnd = random.Random(seed)
+	rows = []
+	for i in range(count):
+		rows += [('%03dABC%03d' % (rnd.randint(100, 999), rnd.randint(0, 999)),
+		          rnd.choice(['Bear Creek at Hwy 20', 'Sacramento River\t@ Freeport', 'Lake Tahoe\x00 Site']),
+		          '%d-%02d-%02d 00:00:00' % (rnd.randint(1990, 2018), rnd.randint(1, 12), rnd.randint(1, 28)),
+		          rnd.choice(['E. coli', 'Diazinon', 'Oxygen, Dissolved', 'pH']),
+		          rnd.choice([None, rnd.random() * 100]),
+		          rnd.choice(['=', 'ND', 'DNQ']), rnd.choice(['None', 'J', 'BX,J']),
+		          37 + rnd.random(), -120 - rnd.random()), ]
+	return rows
+
+
+printable = set(string.printable) - set('|\"\t\r\n\f\v')
+
+
+# work is roughly what data_retrieval does with every row before it gets written
+def work(row):
+	return [''.join(filter(lambda x: x in printable, str(t))) if t is not None else '' for t in row]
+
+
+def run(label, rows, iterable_factory):
+	cursor = FakeCursor(rows, COLUMNS, roundTrip=roundTrip)
+	start = time.perf_counter()
+	count = 0
+	for row in iterable_factory(cursor):
+		work(row)
+		count += 1
+	elapsed = time.perf_counter() - start
+	print('%-40s %8d rows  %6.2f sec  %10.0f rows/sec  %6d round trips' % (label, count, elapsed, count / elapsed,
+	                                                                       cursor.calls))
+
+
+if __name__ == "__main__":
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+	roundTrip = float(sys.argv[2]) / 1000 if len(sys.argv) > 2 else 0.0005
+	rows = synthetic_rows(count)
+	if count <= 20000:
+		run('for row in cursor (one row per trip)', rows, lambda cursor: cursor)
+	run('fetchmany, no prefetch', rows, lambda cursor: BatchedReader(cursor, prefetch=False))
+	run('fetchmany + background prefetch', rows, lambda cursor: BatchedReader(cursor))
+	run('fetchmany + prefetch + auto tune', rows, lambda cursor: BatchedReader(cursor, autoTune=True))
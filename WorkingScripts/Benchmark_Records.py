@@ -0,0 +1,106 @@
+'''
+This is a testing script for the RecordLayout (CEDEN_Records.py). It runs the per row work of data_retrieval on
+synthetic WQDMart_MV rows twice, once with the old recordDict = dict(zip(columns, filtered)) and list(values) for
+each writer, once with the record layout, and reports the time, the peak memory (tracemalloc) and the number of
+garbage collections of each. It also checks that both write exactly the same files.
+
+	python WorkingScripts\\Benchmark_Records.py [number of rows]
+'''
+
+import os, sys, io, csv, gc, time, tracemalloc
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from CEDEN_Records import RecordLayout
+from CEDEN_Sanitizer import Sanitizer, printable_for
+from Benchmark_Reader import COLUMNS, synthetic_rows
+
+# the columns data_retrieval adds to every table but WQX
+COLUMNS = [column.replace('TargetL', 'L') for column in COLUMNS] + ['DataQuality', 'DataQualityIndicator', 'Datum']
+WQX_Sites = {'204ALP100': 'NAD83'}
+
+
+def with_dict(rows, writers, sanitizer):
+	AllSites = {}
+	for row in rows:
+		filtered = sanitizer.clean_row(row)
+		while len(COLUMNS) > len(filtered):
+			filtered += ['']
+		recordDict = dict(zip(COLUMNS, filtered))
+		try:
+			long = float(recordDict['Longitude'])
+			if 0. < long < 10000.0:
+				recordDict['Longitude'] = -long
+		except ValueError:
+			pass
+		recordDict['Datum'] = WQX_Sites.get(recordDict['StationCode'], 'NR')
+		recordDict['DataQuality'] = 'Passed'
+		values = list(recordDict.values())
+		for writer in writers:
+			writer.writerow(values)
+		if recordDict['StationCode'] not in AllSites:
+			AllSites[recordDict['StationCode']] = [recordDict['StationName'], recordDict['Latitude'],
+			                                       recordDict['Longitude'], recordDict['Datum'], ]
+	return AllSites
+
+
+def with_layout(rows, writers, sanitizer):
+	AllSites = {}
+	layout = RecordLayout(COLUMNS)
+	StationSlot, StationNameSlot = layout.slot('StationCode'), layout.slot('StationName')
+	LatitudeSlot, LongitudeSlot = layout.slot('Latitude'), layout.slot('Longitude')
+	DatumSlot, DataQualitySlot = layout.slot('Datum'), layout.slot('DataQuality')
+	for row in rows:
+		record = layout.record(sanitizer.clean_row(row))
+		try:
+			long = float(record[LongitudeSlot])
+			if 0. < long < 10000.0:
+				record[LongitudeSlot] = -long
+		except ValueError:
+			pass
+		record[DatumSlot] = WQX_Sites.get(record[StationSlot], 'NR')
+		record[DataQualitySlot] = 'Passed'
+		for writer in writers:
+			writer.writerow(record)
+		if record[StationSlot] not in AllSites:
+			AllSites[record[StationSlot]] = [record[StationNameSlot], record[LatitudeSlot],
+			                                 record[LongitudeSlot], record[DatumSlot], ]
+	return AllSites
+
+
+def run(label, work, rows, sanitizer):
+	# the full file and one date range file, like data_retrieval
+	outputs = [open(os.devnull, 'w', newline='', encoding='utf8') for i in range(2)]
+	writers = [csv.writer(output, csv.QUOTE_MINIMAL, delimiter=',', lineterminator='\n') for output in outputs]
+	gc.collect()
+	collections = sum(stat['collections'] for stat in gc.get_stats())
+	start = time.perf_counter()
+	work(rows, writers, sanitizer)
+	elapsed = time.perf_counter() - start
+	collections = sum(stat['collections'] for stat in gc.get_stats()) - collections
+	# and again to measure the memory, tracemalloc slows everything down
+	tracemalloc.start()
+	work(rows, writers, sanitizer)
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	for output in outputs:
+		output.close()
+	print('%-32s %6.2f sec  %10.0f rows/sec  peak %7.2f MB  %5d collections' %
+	      (label, elapsed, len(rows) / elapsed, peak / 1024 / 1024, collections))
+
+
+# written returns what work writes for rows
+def written(work, rows, sanitizer):
+	output = io.StringIO()
+	work(rows, [csv.writer(output, csv.QUOTE_MINIMAL, delimiter=',', lineterminator='\n')], sanitizer)
+	return output.getvalue()
+
+
+if __name__ == "__main__":
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+	rows = synthetic_rows(count)
+	sanitizer = Sanitizer(printable_for('CEDEN'))
+	run('dict(zip(columns, filtered))', with_dict, rows, sanitizer)
+	run('RecordLayout', with_layout, rows, sanitizer)
+	same = written(with_dict, rows[:20000], sanitizer) == written(with_layout, rows[:20000], sanitizer)
+	print('same output' if same else 'the output is DIFFERENT')
+	sys.exit(0 if same else 1)
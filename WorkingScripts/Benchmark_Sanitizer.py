@@ -0,0 +1,78 @@
+'''
+This is a testing script for the Sanitizer (CEDEN_Sanitizer.py). It first checks that every profile gives exactly
+the same values as the old decodeAndStrip function of the scripts, then times both on synthetic CEDEN field text:
+station names, dates, analytes, results, QA codes and comments, with a few tabs, quotes, returns and non ascii
+characters mixed in like the DataMart has.
+
+	python WorkingScripts\\Benchmark_Sanitizer.py [number of rows] [percent of rows with something to strip]
+'''
+
+import os, sys, time, random, string, datetime
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from CEDEN_Sanitizer import Sanitizer, PROFILES, printable_for
+
+# the printable filters exactly as the scripts used to write them
+ORIGINAL = {'CEDEN': set(string.printable) - set('|\"\t\r\n\f\v'),
+            # written '|"\`\t\r\n\f\v' in FHAB_BloomReport.py, which is a backslash and a back quote
+            'FHAB_BloomReport': set(string.printable) - set('|"\\`\t\r\n\f\v'),
+            'FHAB_update': set(string.printable) - set('|"\'`\t\r\n\f\v'), }
+
+DIRT = ['\t', '"', '|', '\r\n', '\x00', '\x0b', "'", '`', '\\', '\xe9', '\xb5', '\u2013', '\ufeff']
+
+
+# synthetic_rows makes rows that look like WQDMart_MV rows. dirty is the fraction of rows with something to strip.
+def synthetic_rows(count, dirty, seed=42):
+	rnd = random.Random(seed)
+	rows = []
+	for i in range(count):
+		row = ['%03dABC%03d' % (rnd.randint(100, 999), rnd.randint(0, 999)),
+		       rnd.choice(['Bear Creek at Hwy 20', 'Sacramento River @ Freeport', 'Lake Tahoe - Emerald Bay']),
+		       datetime.datetime(rnd.randint(1990, 2018), rnd.randint(1, 12), rnd.randint(1, 28)),
+		       rnd.choice(['E. coli', 'Diazinon', 'Oxygen, Dissolved, Total', 'pH', 'Chlorpyrifos']),
+		       rnd.choice([None, rnd.random() * 100, 'None', '']), rnd.choice(['=', 'ND', 'DNQ']),
+		       rnd.choice(['None', 'J', 'BX,J']), 'mg/L', 37 + rnd.random(), -120 - rnd.random(),
+		       rnd.choice(['', 'Sample collected by boat', 'Duplicate, see lab report 2015-113', None])]
+		if rnd.random() < dirty:
+			position = rnd.randrange(len(row))
+			row[position] = str(row[position]) + rnd.choice(DIRT) + 'x'
+		rows += [tuple(row)]
+	return rows
+
+
+# decodeAndStrip is the function the scripts had, with the None handling of data_retrieval
+def decodeAndStrip(row, printable):
+	return [''.join(filter(lambda x: x in printable, str(t))) if t is not None else '' for t in row]
+
+
+def timed(label, function, count):
+	start = time.perf_counter()
+	function()
+	elapsed = time.perf_counter() - start
+	print('%-40s %6.2f sec  %10.0f rows/sec' % (label, elapsed, count / elapsed))
+	return elapsed
+
+
+if __name__ == "__main__":
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+	dirty = float(sys.argv[2]) / 100 if len(sys.argv) > 2 else 0.02
+	passed = True
+	every = synthetic_rows(5000, 1.) + [tuple(chr(code) for code in range(0x3000))]
+	for profile in PROFILES:
+		if printable_for(profile) != ORIGINAL[profile]:
+			print('%s profile does not match the original printable filter' % profile)
+			passed = False
+		sanitizer = Sanitizer(ORIGINAL[profile])
+		if any(sanitizer.clean_row(row) != decodeAndStrip(row, ORIGINAL[profile]) for row in every):
+			print('%s profile does not give the same values as decodeAndStrip' % profile)
+			passed = False
+	print('all profiles give the same values as decodeAndStrip' if passed else 'some profiles FAILED')
+	rows = synthetic_rows(count, dirty)
+	printable = ORIGINAL['CEDEN']
+	sanitizer = Sanitizer(printable)
+	print('\n%d rows, %.0f%% with something to strip' % (count, dirty * 100))
+	before = timed('decodeAndStrip, one lambda per character', lambda: [decodeAndStrip(row, printable) for row in rows],
+	               count)
+	after = timed('Sanitizer.clean_row', lambda: [sanitizer.clean_row(row) for row in rows], count)
+	timed('Sanitizer.clean_rows (one batch)', lambda: sanitizer.clean_rows(rows), count)
+	print('%.1f times faster' % (before / after))
+	sys.exit(0 if passed else 1)
@@ -0,0 +1,117 @@
+'''
+This is a testing script for the RecordWriter (CEDEN_Serializer.py). It first checks that it writes exactly the same
+bytes as the csv.writer data_retrieval used, for commas and tabs, on records of the synthetic DataMart
+(Synthetic_DataMart.py) and on values the csv module has to quote. Then it times both writing the same records to a
+file: the csv module through the text layer, and the RecordWriter through a binary file.
+
+	python WorkingScripts\\Benchmark_Serializer.py [number of rows]
+
+The default is 10^7 rows, the csv module takes a few minutes for them.
+'''
+
+import os, sys, io, csv, time, hashlib, tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from CEDEN_Serializer import RecordWriter
+from CEDEN_Sanitizer import Sanitizer, printable_for
+from CEDEN_Records import RecordLayout
+from Synthetic_DataMart import SyntheticDataMart
+
+BATCH = 5000
+# values the csv module quotes or doesn't write as they are
+ODD = [['a,b', 'c'], ['a\tb', 'c'], ['say "hi"', 'x'], ['two\nlines', 'x'], ['return\r', 'x'], [''], ['x'], [],
+       [None, ''], [None], ['', ''], [-119.5, 'x'], [3, True, 'x'], ['\xe9t\xe9', 'caf\xe9'], [' spaces ', ' ']]
+
+
+# synthetic_batch returns the column names and a batch of records of a view of the synthetic DataMart, cleaned like
+# extract_table does, with a DataQualityIndicator that has commas in one record out of ten and a few Longitudes made
+# negative.
+def synthetic_batch(view):
+	cursor = SyntheticDataMart({view: BATCH}).connect().cursor()
+	cursor.execute('SELECT * FROM %s WHERE 1 = 0' % view)
+	cursor.execute('SELECT %s FROM %s' % (', '.join('[%s]' % column[0] for column in cursor.description), view))
+	names = [column[0] for column in cursor.description] + ['DataQuality', 'DataQualityIndicator']
+	layout = RecordLayout(names)
+	sanitizer = Sanitizer(printable_for('CEDEN'))
+	records = [layout.record(sanitizer.clean_row(row)) for row in cursor.fetchmany(BATCH)]
+	for number, record in enumerate(records):
+		record[-2] = 'Passed QC'
+		record[-1] = 'ResultQACode:BX,J; BatchVerificationCode:VLMQ' if number % 10 == 0 else ''
+		if number % 100 == 0:
+			record[layout.slot('TargetLongitude')] = 119.5 + number / 1000
+	return names, records
+
+
+def csv_bytes(records, sep):
+	text = io.StringIO()
+	csv.writer(text, csv.QUOTE_MINIMAL, delimiter=sep, lineterminator='\n').writerows(records)
+	return text.getvalue().encode('utf8')
+
+
+def serialized_bytes(records, sep, batch=True):
+	data = io.BytesIO()
+	writer = RecordWriter(data, sep)
+	if batch:
+		writer.writerows(records)
+	else:
+		for record in records:
+			writer.writerow(record)
+	return data.getvalue()
+
+
+# write_csv and write_serialized write the batch until count rows are written and return the hash of the file
+def write_csv(path, names, records, sep, count):
+	with open(path, 'w', newline='', encoding='utf8') as fileOut:
+		writer = csv.writer(fileOut, csv.QUOTE_MINIMAL, delimiter=sep, lineterminator='\n')
+		writer.writerow(names)
+		for start in range(0, count, BATCH):
+			writer.writerows(records[:count - start])
+
+
+def write_serialized(path, names, records, sep, count):
+	with open(path, 'wb') as fileOut:
+		writer = RecordWriter(fileOut, sep)
+		writer.writerow(names)
+		for start in range(0, count, BATCH):
+			writer.writerows(records[:count - start])
+
+
+def timed(label, function, count):
+	start = time.perf_counter()
+	function()
+	elapsed = time.perf_counter() - start
+	print('%-40s %7.2f sec  %10.0f rows/sec' % (label, elapsed, count / elapsed))
+	return elapsed
+
+
+def file_hash(path):
+	with open(path, 'rb') as fileIn:
+		return hashlib.sha256(fileIn.read()).hexdigest()
+
+
+if __name__ == "__main__":
+	count = int(sys.argv[1]) if len(sys.argv) > 1 else 10 ** 7
+	passed = True
+	batches = {',': synthetic_batch('WQDMart_MV'), '\t': synthetic_batch('IR2018_WQ')}
+	for sep, (names, records) in batches.items():
+		for label, sample in (('synthetic records', [names] + records), ('odd values', ODD)):
+			for batch in (True, False):
+				if serialized_bytes(sample, sep, batch) != csv_bytes(sample, sep):
+					print('%s separated by %r are not written like the csv module does (%s)' %
+					      (label, sep, 'writerows' if batch else 'writerow'))
+					passed = False
+	print('the RecordWriter writes the same bytes as the csv module' if passed else 'some records FAILED')
+	folder = tempfile.mkdtemp()
+	for sep, (names, records) in batches.items():
+		print('\n%d rows of %d columns separated by %r' % (count, len(names), sep))
+		before = timed('csv.writer, text file',
+		               lambda: write_csv(os.path.join(folder, 'csv.txt'), names, records, sep, count), count)
+		after = timed('RecordWriter, binary file',
+		              lambda: write_serialized(os.path.join(folder, 'serialized.txt'), names, records, sep, count), count)
+		same = file_hash(os.path.join(folder, 'csv.txt')) == file_hash(os.path.join(folder, 'serialized.txt'))
+		print('%.1f times faster, %s' % (before / after, 'the files are the same' if same else 'the files DIFFER'))
+		passed &= same
+		for name in ('csv.txt', 'serialized.txt'):
+			os.remove(os.path.join(folder, name))
+	os.rmdir(folder)
+	sys.exit(0 if passed else 1)
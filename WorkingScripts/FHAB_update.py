@@ -32,15 +32,18 @@ Prerequisites:
 '''
 
 # Import the necessary libraries of python code
-import pyodbc
 import os
 import csv
-import re
 from datetime import datetime
-import string
+import sys
 from dkan.client import DatasetAPI
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from CEDEN_Sanitizer import Sanitizer, printable_for
+from CEDEN_Records import RecordLayout
+from CEDEN_Backend import SQLServerBackend
 
-printable = set(string.printable) - set('|"\'`\t\r\n\f\v')
+printable = printable_for('FHAB_update')
+sanitizer = Sanitizer(printable)
 SERVER = os.environ.get('FHAB_Server')
 UID = os.environ.get('FHAB_User')
 ### you must change this path to suite your computer
@@ -54,13 +57,7 @@ ext = '.csv'
 sep = '|'
 file = os.path.join(path, FHAB + ext)
 
-
-# decodeAndStrip takes a string and filters each character through the printable variable. It returns a filtered string.
-def decodeAndStrip(t):
-	filter1 = ''.join(filter(lambda x: x in printable, str(t)))
-	return filter1
-
-cnxn = pyodbc.connect(Driver='ODBC Driver 11 for SQL Server', Server=SERVER, uid=UID, Trusted_Connection='Yes')
+cnxn = SQLServerBackend(SERVER, uid=UID, trusted=True).connect()
 cursor = cnxn.cursor()
 sql = "SELECT dbo.AlgaeBloomReport.AlgaeBloomReportID, dbo.AlgaeBloomReport.RegionalBoardID, dbo.AlgaeBloomReport.CountyID," \
       " dbo.AlgaeBloomReport.Latitude, dbo.AlgaeBloomReport.Longitude, dbo.AlgaeBloomReport.ObservationDate, CASE WHEN " \
@@ -78,17 +75,19 @@ with open(file, 'w', newline='', encoding='utf8') as writer:
 	dw = csv.DictWriter(writer, fieldnames=columns, delimiter=sep, lineterminator='\n')
 	dw.writeheader()
 	FHAB_writer = csv.writer(writer, csv.QUOTE_MINIMAL, delimiter=sep, lineterminator='\n')
+	layout = RecordLayout(columns)
+	LongitudeSlot = layout.slot('Longitude')
 	for row in cursor:
 		row = [str(word).replace('None', '') for word in row]
-		filtered = [decodeAndStrip(t) for t in list(row)]
-		newDict = dict(zip(columns, filtered))
+		# the cleaned row is the record that gets written, see CEDEN_Records.py
+		record = layout.record(sanitizer.clean_row(row))
 		try:
-			long = float(newDict['Longitude'])
+			long = float(record[LongitudeSlot])
 			if long > 0:
-				newDict['Longitude'] = -long
+				record[LongitudeSlot] = -long
 		except ValueError:
 			pass
-		FHAB_writer.writerow(list(newDict.values()))
+		FHAB_writer.writerow(record)
 
 # 2156 FHAB portal data
 NODE = 2156
@@ -0,0 +1,311 @@
+'''
+This is a stand in for the SWRCB DataMart, for the benchmarks (see Benchmark_Pipeline.py) and for trying the
+scripts without access to the internal server. It makes seeded, made up rows for every view of the tables
+dictionaries in CEDEN_DataRefresh.py (WQDMart_MV, ToxDmart_MV, TissueDMart_MV, BenthicDMart_MV, HabitatDMart_MV,
+DM_WQX_Stations_MV and the IR2018_* views) and serves them through a fake connection and cursor, it is a backend like
+the ones of CEDEN_Backend.py.
+	The code columns are drawn from the dictionaries data_retrieval scores with (QA_Code_list, ResultQualCode_list,
+BatchVerificationCode_list, ...): mostly the usual value, sometimes any other code of the dictionary and once in a
+while a code that isn't in it. A few values get a tab, quote, pipe, return or non ascii character like the DataMart
+has, so the Sanitizer has something to strip.
+	Making millions of rows one by one would take longer than extracting them, so every view has a pool of poolSize
+rows that is served over and over until the view has its number of rows. The same seed always gives the same rows.
+
+	from Synthetic_DataMart import SyntheticDataMart
+	datamart = SyntheticDataMart(rows=1000000, seed=42)
+	datamart.install(CEDEN_DataRefresh)      # CEDEN_DataRefresh.DataMart_connect now connects to it
+
+The cursor knows the queries of data_retrieval without a filter: the column names (WHERE 1 = 0), the SELECT of a
+TableQuery, COUNT(*) for the scheduler and the fingerprint of the stations view. Shards, incremental tables and
+TableQuery filters need a WHERE or GROUP BY it doesn't do. For those, write the rows to a SQLite file and read it
+with the SQLiteBackend of CEDEN_Backend.py:
+
+	datamart.to_sqlite('DataMart.sqlite')
+	data_retrieval(NON_IR, folder, ',', '.csv', False, workers=4, shards={'WaterChemistryData': 4},
+	               backend=SQLiteBackend('DataMart.sqlite'))
+'''
+
+import os, sys, re, random, sqlite3, datetime
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+import CEDEN_DataRefresh
+from CEDEN_DataRefresh import QA_Code_list, BatchVerificationCode_list, ResultQualCode_list, StationCode_list, \
+	SampleTypeCode_list, MatrixName_list, CollectionReplicate_list, ResultsReplicate_list, Datum_list
+from CEDEN_Sanitizer import printable_for
+# the IR2018 WQ and Tissue views have the dates as monthdayyear text, see CEDEN_DataQuality.py
+from CEDEN_Shards import TEXT_DATES
+
+NON_IR = {"WQX_Stations": "DM_WQX_Stations_MV", "WaterChemistryData": "WQDMart_MV", "ToxicityData": "ToxDmart_MV",
+          "TissueData": "TissueDMart_MV", "BenthicData": "BenthicDMart_MV", "HabitatData": "HabitatDMart_MV", }
+IR = {"IR_WaterChemistryData": "IR2018_WQ", "IR_ToxicityData": "IR2018_Toxicity", "IR_BenthicData": "IR2018_Benthic",
+      "IR_STORET_2010": "IR2018_Storet_2010_2012", "IR_STORET_2012": "IR2018_Storet_2012_2017",
+      "IR_NWIS": "IR2018_NWIS", "IR_Field": "IR2018_Field", "IR_TissueData": "IR2018_Tissue", }
+
+# the columns of each view, with the names the DataMart uses. The rest of a record is comments and lab details, they
+# make the rows as wide as the real ones.
+DETAILS = ['ParentProject', 'Project', 'LocationCode', 'CollectionDepth', 'UnitCollectionDepth', 'LabBatch',
+           'LabSampleID', 'MethodName', 'Unit', 'MDL', 'RL', 'SampleComments', 'CollectionComments',
+           'ResultsComments', 'SampleAgency', 'LabAgency', 'SubmittingAgency', 'AnalysisDate']
+COLUMNS = {'DM_WQX_Stations_MV': ['StationCode', 'StationName', 'TargetLatitude', 'TargetLongitude', 'Datum',
+                                  'CoordinateSource', 'LocalWatershed', 'RegionalBoardID'],
+           'WQDMart_MV': ['Program', 'StationCode', 'StationName', 'SampleDate', 'SampleTypeCode',
+                          'CollectionReplicate', 'ResultsReplicate', 'MatrixName', 'Analyte', 'DW_AnalyteName',
+                          'Result', 'ResultQualCode', 'QACode', 'BatchVerification', 'TargetLatitude',
+                          'TargetLongitude', 'Datum', 'RegionalBoardID'] + DETAILS,
+           'ToxDmart_MV': ['Program', 'StationCode', 'StationName', 'SampleDate', 'SampleTypeCode',
+                           'CollectionReplicate', 'MatrixName', 'Analyte', 'Result', 'ResultQualCode', 'QACode',
+                           'BatchVerificationCode', 'TargetLatitude', 'TargetLongitude', 'RegionalBoardID'] + DETAILS,
+           'TissueDMart_MV': ['ProgramName', 'StationCode', 'StationName', 'SampleDate', 'SampleTypeCode',
+                              'CollectionReplicate', 'ResultReplicate', 'Matrix', 'Analyte', 'Result', 'QACode',
+                              'BatchVerification', 'TargetLatitude', 'TargetLongitude', 'Datum',
+                              'RegionalBoardID'] + DETAILS,
+           'BenthicDMart_MV': ['ProgramName', 'StationCode', 'StationName', 'SampleDate', 'SampleType',
+                               'CollectionReplicate', 'ResQualCode', 'TargetLatitude', 'TargetLongitude',
+                               'RegionalBoardID', 'FinalID', 'BAResult', 'SampleComments'],
+           'HabitatDMart_MV': ['Program', 'StationCode', 'StationName', 'SampleDate', 'SampleTypeCode',
+                               'CollectionReplicate', 'MatrixName', 'Analyte', 'ResultQualCode', 'QACode',
+                               'TargetLatitude', 'TargetLongitude', 'RegionalBoardID', 'SampleComments'], }
+IR_DETAILS = ['Unit', 'MDL', 'RL', 'SampleComments', 'ResultsComments', 'SubmittingAgency']
+COLUMNS.update({'IR2018_WQ': ['ProgramName', 'StationCode', 'StationName', 'SampleDate', 'SampleTypeCode',
+                              'Replicate', 'MatrixName', 'AnalyteName', 'Result', 'ResQualCode', 'QACode',
+                              'TargetLatitude', 'TargetLongitude', 'RegionalBoardID'] + IR_DETAILS,
+                'IR2018_Toxicity': ['Program', 'StationCode', 'StationName', 'SampleDate', 'SampleTypeCode',
+                                    'CollectionReplicate', 'MatrixName', 'Analyte', 'Result', 'ResQualCode',
+                                    'QACode', 'TargetLatitude', 'TargetLongitude', 'RegionalBoard'] + IR_DETAILS,
+                'IR2018_Benthic': ['ProgramName', 'StationCode', 'StationName', 'SampleDate', 'SampleType',
+                                   'CollectionReplicate', 'ResQualCode', 'TargetLatitude', 'TargetLongitude',
+                                   'RegionalBoardID', 'FinalID', 'BAResult'],
+                'IR2018_Field': ['ProgramName', 'StationCode', 'StationName', 'SampleDate', 'SampleTypeCode',
+                                 'CollectionReplicate', 'ResultReplicate', 'MatrixName', 'Analyte', 'AnalyteName',
+                                 'Result', 'ResQualCode', 'QACode', 'TargetLatitude', 'TargetLongitude',
+                                 'RegionalBoard'] + IR_DETAILS,
+                'IR2018_Tissue': ['ProgramName', 'StationCode', 'StationName', 'SampleDate', 'SampleTypeCode',
+                                  'CollectionReplicate', 'ResultReplicate', 'Matrix', 'Analyte', 'Result',
+                                  'ResQualCode', 'QACode', 'TargetLatitude', 'TargetLongitude',
+                                  'RegionalBoardID'] + IR_DETAILS, })
+for view in ('IR2018_Storet_2010_2012', 'IR2018_Storet_2012_2017', 'IR2018_NWIS'):
+	COLUMNS[view] = COLUMNS['IR2018_WQ']
+
+# (usual value, how often it is used, dictionary of the other codes) of each code column. One code in a hundred
+# isn't in the dictionary at all.
+CODES = {'QACode': ('None', 0.7, QA_Code_list), 'ResultQualCode': ('=', 0.75, ResultQualCode_list),
+         'ResQualCode': ('=', 0.75, ResultQualCode_list),
+         'BatchVerification': ('VAC', 0.6, BatchVerificationCode_list),
+         'BatchVerificationCode': ('VAC', 0.6, BatchVerificationCode_list),
+         'SampleTypeCode': ('Grab', 0.95, SampleTypeCode_list), 'SampleType': ('Grab', 0.95, SampleTypeCode_list),
+         'MatrixName': ('samplewater', 0.97, MatrixName_list), 'Matrix': ('tissue', 0.97, MatrixName_list),
+         'CollectionReplicate': (1, 0.95, CollectionReplicate_list),
+         'ResultsReplicate': (1, 0.95, ResultsReplicate_list), 'ResultReplicate': (1, 0.95, ResultsReplicate_list),
+         'Replicate': (1, 0.95, ResultsReplicate_list), 'Datum': ('NAD83', 0.9, Datum_list), }
+ANALYTES = ['E. coli', 'Enterococcus', 'Coliform, Total', 'Coliform, Fecal', 'Diazinon', 'Chlorpyrifos', 'Aldicarb ',
+            'Bifenthrin', 'Oxygen, Dissolved, Total', 'pH', 'Temperature', 'SpecificConductivity', 'Nitrate as N',
+            'Phosphorus as P', 'Mercury', 'Copper, Dissolved', 'Turbidity', 'Surrogate: Decachlorobiphenyl']
+PROGRAMS = ['Surface Water Ambient Monitoring Program', 'Irrigated Lands Regulatory Program',
+            'Delta Regional Monitoring Program', 'Bay Area Regional Monitoring Program', 'SWAMP Bioassessment']
+WORDS = ['sample', 'collected', 'by', 'boat', 'duplicate', 'see', 'lab', 'report', 'bank', 'flow', 'low', 'high',
+         'turbid', 'clear', 'bottle', 'holding', 'time', 'exceeded', 'qualified', 'estimated', 'field', 'crew']
+PLACES = ['Bear Creek', 'Sacramento River', 'Lake Tahoe', 'San Joaquin River', 'Putah Creek', 'Salinas River',
+          'Mission Bay', 'Clear Lake', 'Russian River', 'Santa Ana River', 'Los Angeles River', 'Cache Creek']
+# the characters the Sanitizer strips
+DIRT = ['\t', '"', '|', '\r\n', '\x00', '\x0b', '\xe9', '\xb5', '\u2013', '\ufeff']
+
+
+# SyntheticDataMart holds the rows of every view. rows is the number of rows of each view, or a dictionary of view:
+# number of rows (the views that are not in it get none). stations is the number of rows of the stations view, the
+# other views use the same stations (and a few that aren't in it). dirty is the fraction of rows with something to
+# strip.
+class SyntheticDataMart:
+	def __init__(self, rows, seed=42, stations=2000, poolSize=20000, dirty=0.02):
+		self.rows = rows
+		self.seed = seed
+		self.stations = stations
+		self.poolSize = poolSize
+		self.dirty = dirty
+		self.pools = {}
+		rnd = random.Random(seed)
+		self.stationCodes = ['%03d%s%03d' % (rnd.randint(100, 999), ''.join(rnd.choice('ABCDEFGHJKLMNPRSTUVW')
+		                                                                     for i in range(3)), i)
+		                     for i in range(stations)]
+
+	# count is the number of rows of a view
+	def count(self, view):
+		if view == CEDEN_DataRefresh.WQX_table:
+			return self.stations
+		if isinstance(self.rows, dict):
+			return self.rows.get(view, 0)
+		return self.rows
+
+	# pool returns the rows served for a view, made the first time they are needed
+	def pool(self, view):
+		if view not in self.pools:
+			rnd = random.Random('%s %s' % (self.seed, view))
+			if view == CEDEN_DataRefresh.WQX_table:
+				self.pools[view] = [self.row(rnd, view, station) for station in range(self.stations)]
+			else:
+				self.pools[view] = [self.row(rnd, view) for i in range(min(self.poolSize, self.count(view)))]
+		return self.pools[view]
+
+	# row makes one row of a view. station is the station of a row of the stations view.
+	def row(self, rnd, view, station=None):
+		row = []
+		for column in COLUMNS[view]:
+			row += [self.value(rnd, view, column, station)]
+		if rnd.random() < self.dirty:
+			text = [i for i, value in enumerate(row) if isinstance(value, str)]
+			position = rnd.choice(text)
+			cut = rnd.randint(0, len(row[position]))
+			row[position] = row[position][:cut] + rnd.choice(DIRT) + row[position][cut:]
+		return tuple(row)
+
+	def value(self, rnd, view, column, station):
+		if column in CODES:
+			usual, often, codes = CODES[column]
+			draw = rnd.random()
+			if draw < often:
+				return usual
+			if draw > 0.99:
+				return 'XX%d' % rnd.randint(1, 9)
+			return rnd.choice(list(codes) or [usual])
+		if column == 'StationCode':
+			if station is not None:
+				return self.stationCodes[station]
+			if rnd.random() < 0.03:
+				return rnd.choice(list(StationCode_list))
+			# some of the stations of the results are not in the stations view
+			return rnd.choice(self.stationCodes) if rnd.random() < 0.95 else 'NEW%05d' % rnd.randint(0, 99999)
+		if column == 'StationName':
+			return '%s %s %s' % (rnd.choice(PLACES), rnd.choice(['at', '@', 'near', 'above', 'below']),
+			                     rnd.choice(['Hwy %d' % rnd.randint(1, 299), 'Freeport', 'the Bridge', 'Site B']))
+		if column == 'SampleDate':
+			date = datetime.datetime(rnd.choice(range(1950, 2019)) if rnd.random() < 0.1 else rnd.randint(2000, 2018),
+			                         rnd.randint(1, 12), rnd.randint(1, 28))
+			return date.strftime('%m%d%Y') if view in TEXT_DATES else date
+		if column in ('Program', 'ProgramName', 'ParentProject', 'Project'):
+			return rnd.choice(PROGRAMS)
+		if column in ('Analyte', 'DW_AnalyteName', 'AnalyteName'):
+			return rnd.choice(ANALYTES)
+		if column in ('Result', 'BAResult', 'MDL', 'RL'):
+			draw = rnd.random()
+			return None if draw < 0.05 else -88 if draw < 0.06 else round(rnd.lognormvariate(0, 2), 4)
+		if column == 'TargetLatitude':
+			draw = rnd.random()
+			return None if draw < 0.02 else -88 if draw < 0.03 else round(rnd.uniform(32.5, 42.), 5)
+		if column == 'TargetLongitude':
+			# Sometimes the Longitude is entered as 119 instead of -119
+			longitude = round(rnd.uniform(-124.4, -114.1), 5)
+			return None if rnd.random() < 0.02 else -longitude if rnd.random() < 0.02 else longitude
+		if column in ('RegionalBoardID', 'RegionalBoard'):
+			return rnd.choice(['1', '2', '3', '4', '5', '5', '5', '6', '7', '8', '9', '']) if rnd.random() < 0.99 \
+				else None
+		if column.endswith('Comments') or column == 'LocalWatershed':
+			return ' '.join(rnd.choice(WORDS) for i in range(rnd.randint(0, 12))) if rnd.random() < 0.4 else None
+		if column.endswith('Date'):
+			return datetime.datetime(2018, rnd.randint(1, 12), rnd.randint(1, 28), rnd.randint(0, 23))
+		return '%s-%d' % (rnd.choice(WORDS), rnd.randint(1, 999))
+
+	# connect makes it a backend (see CEDEN_Backend.py), it stands in for SQLServerBackend.connect
+	def connect(self, *args, **kwargs):
+		return SyntheticConnection(self)
+
+	# to_sqlite writes the rows of views (all of them by default) into the SQLite file path, which is replaced. The
+	# dates are written as text, the way the records have them once they are cleaned.
+	def to_sqlite(self, path, views=None):
+		if os.path.exists(path):
+			os.remove(path)
+		cnxn = sqlite3.connect(path)
+		for view in views or COLUMNS:
+			cnxn.execute('CREATE TABLE %s (%s)' % (view, ', '.join('[%s]' % column for column in COLUMNS[view])))
+			pool = [tuple(str(value) if isinstance(value, datetime.datetime) else value for value in row)
+			        for row in self.pool(view)]
+			count = self.count(view)
+			cnxn.executemany('INSERT INTO %s VALUES (%s)' % (view, ', '.join('?' * len(COLUMNS[view]))),
+			                 (pool[i % len(pool)] for i in range(count)))
+			cnxn.commit()
+		cnxn.close()
+		return path
+
+	# install makes DataMart_backend and DataMart_connect of module (CEDEN_DataRefresh) connect to this DataMart, and
+	# sets the connection settings and printable filter "Main" would
+	def install(self, module=CEDEN_DataRefresh):
+		module.DataMart_backend = lambda: self
+		module.SERVER1 = module.UID = module.PWD = 'synthetic'
+		module.printable = printable_for('CEDEN')
+
+
+class SyntheticConnection:
+	def __init__(self, datamart):
+		self.datamart = datamart
+
+	def cursor(self):
+		return SyntheticCursor(self.datamart)
+
+	def close(self):
+		pass
+
+
+PROJECTION = re.compile(r'\[([^\]]*)\](?: AS \[([^\]]*)\])?')
+
+
+# SyntheticCursor serves the rows of a view like an executed pyodbc cursor
+class SyntheticCursor:
+	def __init__(self, datamart):
+		self.datamart = datamart
+		self.description = None
+		self.arraysize = 1
+		self._rows = []
+		self._count = 0
+		self._position = 0
+
+	def execute(self, sql, *params):
+		if sql == 'SELECT 1':
+			# the health check of a ConnectionPool (CEDEN_Backend.py)
+			self.description, self._rows, self._count, self._position = [('',)], [(1,)], 1, 0
+			return self
+		select, view = re.match(r'SELECT (.*) FROM (\S+)', sql).groups()
+		if view not in COLUMNS:
+			raise sqlite3.OperationalError('no such table: %s' % view)
+		if ' GROUP BY ' in sql or (' WHERE ' in sql and not sql.endswith('WHERE 1 = 0')):
+			raise NotImplementedError("The synthetic DataMart doesn't filter or group rows: %s" % sql)
+		columns = COLUMNS[view]
+		self._position = 0
+		if select.startswith('COUNT(*)'):
+			# the number of rows, and for the stations fingerprint a checksum that only changes with the seed
+			self.description = [('',)] * (2 if ',' in select else 1)
+			self._rows = [(self.datamart.count(view), self.datamart.seed)[:len(self.description)]]
+			self._count = 1
+		elif select == '*':
+			self.description = [(column, ) for column in columns]
+			self._rows = []
+			self._count = 0
+		else:
+			names = PROJECTION.findall(select)
+			take = [columns.index(column) for column, alias in names]
+			self.description = [(alias or column, ) for column, alias in names]
+			pool = self.datamart.pool(view)
+			self._rows = pool if take == list(range(len(columns))) else [tuple(row[i] for i in take) for row in pool]
+			self._count = self.datamart.count(view)
+		return self
+
+	def fetchmany(self, size=None):
+		size = min(size or self.arraysize, self._count - self._position)
+		batch = []
+		while size > 0:
+			start = self._position % len(self._rows)
+			chunk = self._rows[start:start + size]
+			batch += chunk
+			self._position += len(chunk)
+			size -= len(chunk)
+		return batch
+
+	def fetchone(self):
+		batch = self.fetchmany(1)
+		return batch[0] if batch else None
+
+	def fetchall(self):
+		return self.fetchmany(self._count - self._position)
+
+	def __iter__(self):
+		while True:
+			batch = self.fetchmany(1000)
+			if not batch:
+				return
+			yield from batch
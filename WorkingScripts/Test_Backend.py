@@ -0,0 +1,55 @@
+'''
+This is a testing script for the backends and the connection pool (CEDEN_Backend.py). It checks that
+	- the SQLite backend runs the YEAR and RIGHT functions of the shard keys, RIGHT is a reserved word in SQLite,
+	- a histogram of the year of the text dates of IR2018_WQ can be made on the SQLite copy of the synthetic DataMart,
+	- the pool hands a connection out again and replaces one that dropped while it waited.
+
+	python WorkingScripts\\Test_Backend.py
+'''
+
+import os, sys, shutil, tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from CEDEN_Backend import SQLiteBackend, ConnectionPool
+from CEDEN_Shards import histogram
+from Synthetic_DataMart import SyntheticDataMart
+
+
+def check(name, condition):
+	print('%-60s %s' % (name, 'ok' if condition else 'FAILED'))
+	return condition
+
+
+if __name__ == "__main__":
+	folder = tempfile.mkdtemp()
+	passed = True
+	database = SyntheticDataMart({'IR2018_WQ': 500}).to_sqlite(os.path.join(folder, 'DataMart.sqlite'), ['IR2018_WQ'])
+	backend = SQLiteBackend(database)
+	cnxn = backend.connect()
+	cursor = cnxn.cursor()
+	cursor.execute("SELECT RIGHT('06012015', 4), right(?, 2), YEAR('2015-06-01 00:00:00')", ['06012015'])
+	passed &= check('RIGHT and YEAR work on SQLite', cursor.fetchall() == [('2015', '15', 2015)])
+	passed &= check('RIGHT works through the connection as well',
+	                cnxn.execute("SELECT RIGHT('06012015', 4)").fetchall() == [('2015', )])
+	counts = histogram(cursor, 'IR2018_WQ', 'CAST(RIGHT(SampleDate, 4) AS INT)')
+	passed &= check('the year histogram of text dates', sum(counts.values()) == 500 and counts.get(2018, 0) > 0
+	                and all(isinstance(year, int) for year in counts if year is not None))
+	cnxn.close()
+	pool = ConnectionPool(backend, size=2)
+	first, cursor = pool.connect()
+	kept = first.cnxn
+	first.close()
+	second, cursor = pool.connect()
+	passed &= check('the pool hands the connection out again', second.cnxn is kept and pool.stats()['reused'] == 1)
+	second.close()
+	# the connection drops while it waits in the pool
+	kept.close()
+	third, cursor = pool.connect()
+	cursor.execute('SELECT COUNT(*) FROM IR2018_WQ')
+	passed &= check('a connection that dropped is replaced', third.cnxn is not kept and cursor.fetchall() == [(500, )]
+	                and pool.stats()['dropped'] == 1)
+	third.close()
+	pool.close()
+	shutil.rmtree(folder)
+	print('\nall checks passed' if passed else '\nsome checks FAILED')
+	sys.exit(0 if passed else 1)
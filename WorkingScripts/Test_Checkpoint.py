@@ -0,0 +1,263 @@
+'''
+This is a testing script for the checkpoints of data_retrieval (CEDEN_Checkpoint.py) and the reconnects of the
+BatchedReader (CEDEN_Reader.py). It builds a SQLite stand in for the DataMart with a few small tables and hands
+data_retrieval a fake pyodbc.connect whose cursors can drop the connection after a given number of rows, like the
+DataMart does when the link fails. It checks that
+	- a connection that drops once in the middle of a table is made again and the table is finished, with the
+	  same files as a run without any drop,
+	- a run that dies in the middle of a table leaves a checkpoint and the next run only extracts the tables that
+	  were left, again with the same files,
+	- DataMart_connect tries again and raises a ConnectionError when the DataMart is down,
+	- with workers and shards (where fork is available), a shard that fails doesn't stop the others and the next
+	  run only extracts that shard.
+
+	python WorkingScripts\\Test_Checkpoint.py
+'''
+
+import os, sys, io, types, random, shutil, sqlite3, tempfile, contextlib, multiprocessing
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+# the errors of the pyodbc stand in, like the ones of pyodbc they take the SQLSTATE as their first argument
+class Error(Exception):
+	pass
+
+
+class OperationalError(Error):
+	pass
+
+
+# the fake connections stand in for pyodbc.connect, which SQLServerBackend (CEDEN_Backend.py) calls. The test only
+# needs pyodbc's connect and error classes, so it runs on a stand in module when the driver isn't installed.
+sys.modules.setdefault('pyodbc', types.ModuleType('pyodbc'))
+import pyodbc
+if not hasattr(pyodbc, 'Error'):
+	pyodbc.Error, pyodbc.OperationalError = Error, OperationalError
+import CEDEN_DataRefresh
+from CEDEN_DataRefresh import data_retrieval
+from CEDEN_Sanitizer import printable_for
+from CEDEN_Subsets import Subset
+from CEDEN_Checkpoint import Checkpoint
+
+TABLES = {'WQX_Stations': 'DM_WQX_Stations_MV', 'WaterChemistryData': 'WQDMart_MV', 'ToxicityData': 'ToxDmart_MV',
+          'BenthicData': 'BenthicDMart_MV', }
+COLUMNS = {'WQDMart_MV': ['StationCode', 'StationName', 'SampleDate', 'Program', 'Analyte', 'DW_AnalyteName',
+                          'Result', 'ResultQualCode', 'QACode', 'BatchVerification', 'MatrixName', 'SampleTypeCode',
+                          'CollectionReplicate', 'ResultsReplicate', 'TargetLatitude', 'TargetLongitude', 'Datum'],
+           'ToxDmart_MV': ['StationCode', 'StationName', 'SampleDate', 'Program', 'Analyte', 'Result',
+                           'ResultQualCode', 'QACode', 'BatchVerificationCode', 'MatrixName', 'SampleTypeCode',
+                           'CollectionReplicate', 'TargetLatitude', 'TargetLongitude'],
+           'BenthicDMart_MV': ['StationCode', 'StationName', 'SampleDate', 'ProgramName', 'ResQualCode',
+                               'SampleType', 'CollectionReplicate', 'TargetLatitude', 'TargetLongitude'], }
+VALUES = {'Analyte': ['E. coli', 'Enterococcus', 'Diazinon', 'pH', 'Surrogate: X'], 'Result': [None, 0.5, 12, -88],
+          'ResultQualCode': ['=', 'ND', 'DNQ', 'NR', None], 'ResQualCode': ['=', 'ND', 'NR'],
+          'QACode': ['None', 'None', 'BX', 'J', 'VQN,J'], 'BatchVerification': ['VAC', 'NR', 'VQI'],
+          'BatchVerificationCode': ['VAC', 'NR'], 'MatrixName': ['samplewater', 'blankwater'],
+          'SampleTypeCode': ['Grab', 'LabBlank'], 'SampleType': ['Grab', 'Integrated'],
+          'CollectionReplicate': [1, 1, 2], 'ResultsReplicate': [1, 2], 'TargetLatitude': [37.5, 38.25, None],
+          'TargetLongitude': [121.5, -122.25, None], 'Datum': ['NAD83', None], }
+ROWS = 3000
+
+# the stand in DataMart. drops is a list of dict(table=, where=, after=, times=): the queries of table (whose WHERE
+# has where in it) drop the connection after rows, times times or always when times is None. down makes every
+# connect fail. Every SELECT of records is written to log.
+database = None
+log = None
+drops = []
+down = False
+connects = 0
+
+
+class FakeCursor:
+	def __init__(self, cnxn):
+		self.cursor = cnxn.cursor()
+		self.dropAfter = None
+		self.read = 0
+
+	@property
+	def description(self):
+		return self.cursor.description
+
+	def execute(self, sql, *params):
+		self.dropAfter = None
+		self.read = 0
+		if sql.startswith('SELECT [') and 'WHERE 1 = 0' not in sql:
+			table = sql.split(' FROM ')[1].split()[0]
+			where = sql.split(' WHERE ', 1)[1] if ' WHERE ' in sql else ''
+			with open(log, 'a') as logOut:
+				logOut.write('%s|%s\n' % (table, where))
+			for drop in drops:
+				if drop['table'] == table and drop.get('where', '') in where and drop['times'] != 0:
+					self.dropAfter = drop['after']
+					if drop['times'] is not None:
+						drop['times'] -= 1
+		self.cursor.execute(sql, *params)
+		return self
+
+	def fetchmany(self, size):
+		if self.dropAfter is not None:
+			if self.read >= self.dropAfter:
+				raise pyodbc.OperationalError('08S01', '[08S01] Communication link failure')
+			size = min(size, self.dropAfter - self.read)
+		batch = self.cursor.fetchmany(size)
+		self.read += len(batch)
+		return batch
+
+	def fetchone(self):
+		return self.cursor.fetchone()
+
+	def fetchall(self):
+		return self.cursor.fetchall()
+
+
+class FakeConnection:
+	def __init__(self):
+		# the reader fetches on its own thread
+		self.cnxn = sqlite3.connect(database, check_same_thread=False)
+		self.cnxn.create_function('YEAR', 1, lambda date: int(date[:4]) if date else None)
+
+	def cursor(self):
+		return FakeCursor(self.cnxn)
+
+	def close(self):
+		self.cnxn.close()
+
+
+def fake_connect(*args, **kwargs):
+	global connects
+	connects += 1
+	if down:
+		raise pyodbc.OperationalError('08001', '[08001] The server was not found or was not accessible')
+	return FakeConnection()
+
+
+def make_DataMart(path):
+	rnd = random.Random(1)
+	cnxn = sqlite3.connect(path)
+	cnxn.execute('CREATE TABLE DM_WQX_Stations_MV (StationCode, StationName, TargetLatitude, TargetLongitude, Datum)')
+	cnxn.executemany('INSERT INTO DM_WQX_Stations_MV VALUES (?, ?, ?, ?, ?)',
+	                 [('ST%03d' % i, 'Station %d' % i, 37 + i / 100, rnd.choice([120.5, -121.25]),
+	                   rnd.choice(['NAD83', 'WGS84', 'NR'])) for i in range(200)])
+	for table, columns in COLUMNS.items():
+		cnxn.execute('CREATE TABLE %s (%s)' % (table, ', '.join(columns)))
+		records = []
+		for i in range(ROWS):
+			record = []
+			for column in columns:
+				if column == 'StationCode':
+					record += ['ST%03d' % rnd.randint(0, 250)]
+				elif column == 'StationName':
+					record += [rnd.choice(['Creek A', 'River, B', 'Bay "D"'])]
+				elif column == 'SampleDate':
+					record += ['%d-%02d-%02d 00:00:00' % (rnd.randint(1990, 2018), rnd.randint(1, 12),
+					                                      rnd.randint(1, 28))]
+				elif column in VALUES:
+					record += [rnd.choice(VALUES[column])]
+				else:
+					record += [rnd.choice(['SWAMP', 'Grab', 'Diazinon'])]
+			records += [record]
+		cnxn.executemany('INSERT INTO %s VALUES (%s)' % (table, ', '.join('?' for column in columns)), records)
+	cnxn.commit()
+	cnxn.close()
+
+
+# run runs data_retrieval in folder, quietly. It returns the error it raised, if any, and the queries it ran.
+def run(folder, **kw):
+	open(log, 'w').close()
+	os.makedirs(folder, exist_ok=True)
+	subsets = [Subset(newFileName='SafeToSwim.csv', table='WaterChemistryData', field_filter='Analyte',
+	                  analytes=['E. coli', 'Enterococcus'], sep=',')]
+	error = None
+	with contextlib.redirect_stdout(io.StringIO()):
+		try:
+			data_retrieval(TABLES, folder, ',', '.csv', False, subsets=subsets, arraysize=250, autoTune=False,
+			               checkpointFile=os.path.join(folder, 'Checkpoint.json'), **kw)
+		except Exception as raised:
+			error = raised
+	with open(log) as logIn:
+		return error, [line.rstrip('\n').split('|') for line in logIn]
+
+
+# same_files is True when two folders have the same files with the same content
+def same_files(folder, other):
+	names = sorted(os.listdir(folder))
+	if names != sorted(os.listdir(other)):
+		return False
+	for name in names:
+		with open(os.path.join(folder, name), 'rb') as fileIn, open(os.path.join(other, name), 'rb') as otherIn:
+			if fileIn.read() != otherIn.read():
+				return False
+	return True
+
+
+def check(name, condition):
+	print('%-70s %s' % (name, 'ok' if condition else 'FAILED'))
+	return condition
+
+
+if __name__ == "__main__":
+	temp = tempfile.mkdtemp()
+	database = os.path.join(temp, 'DataMart.sqlite')
+	log = os.path.join(temp, 'queries.log')
+	make_DataMart(database)
+	pyodbc.connect = fake_connect
+	CEDEN_DataRefresh.printable = printable_for('CEDEN')
+	CEDEN_DataRefresh.SERVER1 = CEDEN_DataRefresh.UID = CEDEN_DataRefresh.PWD = 'fake'
+	CEDEN_DataRefresh.connectTries = 3
+	CEDEN_DataRefresh.connectBackoff = 0.01
+	passed = True
+	reference = os.path.join(temp, 'reference')
+	error, queries = run(reference)
+	passed &= check('a run without drops works', error is None and len(queries) == 4)
+	# the connection drops once, 1000 rows into the water chemistry table
+	drops = [dict(table='WQDMart_MV', after=1000, times=1)]
+	folder = os.path.join(temp, 'reconnect')
+	error, queries = run(folder)
+	passed &= check('a dropped connection is made again', error is None and
+	                [table for table, where in queries].count('WQDMart_MV') == 2)
+	passed &= check('and the files are the same as without the drop', same_files(reference, folder))
+	# the connection drops for good in the middle of the toxicity table
+	drops = [dict(table='ToxDmart_MV', after=700, times=None)]
+	folder = os.path.join(temp, 'resume')
+	error, queries = run(folder)
+	passed &= check('a run that loses the DataMart fails', isinstance(error, pyodbc.Error))
+	checkpoint = Checkpoint(os.path.join(folder, 'Checkpoint.json'), {'sep': ',', 'extension': '.csv',
+	                                                                  'For_IR': False, 'shardKey': None})
+	passed &= check('the checkpoint has the tables that were finished', sorted(checkpoint.tables) ==
+	                ['WQX_Stations', 'WaterChemistryData'])
+	drops = []
+	error, queries = run(folder)
+	passed &= check('the next run only extracts the tables that were left', error is None and
+	                [table for table, where in queries] == ['ToxDmart_MV', 'BenthicDMart_MV'])
+	passed &= check('and the files are the same as a run in one go', same_files(reference, folder))
+	# the DataMart is down
+	down = True
+	connects = 0
+	error, queries = run(os.path.join(temp, 'down'))
+	passed &= check('DataMart_connect tries %d times and raises a ConnectionError' % CEDEN_DataRefresh.connectTries,
+	                isinstance(error, ConnectionError) and connects == CEDEN_DataRefresh.connectTries)
+	down = False
+	# the workers need the fake DataMart, which they only get when they are forked from this process
+	if 'fork' in multiprocessing.get_all_start_methods():
+		multiprocessing.set_start_method('fork', force=True)
+		sharded = dict(workers=2, shards={'WaterChemistryData': 3})
+		reference = os.path.join(temp, 'reference_shards')
+		error, queries = run(reference, **sharded)
+		# the first shard (the oldest years) fails for good, the other shards and tables go on
+		drops = [dict(table='WQDMart_MV', where='IS NULL', after=300, times=None)]
+		folder = os.path.join(temp, 'resume_shards')
+		error, queries = run(folder, **sharded)
+		checkpoint = Checkpoint(os.path.join(folder, 'Checkpoint.json'), checkpoint.settings)
+		passed &= check('a failed shard leaves the other shards and tables in the checkpoint', error is not None and
+		                sorted(checkpoint.tables) == ['BenthicData', 'ToxicityData', 'WQX_Stations'] and
+		                sorted(checkpoint.jobs['WaterChemistryData']) == ['1', '2'])
+		drops = []
+		error, queries = run(folder, **sharded)
+		passed &= check('the next run only extracts the failed shard', error is None and len(queries) == 1 and
+		                queries[0][0] == 'WQDMart_MV' and 'IS NULL' in queries[0][1])
+		passed &= check('and the files are the same as a run in one go', same_files(reference, folder))
+	else:
+		print('fork is not available, the sharded run was not checked')
+	shutil.rmtree(temp)
+	print('\nall checks passed' if passed else '\nsome checks FAILED')
+	sys.exit(0 if passed else 1)
@@ -0,0 +1,77 @@
+'''
+This is a testing script for the output files of CEDEN_Compression.py when something goes wrong while they are
+written. With keep_unchanged in effect a file is written next to the last one (.partial) and replaces it when it is
+closed. It checks, for plain text, binary, gzip and pooled (CEDEN_Partitions.py) files, that
+	- a with block that fails leaves the last file as it was, removes the .partial file and keeps no hash,
+	- a file that is never closed doesn't replace the last one either,
+	- a file that is closed normally still replaces the last one.
+
+	python WorkingScripts\\Test_Compression.py
+'''
+
+import os, sys, gc, shutil, tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from CEDEN_Compression import open_output, open_input, PooledOutput
+from CEDEN_Digests import keep_unchanged, digest_of, take_digests
+from CEDEN_Partitions import HandlePool
+
+
+def check(name, condition):
+	print('%-60s %s' % (name, 'ok' if condition else 'FAILED'))
+	return condition
+
+
+def read(path):
+	with open_input(path) as fileIn:
+		return fileIn.read()
+
+
+# publish writes the last run's file and marks it as kept, like data_retrieval does with the manifest
+def publish(path, binary):
+	with open_output(path, binary=binary) as fileOut:
+		fileOut.write(b'old\n' if binary else 'old\n')
+	keep_unchanged({path: 'the hash of the last run'})
+	take_digests()
+
+
+# the ways of opening an output file: (name, extension, binary, function that opens it)
+OUTPUTS = [('text', '.csv', False, lambda path: open_output(path)),
+           ('binary', '.csv', True, lambda path: open_output(path, binary=True)),
+           ('gzip', '.csv.gz', False, lambda path: open_output(path)),
+           ('gzip binary', '.csv.gz', True, lambda path: open_output(path, binary=True)),
+           ('pooled', '.csv', False, lambda path: PooledOutput(path, HandlePool(), bufferSize=4)), ]
+
+
+if __name__ == "__main__":
+	folder = tempfile.mkdtemp()
+	passed = True
+	for name, extension, binary, opener in OUTPUTS:
+		path = os.path.join(folder, name.replace(' ', '_') + extension)
+		publish(path, binary)
+		new = b'new\n' if binary else 'new\n'
+		try:
+			with opener(path) as fileOut:
+				fileOut.write(new * 1000)
+				raise RuntimeError('the DataMart went away')
+		except RuntimeError:
+			pass
+		passed &= check('%s: a failed with block leaves the last file' % name,
+		                read(path) == 'old\n' and not os.path.exists(path + '.partial') and digest_of(path) is None)
+		fileOut = opener(path)
+		fileOut.write(new * 1000)
+		if extension == '.csv' and not isinstance(fileOut, PooledOutput):
+			# a plain file that is dropped without being closed
+			del fileOut
+			gc.collect()
+			passed &= check('%s: a file never closed leaves the last file' % name,
+			                read(path) == 'old\n' and not os.path.exists(path + '.partial'))
+		else:
+			fileOut.abort()
+		with opener(path) as fileOut:
+			fileOut.write(new)
+		passed &= check('%s: a closed file replaces the last one' % name,
+		                read(path) == 'new\n' and not os.path.exists(path + '.partial') and digest_of(path) is not None)
+	keep_unchanged({})
+	shutil.rmtree(folder)
+	print('\nall checks passed' if passed else '\nsome checks FAILED')
+	sys.exit(0 if passed else 1)
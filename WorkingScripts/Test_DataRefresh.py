@@ -0,0 +1,70 @@
+'''
+This is a smoke test of CEDEN_DataRefresh.py run as a script, with the settings of its __main__ block as they are.
+The DataMart is a SQLite copy of the synthetic DataMart (Synthetic_DataMart.py), handed out by a stand in pyodbc
+module whose connect opens it, and the files are written in a temporary folder (CEDEN_SaveLocation). It checks that
+	- the script runs to the end, from the extraction to the run profile,
+	- every table was written, with its By_RB partitions,
+	- the run left its manifest and profile, and removed its checkpoint.
+
+	python WorkingScripts\\Test_DataRefresh.py
+'''
+
+import os, sys, shutil, tempfile, subprocess
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from Synthetic_DataMart import SyntheticDataMart, IR
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# the pyodbc of the script, in the script and in its worker processes
+PYODBC = """import os
+from CEDEN_Backend import SQLiteBackend
+
+
+class Error(Exception):
+	pass
+
+
+class OperationalError(Error):
+	pass
+
+
+def connect(**kwargs):
+	return SQLiteBackend(os.environ['CEDEN_TestDataMart']).connect()
+"""
+
+
+def check(name, condition):
+	print('%-60s %s' % (name, 'ok' if condition else 'FAILED'))
+	return condition
+
+
+if __name__ == "__main__":
+	folder = tempfile.mkdtemp()
+	passed = True
+	database = SyntheticDataMart({view: 500 for view in IR.values()}, stations=100).to_sqlite(
+		os.path.join(folder, 'DataMart.sqlite'), list(IR.values()))
+	modules = os.path.join(folder, 'modules')
+	os.makedirs(modules)
+	with open(os.path.join(modules, 'pyodbc.py'), 'w', encoding='utf8') as moduleOut:
+		moduleOut.write(PYODBC)
+	saveLocation = os.path.join(folder, 'CEDEN_Datasets')
+	os.makedirs(saveLocation)
+	environment = dict(os.environ, CEDEN_SaveLocation=saveLocation, CEDEN_TestDataMart=database,
+	                   PYTHONPATH=os.pathsep.join([modules, ROOT]))
+	run = subprocess.run([sys.executable, os.path.join(ROOT, 'CEDEN_DataRefresh.py')], env=environment,
+	                     stdout=subprocess.PIPE, stderr=subprocess.STDOUT, universal_newlines=True)
+	if run.returncode:
+		print(run.stdout[-3000:])
+	passed &= check('the script runs to the end', run.returncode == 0)
+	passed &= check('every table was written',
+	                all(os.path.isfile(os.path.join(saveLocation, filename + '.txt')) for filename in IR))
+	passed &= check('the tables were split by Regional Board',
+	                os.path.isfile(os.path.join(saveLocation, 'By_RB', 'IR_WaterChemistryData_RB_5.txt')))
+	passed &= check('the manifest and profile were saved',
+	                os.path.isfile(os.path.join(saveLocation, 'CEDEN_Manifest.json')) and
+	                len(os.listdir(os.path.join(saveLocation, 'Profiles'))) > 0)
+	passed &= check('the checkpoint was removed',
+	                not os.path.exists(os.path.join(saveLocation, 'DataMart_Checkpoint.json')))
+	shutil.rmtree(folder)
+	print('\nall checks passed' if passed else '\nsome checks FAILED')
+	sys.exit(0 if passed else 1)
@@ -0,0 +1,115 @@
+'''
+This is a testing script for the incremental refresh of data_retrieval (CEDEN_Incremental.py). It extracts two IR
+tables from a SQLite copy of the synthetic DataMart (Synthetic_DataMart.py): IR2018_WQ, which has its SampleDate as
+monthdayyear text, and IR2018_Benthic, which has a datetime SampleDate. It checks that
+	- a second run with nothing changed extracts nothing and returns the same sites,
+	- once records of a few years are changed and deleted, the incremental run writes the same files as a full
+	  extraction, and the same sites for every station whose first record is still there.
+
+	python WorkingScripts\\Test_Incremental.py
+'''
+
+import os, sys, json, shutil, sqlite3, tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import CEDEN_DataRefresh
+from CEDEN_DataRefresh import data_retrieval
+from CEDEN_Backend import SQLiteBackend
+from CEDEN_Subsets import RegionPartitioner
+from CEDEN_Compression import open_input
+from Synthetic_DataMart import SyntheticDataMart
+
+TABLES = {'WQX_Stations': 'DM_WQX_Stations_MV', 'IR_WaterChemistryData': 'IR2018_WQ',
+          'IR_BenthicData': 'IR2018_Benthic', }
+# SQLite has no CHECKSUM_AGG, the sum of the results stands in for it
+INCREMENTAL = {'IR_WaterChemistryData': 'TOTAL(Result)', 'IR_BenthicData': 'TOTAL(BAResult)', }
+# the year of a record in SQLite, for the text dates of IR2018_WQ and the datetimes of IR2018_Benthic
+YEAR = {'IR2018_WQ': 'substr(SampleDate, -4)', 'IR2018_Benthic': 'substr(SampleDate, 1, 4)', }
+
+
+def check(name, condition):
+	print('%-60s %s' % (name, 'ok' if condition else 'FAILED'))
+	return condition
+
+
+def extract(database, folder, **options):
+	os.makedirs(folder, exist_ok=True)
+	subsets = [RegionPartitioner('IR_BenthicData', 'RegionalBoardID', '\t', '.txt')]
+	return data_retrieval(TABLES, folder, '\t', '.txt', True, subsets=subsets, backend=SQLiteBackend(database),
+	                      **options)
+
+
+# output_files returns the header and the sorted records of every output file in folder, by path inside folder
+def output_files(folder):
+	files = {}
+	for root, folders, names in os.walk(folder):
+		for name in names:
+			if name.endswith('.json'):
+				continue
+			with open_input(os.path.join(root, name)) as fileIn:
+				lines = fileIn.read().split('\n')
+			files[os.path.relpath(os.path.join(root, name), folder)] = (lines[0], sorted(lines[1:]))
+	return files
+
+
+# first_records returns the rowid of the first record of every station of the views
+def first_records(database):
+	cnxn = sqlite3.connect(database)
+	first = {}
+	for view in YEAR:
+		for StationCode, rowid in cnxn.execute('SELECT StationCode, MIN(rowid) FROM %s GROUP BY StationCode' % view):
+			first[(view, StationCode)] = rowid
+	cnxn.close()
+	return first
+
+
+if __name__ == "__main__":
+	folder = tempfile.mkdtemp()
+	passed = True
+	database = SyntheticDataMart({'IR2018_WQ': 4000, 'IR2018_Benthic': 4000}, stations=300).to_sqlite(
+		os.path.join(folder, 'DataMart.sqlite'), list(TABLES.values()))
+	CEDEN_DataRefresh.printable = CEDEN_DataRefresh.printable_for('CEDEN')
+	incremental = os.path.join(folder, 'Incremental_run')
+	options = dict(incremental=INCREMENTAL, stateFile=os.path.join(incremental, 'State.json'))
+	FILES, firstSites = extract(database, incremental, **options)
+	before = output_files(incremental)
+	FILES, AllSites = extract(database, incremental, **options)
+	with open(options['stateFile'], encoding='utf8') as stateIn:
+		state = json.load(stateIn)
+	lastFull = {view: state[view]['full'] for view in YEAR}
+	passed &= check('nothing changed: the same files and sites',
+	                output_files(incremental) == before and AllSites == firstSites)
+	passed &= check('the sites and counts are kept in the state file',
+	                all('sites' in state[view] and state[view]['records'] > 0 for view in YEAR))
+
+	# change the results of a year of each view and delete a third of the records of another
+	first = first_records(database)
+	cnxn = sqlite3.connect(database)
+	for view, (changed, deleted) in {'IR2018_WQ': ('2015', '2010'), 'IR2018_Benthic': ('2016', '2004')}.items():
+		column = 'BAResult' if view == 'IR2018_Benthic' else 'Result'
+		cnxn.execute('UPDATE %s SET %s = COALESCE(%s, 0) + 1 WHERE %s = ?' % (view, column, column, YEAR[view]),
+		             [changed])
+		cnxn.execute('DELETE FROM %s WHERE %s = ? AND rowid %% 3 = 0' % (view, YEAR[view]), [deleted])
+	cnxn.commit()
+	cnxn.close()
+	after = first_records(database)
+	moved = {StationCode for (view, StationCode), rowid in first.items() if after.get((view, StationCode)) != rowid}
+
+	FILES, AllSites = extract(database, incremental, **options)
+	full = os.path.join(folder, 'Full_run')
+	fullFILES, fullSites = extract(database, full)
+	with open(options['stateFile'], encoding='utf8') as stateIn:
+		state = json.load(stateIn)
+	passed &= check('the tables were not extracted in full', {view: state[view]['full'] for view in YEAR} == lastFull)
+	incrementalFiles, fullFiles = output_files(incremental), output_files(full)
+	passed &= check('the same files as a full extraction', sorted(incrementalFiles) == sorted(fullFiles))
+	for path in sorted(fullFiles):
+		if incrementalFiles.get(path) != fullFiles[path]:
+			passed &= check('%s has the records of a full extraction' % path, False)
+	passed &= check('the same stations as a full extraction', sorted(AllSites) == sorted(fullSites))
+	passed &= check('the same sites as a full extraction',
+	                all(AllSites[StationCode] == fullSites[StationCode] for StationCode in fullSites
+	                    if StationCode not in moved))
+	shutil.rmtree(folder)
+	print('\nall checks passed' if passed else '\nsome checks FAILED')
+	sys.exit(0 if passed else 1)
@@ -0,0 +1,121 @@
+'''
+This is a testing script for the partition writer (CEDEN_Partitions.py) and the Partitioner subsets
+(CEDEN_Subsets.py). It checks that
+	- a partition only gets a file once a record goes in it,
+	- hundreds of partitions can be written with a handful of open files, plain and compressed, and every file has
+	  the records of its partition in order,
+	- the files are hashed like any other output file (see CEDEN_Digests.py),
+	- a Partitioner splits by a bucket of a column, the RegionPartitioner still writes every region and the partition
+	  files are left out of the published files.
+
+	python WorkingScripts\\Test_Partitions.py
+'''
+
+import os, sys, csv, random, shutil, tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from CEDEN_Partitions import PartitionWriter, HandlePool
+from CEDEN_Compression import open_input
+from CEDEN_Digests import digest_of
+from CEDEN_Manifest import content_digest
+from CEDEN_Subsets import Partitioner, RegionPartitioner, published
+
+COLUMNS = ['StationCode', 'Analyte', 'SampleDate', 'RegionalBoardID', 'Result']
+
+
+def check(name, condition):
+	print('%-60s %s' % (name, 'ok' if condition else 'FAILED'))
+	return condition
+
+
+def read(path):
+	with open_input(path) as fileIn:
+		return list(csv.reader(fileIn, delimiter=','))
+
+
+def make_records(count, analytes):
+	rnd = random.Random(7)
+	return [['%03dXYZ' % rnd.randint(0, 99), 'Analyte %d' % rnd.randint(0, analytes - 1),
+	         '%d-%02d-01 00:00:00' % (rnd.randint(1985, 2019), rnd.randint(1, 12)), str(rnd.randint(1, 9)),
+	         '%.3f' % rnd.random()] for i in range(count)]
+
+
+# CountingPool keeps the most files that were open at once
+class CountingPool(HandlePool):
+	most = 0
+
+	def handle(self, output):
+		fileOut = super().handle(output)
+		self.most = max(self.most, len(self.files))
+		return fileOut
+
+
+# decade is the bucket of the Partitioner check, it has to be a function of a module for the worker processes
+def decade(SampleDate):
+	return SampleDate[:3] + '0s'
+
+
+if __name__ == "__main__":
+	folder = tempfile.mkdtemp()
+	passed = True
+	records = make_records(20000, 300)
+	# the 300 analytes in 300 files with 8 open at most, plain and gzip
+	for extension in ('.csv', '.csv.gz'):
+		handles = CountingPool(maxOpen=8)
+		with PartitionWriter(COLUMNS, lambda record: record[1] if record[1] != 'Analyte 7' else None,
+		                     lambda analyte: os.path.join(folder, analyte + extension), ',', handles=handles,
+		                     bufferSize=1024) as partitions:
+			for record in records:
+				partitions.write(record)
+			rows = dict(partitions.rows)
+		expected = {}
+		for record in records:
+			if record[1] != 'Analyte 7':
+				expected.setdefault(record[1], []).append(record)
+		files = [name for name in os.listdir(folder) if name.endswith(extension) and
+		         (extension == '.csv.gz' or not name.endswith('.gz'))]
+		passed &= check('%s: a file for each of the %d partitions' % (extension, len(expected)),
+		                len(files) == len(expected) and 'Analyte 7' + extension not in files)
+		passed &= check('%s: never more than 8 files open' % extension, handles.most == 8 and
+		                handles.opened > len(expected) and not handles.files)
+		passed &= check('%s: every file has its records in order' % extension,
+		                all(read(os.path.join(folder, analyte + extension)) == [COLUMNS] + partition
+		                    for analyte, partition in expected.items()))
+		passed &= check('%s: the rows of each partition are counted' % extension,
+		                rows == {analyte: len(partition) for analyte, partition in expected.items()})
+		path = os.path.join(folder, 'Analyte 1' + extension)
+		passed &= check('%s: the files are hashed as they are written' % extension,
+		                digest_of(path) == content_digest(path))
+	# a Partitioner by decade, only the decades with records get a file
+	subset = Partitioner(table='WaterChemistryData', field_filter='SampleDate', sep=',', extension='.csv',
+	                     name='Decade', bucket=decade)
+	subset.open(folder, COLUMNS)
+	for record in records:
+		subset.route(record)
+	written = subset.close()
+	passed &= check('the Partitioner writes a file per decade',
+	                sorted(written) == ['WaterChemistryData_Decade_%d0s' % decade for decade in (198, 199, 200, 201)]
+	                and all(os.path.isfile(path) for path in written.values()))
+	passed &= check('the Partitioner goes in By_Decade',
+	                os.path.dirname(written['WaterChemistryData_Decade_1980s']) == os.path.join(folder, 'By_Decade'))
+	passed &= check('every record went in a decade', subset.rows == len(records) and
+	                sum(len(read(path)) - 1 for path in written.values()) == len(records))
+	# the RegionPartitioner writes every region, even without records
+	regions = RegionPartitioner(table='IR_WaterChemistryData', field_filter='RegionalBoardID', sep=',',
+	                            extension='.csv')
+	regions.open(folder, COLUMNS)
+	for record in records[:5]:
+		regions.route(record)
+	regions.route(['', '', '', '', ''])
+	written = regions.close()
+	passed &= check('the RegionPartitioner writes the 9 regions',
+	                sorted(written) == ['IR_WaterChemistryData_RB_%d' % region for region in range(1, 10)] and
+	                all(os.path.isfile(path) for path in written.values()))
+	passed &= check('records without a region are skipped', regions.rows == 5)
+	# the partitions are not published, the dataset and the subsets are
+	tableFiles = dict(written, IR_WaterChemistryData='IR_WaterChemistryData.csv', SafeToSwim='SafeToSwim.csv')
+	passed &= check('the partitions are left out of the published files',
+	                published(tableFiles, [regions, subset]) == {'IR_WaterChemistryData': 'IR_WaterChemistryData.csv',
+	                                                             'SafeToSwim': 'SafeToSwim.csv'})
+	shutil.rmtree(folder)
+	print('\nall checks passed' if passed else '\nsome checks FAILED')
+	sys.exit(0 if passed else 1)
@@ -0,0 +1,86 @@
+'''
+This is a testing script for the publish queue (CEDEN_Publish.py), with the stand-in for the DKAN attach_file
+endpoint of Test_Uploads.py. It checks that
+	- files pushed on the queue are uploaded while the next ones are still being made,
+	- a run that is killed in the middle of its uploads leaves them in the queue file,
+	- the next run resumes only those, and empties the queue file.
+
+	python WorkingScripts\\Test_Publish.py
+'''
+
+import os, sys, json, time, shutil, tempfile, threading, multiprocessing
+from http.server import ThreadingHTTPServer
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from CEDEN_Upload import UploadScheduler, StreamingClient
+from CEDEN_Publish import PublishQueue
+from Test_Uploads import FakeDKAN, Handler, check
+
+NODES = {'Dataset_%d' % node: node for node in range(1, 7)}
+
+
+# the killed run drops its connections, the server doesn't need to print that
+class QuietServer(ThreadingHTTPServer):
+	def handle_error(self, request, client_address):
+		pass
+
+
+def make_file(folder, name):
+	path = os.path.join(folder, name + '.csv')
+	with open(path, 'wb') as fileOut:
+		fileOut.write(os.urandom(200000))
+	return path
+
+
+# run is one run of the pipeline: a file is made every pause seconds and pushed on the queue. It returns when the
+# queue is closed, when it isn't killed before.
+def run(URI, folder, names, pause):
+	scheduler = UploadScheduler(lambda: StreamingClient(URI, 'u', 'p'), workers=2, retries=1, backoff=0.05)
+	publish = PublishQueue(os.path.join(folder, 'PublishQueue.json'), NODES, scheduler)
+	resumed = publish.resume()
+	pushed = {}
+	for name in names:
+		time.sleep(pause)
+		publish.push(name, make_file(folder, name))
+		pushed[name] = time.perf_counter()
+	return resumed, pushed, publish.close()
+
+
+if __name__ == "__main__":
+	dkan = FakeDKAN(latency=0.3)
+	server = QuietServer(('127.0.0.1', 0), Handler)
+	server.dkan = dkan
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	URI = 'http://127.0.0.1:%d/' % server.server_address[1]
+	folder = tempfile.mkdtemp()
+	passed = True
+	# a pipeline that makes a file every 0.5 sec, the uploads take 0.3 sec
+	start = time.perf_counter()
+	resumed, pushed, reports = run(URI, folder, ['Dataset_1', 'Dataset_2', 'Dataset_3'], 0.5)
+	passed &= check('every file was uploaded', sorted(dkan.received) == [1, 2, 3])
+	# one after the other it would take 3 * 0.5 + 3 * 0.3 sec, pipelined only the last upload comes after the files
+	passed &= check('uploads ran while the files were made', time.perf_counter() - start < 0.5 * 3 + 0.3 + 0.25)
+	passed &= check('the queue file is empty', json.load(open(os.path.join(folder, 'PublishQueue.json')))['uploads']
+	                == {})
+	# a run killed while its uploads are going on, they take 2 sec each
+	dkan.latency = 2.
+	dkan.received = {}
+	crashed = multiprocessing.Process(target=run, args=(URI, folder, ['Dataset_4', 'Dataset_5', 'Dataset_6'], 0.))
+	crashed.start()
+	time.sleep(1.)
+	crashed.terminate()
+	crashed.join()
+	left = json.load(open(os.path.join(folder, 'PublishQueue.json')))['uploads']
+	passed &= check('the killed run left its uploads in the queue file', sorted(left.values()) == [4, 5, 6])
+	# the next run resumes them, and nothing else
+	dkan.latency = 0.1
+	time.sleep(2.5)
+	dkan.received = {}
+	resumed, pushed, reports = run(URI, folder, [], 0.)
+	passed &= check('the next run resumed the 3 uploads', resumed == 3 and sorted(dkan.received) == [4, 5, 6])
+	passed &= check('the queue file is empty again',
+	                json.load(open(os.path.join(folder, 'PublishQueue.json')))['uploads'] == {})
+	server.shutdown()
+	shutil.rmtree(folder)
+	print('\nall checks passed' if passed else '\nsome checks FAILED')
+	sys.exit(0 if passed else 1)
@@ -0,0 +1,148 @@
+'''
+This is a testing script for the TableQuery declarations in CEDEN_Query.py. It builds a small SQLite stand in for a
+couple of DataMart views in memory and checks that the column list, the aliases and the server side filters do what
+data_retrieval expects from them. SQLite understands the [bracket] names and ? parameters used by the queries. It
+also extracts the water chemistry table of a SQLite copy of the synthetic DataMart (Synthetic_DataMart.py) only for
+its SafeToSwim subset, and checks the subset is the same as in a full extraction.
+
+	python WorkingScripts\\Test_QueryBuilder.py
+'''
+
+import os, sys, csv, shutil, sqlite3, tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import CEDEN_DataRefresh
+from CEDEN_DataRefresh import data_retrieval, default_query
+from CEDEN_Backend import SQLiteBackend
+from CEDEN_Query import TableQuery, RENAME_TARGET, COMPUTED_COLUMNS, in_clause, range_clause, and_clauses
+from CEDEN_Subsets import Subset, RegionPartitioner, subset_query
+from Synthetic_DataMart import SyntheticDataMart
+
+TABLES = {'WQX_Stations': 'DM_WQX_Stations_MV', 'WaterChemistryData': 'WQDMart_MV', }
+
+
+def make_DataMart():
+	cnxn = sqlite3.connect(':memory:')
+	cursor = cnxn.cursor()
+	cursor.execute("CREATE TABLE WQDMart_MV (StationCode TEXT, StationName TEXT, SampleDate TEXT, Analyte TEXT, "
+	               "Result REAL, TargetLatitude REAL, TargetLongitude REAL, RegionalBoardID TEXT, [Internal Notes] TEXT)")
+	records = [('204ALP100', 'Alpine Creek', '1998-06-01', 'E. coli', 12.0, 37.5, -122.1, '2', 'x'),
+	           ('204ALP100', 'Alpine Creek', '2005-06-01', 'Diazinon', 0.5, 37.5, -122.1, '2', 'y'),
+	           ('801ORDC01', 'Orange Drain', '2012-01-15', 'E. coli', 240.0, 33.7, -117.8, '8', None),
+	           ('514FC1166', 'Feather River', '2016-09-30', 'Enterococcus', 3.0, 39.1, -121.6, '5', 'z'),
+	           ('514FC1166', 'Feather River', '2017-03-02', 'pH', 7.2, 39.1, -121.6, '5', None), ]
+	cursor.executemany("INSERT INTO WQDMart_MV VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", records)
+	cnxn.commit()
+	return cnxn, cursor
+
+
+def check(name, condition):
+	print('%-60s %s' % (name, 'ok' if condition else 'FAILED'))
+	return condition
+
+
+# CountingCursor counts the statements run on a cursor
+class CountingCursor:
+	def __init__(self, cursor):
+		self.cursor = cursor
+		self.statements = 0
+
+	def execute(self, *args):
+		self.statements += 1
+		return self.cursor.execute(*args)
+
+	@property
+	def description(self):
+		return self.cursor.description
+
+
+def read(path):
+	with open(path, encoding='utf8', newline='') as fileIn:
+		return list(csv.reader(fileIn, delimiter=','))
+
+
+if __name__ == "__main__":
+	cnxn, cursor = make_DataMart()
+	passed = True
+	# every column, TargetLatitude/Longitude published as Latitude/Longitude
+	query = TableQuery('WQDMart_MV', rename=RENAME_TARGET)
+	columns = query.execute(cursor)
+	passed &= check('default query renames TargetL to L', 'Latitude' in columns and 'TargetLatitude' not in columns)
+	passed &= check('default query returns every record', len(cursor.fetchall()) == 5)
+	# leave a column out and rename another one
+	query = TableQuery('WQDMart_MV', exclude=['Internal Notes'], aliases={'RegionalBoardID': 'RegionalBoard'},
+	                   rename=RENAME_TARGET)
+	columns = query.execute(cursor)
+	passed &= check('excluded column is not selected', 'Internal Notes' not in columns and len(columns) == 8)
+	passed &= check('alias renames a whole column', 'RegionalBoard' in columns and 'RegionalBoardID' not in columns)
+	passed &= check('records only carry the selected columns', all(len(row) == 8 for row in cursor.fetchall()))
+	# filters applied by the server
+	query = TableQuery('WQDMart_MV', rename=RENAME_TARGET, where=in_clause('Analyte', ['E. coli', 'Enterococcus'])[0],
+	                   params=in_clause('Analyte', ['E. coli', 'Enterococcus'])[1])
+	query.execute(cursor)
+	passed &= check('analyte filter is applied by the server', len(cursor.fetchall()) == 3)
+	query.execute(cursor, *range_clause('SampleDate', '2010-01-01'))
+	passed &= check('extra filter is added to the declared one', len(cursor.fetchall()) == 2)
+	query.execute(cursor, "RegionalBoardID = '8'")
+	passed &= check('plain SQL filter (shards, incremental years)', len(cursor.fetchall()) == 1)
+	clause, params = and_clauses(range_clause('SampleDate', '2000-01-01', '2010-01-01'), in_clause('Analyte', []))
+	cursor.execute('SELECT COUNT(*) FROM WQDMart_MV WHERE %s' % clause, params)
+	passed &= check('an empty IN list matches nothing', cursor.fetchone()[0] == 0)
+	# a subset pushed down to the server gives the same records as filtering in python
+	subset = Subset('SafeToSwim.csv', 'WaterChemistryData', 'Analyte', ['E. coli', 'Enterococcus'], ',')
+	TableQuery('WQDMart_MV', where=subset.where()[0], params=subset.where()[1]).execute(cursor)
+	pushed = sorted(cursor.fetchall())
+	columns = TableQuery('WQDMart_MV').execute(cursor)
+	filtered = sorted(row for row in cursor.fetchall() if row[columns.index('Analyte')] in subset.analytes)
+	passed &= check('subset pushed down matches the python filter', pushed == filtered)
+	# two subsets of a table, the server sends the records of either of them
+	pesticides = Subset('Pesticides.csv', 'WaterChemistryData', 'Analyte', ['Diazinon'], ',')
+	subset_query(TableQuery('WQDMart_MV'), [subset, pesticides]).execute(cursor)
+	passed &= check('a table limited to its subsets', len(cursor.fetchall()) == 4)
+	try:
+		subset_query(TableQuery('WQDMart_MV'), [subset, RegionPartitioner('WaterChemistryData', 'RegionalBoardID',
+		                                                                  ',', '.csv')])
+		passed &= check('a Partitioner needs the whole table', False)
+	except ValueError:
+		passed &= check('a Partitioner needs the whole table', True)
+	# the data quality columns are added by data_retrieval, a copy from the DataMart is left out
+	sql, params = default_query('WQDMart_MV', False).select(['StationCode', 'Result', 'DataQuality',
+	                                                         'DataQualityIndicator', 'TargetLatitude'])
+	passed &= check('the data quality columns are not selected',
+	                sql == 'SELECT [StationCode], [Result], [TargetLatitude] AS [Latitude] FROM WQDMart_MV' and
+	                all(column in default_query('WQDMart_MV', True).exclude for column in COMPUTED_COLUMNS))
+	# the column names are only asked for once
+	counting = CountingCursor(cursor)
+	query = TableQuery('WQDMart_MV', rename=RENAME_TARGET)
+	for where in ("RegionalBoardID = '2'", "RegionalBoardID = '5'", None):
+		query.execute(counting, where)
+		counting.cursor.fetchall()
+	passed &= check('the column names are asked for once', counting.statements == 4)
+	cnxn.close()
+
+	# SafeToSwim from a water chemistry table that is only extracted for it
+	folder = tempfile.mkdtemp()
+	database = SyntheticDataMart({'WQDMart_MV': 3000}, stations=200).to_sqlite(os.path.join(folder, 'DataMart.sqlite'),
+	                                                                           list(TABLES.values()))
+	CEDEN_DataRefresh.printable = CEDEN_DataRefresh.printable_for('CEDEN')
+	runs = {}
+	for name, subsetOnly in (('Full', []), ('SubsetOnly', ['WaterChemistryData'])):
+		os.makedirs(os.path.join(folder, name))
+		subsets = [Subset('SafeToSwim.csv', 'WaterChemistryData', 'Analyte', ['E. coli', 'Enterococcus'], ',')]
+		runs[name] = data_retrieval(TABLES, os.path.join(folder, name), ',', '.csv', False, subsets=subsets,
+		                            backend=SQLiteBackend(database), subsetOnly=subsetOnly)
+	FILES, subsetFILES, subsetSites = runs['Full'][0], runs['SubsetOnly'][0], runs['SubsetOnly'][1]
+	passed &= check('only the subset files of the table are published',
+	                sorted(subsetFILES) == ['SafeToSwim.csv', 'Sites_for_SafeToSwim.csv', 'WQX_Stations'])
+	passed &= check('the subset has the records of a full extraction',
+	                all(read(FILES[name]) == read(subsetFILES[name]) for name in subsetFILES))
+	passed &= check('the DataMart only sent the subset records',
+	                len(read(os.path.join(folder, 'SubsetOnly', 'WaterChemistryData.csv'))) ==
+	                len(read(FILES['SafeToSwim.csv'])) < len(read(FILES['WaterChemistryData'])))
+	# a station gets the site of its first SafeToSwim record, like in the Sites_for_ file
+	passed &= check('the sites of the subset records',
+	                {StationCode: [str(value) for value in site] for StationCode, site in subsetSites.items()} ==
+	                {row[1]: [row[0]] + row[2:] for row in read(FILES['Sites_for_SafeToSwim.csv'])[1:]})
+	shutil.rmtree(folder)
+	print('\nall checks passed' if passed else '\nsome checks FAILED')
+	sys.exit(0 if passed else 1)
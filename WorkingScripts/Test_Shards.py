@@ -0,0 +1,101 @@
+'''
+This is a testing script for the shards of data_retrieval (CEDEN_Shards.py). It extracts the water chemistry table
+of a SQLite copy of the synthetic DataMart (Synthetic_DataMart.py) in one go and in three shards, and checks that
+	- the sharded run writes the same records, in the order of the shards,
+	- it finds the same stations, and a station whose records are all in one shard gets the same site,
+	- a station with records in more than one shard gets the site of its first record in the stitched file, which
+	  can be another record than the first one the DataMart returned in one go. This is the difference between a
+	  sharded and an unsharded run, the number of stations it touches is printed.
+
+	python WorkingScripts\\Test_Shards.py
+'''
+
+import os, sys, csv, shutil, bisect, tempfile
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+import CEDEN_DataRefresh
+from CEDEN_DataRefresh import data_retrieval
+from CEDEN_Backend import SQLiteBackend
+from CEDEN_Shards import SHARD_KEY, histogram, split_histogram
+from CEDEN_Subsets import Subset
+from Synthetic_DataMart import SyntheticDataMart
+
+# the shards are only used with more than one table to extract
+TABLES = {'WQX_Stations': 'DM_WQX_Stations_MV', 'WaterChemistryData': 'WQDMart_MV', 'ToxicityData': 'ToxDmart_MV', }
+SHARDS = 3
+
+
+def check(name, condition):
+	print('%-60s %s' % (name, 'ok' if condition else 'FAILED'))
+	return condition
+
+
+def extract(database, folder, **options):
+	os.makedirs(folder, exist_ok=True)
+	subsets = [Subset('SafeToSwim.csv', 'WaterChemistryData', 'Analyte', ['E. coli', 'Enterococcus'], ',')]
+	return data_retrieval(TABLES, folder, ',', '.csv', False, subsets=subsets, backend=SQLiteBackend(database),
+	                      **options)
+
+
+def read(path):
+	with open(path, encoding='utf8', newline='') as fileIn:
+		return list(csv.reader(fileIn, delimiter=','))
+
+
+# first_sites returns the site of the first record of every station of a dataset, as it is written in the file
+def first_sites(path):
+	records = read(path)
+	positions = {name: i for i, name in enumerate(records[0])}
+	sites = {}
+	for record in records[1:]:
+		site = [record[positions[name]] for name in ('StationName', 'Latitude', 'Longitude', 'Datum')]
+		sites.setdefault(record[positions['StationCode']], site)
+	return sites
+
+
+if __name__ == "__main__":
+	folder = tempfile.mkdtemp()
+	passed = True
+	database = SyntheticDataMart({'WQDMart_MV': 6000, 'ToxDmart_MV': 500}, stations=300).to_sqlite(
+		os.path.join(folder, 'DataMart.sqlite'), list(TABLES.values()))
+	CEDEN_DataRefresh.printable = CEDEN_DataRefresh.printable_for('CEDEN')
+	whole = os.path.join(folder, 'Whole')
+	FILES, AllSites = extract(database, whole)
+	sharded = os.path.join(folder, 'Sharded')
+	shardedFILES, shardedSites = extract(database, sharded, workers=2, shards={'WaterChemistryData': SHARDS})
+
+	for name in ('WaterChemistryData', 'SafeToSwim.csv'):
+		records, shardedRecords = read(FILES[name]), read(shardedFILES[name])
+		passed &= check('%s has the same records' % name, records[0] == shardedRecords[0] and
+		                sorted(map(tuple, records[1:])) == sorted(map(tuple, shardedRecords[1:])))
+	# the shard of every record, from the same boundaries data_retrieval used
+	cnxn = SQLiteBackend(database).connect()
+	boundaries = split_histogram(histogram(cnxn.cursor(), 'WQDMart_MV', SHARD_KEY), SHARDS)
+	cnxn.close()
+	records = read(FILES['WaterChemistryData'])
+	positions = {name: i for i, name in enumerate(records[0])}
+	shardsOf = {}
+	for record in records[1:]:
+		year = record[positions['SampleDate']][:4]
+		shard = bisect.bisect_right(boundaries, int(year)) if year else 0
+		shardsOf.setdefault(record[positions['StationCode']], set()).add(shard)
+	shards = [bisect.bisect_right(boundaries, int(record[positions['SampleDate']][:4]))
+	          for record in read(shardedFILES['WaterChemistryData'])[1:]]
+	passed &= check('the sharded records are in the order of the shards', shards == sorted(shards))
+
+	passed &= check('the same stations', sorted(AllSites) == sorted(shardedSites))
+	# the water chemistry table comes first, the sites of its stations come from it
+	passed &= check('a station in one shard gets the same site',
+	                all(shardedSites[StationCode] == AllSites[StationCode] for StationCode in shardsOf
+	                    if len(shardsOf[StationCode]) == 1))
+	written = first_sites(shardedFILES['WaterChemistryData'])
+	passed &= check('a station gets the site of its first stitched record',
+	                all([str(value) for value in shardedSites[StationCode]] == written[StationCode]
+	                    for StationCode in shardsOf))
+	differ = [StationCode for StationCode in shardsOf if shardedSites[StationCode] != AllSites[StationCode]]
+	passed &= check('only stations in several shards get another site',
+	                all(len(shardsOf[StationCode]) > 1 for StationCode in differ))
+	print('%d of %d stations got the site of another record than in one go' % (len(differ), len(shardsOf)))
+	shutil.rmtree(folder)
+	print('\nall checks passed' if passed else '\nsome checks FAILED')
+	sys.exit(0 if passed else 1)
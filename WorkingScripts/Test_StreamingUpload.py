@@ -0,0 +1,165 @@
+'''
+This is a testing script for the StreamingClient (CEDEN_Upload.py). It writes a synthetic WaterChemistryData.csv of
+3 GB (or the size given, in GB), starts a local stand-in for the DKAN attach_file endpoint in another process and
+uploads the file to it. The stand-in reads the requests as they come and keeps only the name, size, first line and
+md5 of every file it gets. The script checks that the file was sent in parts no larger than the portal limit, that
+each part starts with the header line and ends with a whole line, that the parts put back together are the file,
+and that the peak memory (RSS) of the uploading process didn't grow by more than MAX_GROWTH while it was sent.
+
+	python WorkingScripts\\Test_StreamingUpload.py [size in GB] [folder for the synthetic file]
+'''
+
+import os, sys, re, json, time, uuid, hashlib, tempfile, multiprocessing
+from http.server import HTTPServer, BaseHTTPRequestHandler
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from CEDEN_Upload import StreamingClient, PORTAL_LIMIT, CHUNK_SIZE, part_ranges
+
+# the most the peak memory of the upload may grow, in bytes
+MAX_GROWTH = 64 * 1024 * 1024
+HEADER = b'Program,ParentProject,Project,StationName,StationCode,SampleDate,Analyte,Result,Unit\n'
+LINE = b'Surface Water Ambient Monitoring Program,SWAMP,SWAMP Monitoring,Alpine Creek,204ALP100,2015-06-%02d,' \
+       b'Oxygen Dissolved Total,%d.%d,mg/L\n'
+
+
+# peak_rss returns the peak memory of this process, in bytes
+def peak_rss():
+	try:
+		import resource
+		return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+	except ImportError:
+		import psutil
+		return psutil.Process().memory_info().peak_wset
+
+
+# write_file writes a csv of size bytes, a block of lines at a time
+def write_file(path, size):
+	block = b''.join(LINE % (day % 28 + 1, day, day % 7) for day in range(12000))
+	with open(path, 'wb') as fileOut:
+		fileOut.write(HEADER)
+		written = len(HEADER)
+		while written + len(block) <= size:
+			fileOut.write(block)
+			written += len(block)
+		fileOut.write(block[:block.rfind(b'\n', 0, size - written) + 1])
+
+
+class Handler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def log_message(self, *args):
+		pass
+
+	def _answer(self, body):
+		data = json.dumps(body).encode('utf8')
+		self.send_response(200)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	# do_POST reads the multipart body as it comes, CHUNK_SIZE bytes at a time
+	def do_POST(self):
+		length = int(self.headers['Content-Length'])
+		if not self.path.endswith('/attach_file'):
+			self.rfile.read(length)
+			return self._answer({'sessid': uuid.uuid4().hex, 'session_name': 'SESS', 'token': 'token'})
+		boundary = re.search('boundary=(\\S+)', self.headers['Content-Type']).group(1).encode()
+		tail = b'\r\n--%s--\r\n' % boundary
+		head = self.rfile.read(min(length, 64 * 1024))
+		name = re.search(b'name="files\\[[^]]*\\]"; filename="([^"]*)"', head)
+		start = head.index(b'\r\n\r\n', name.end()) + 4
+		content = length - start - len(tail)
+		md5 = hashlib.md5()
+		first = head[start:start + content].split(b'\n')[0] + b'\n'
+		block = head[start:]
+		left = length - len(head)
+		received = 0
+		last = b''
+		while True:
+			use = block[:content - received]
+			md5.update(use)
+			received += len(use)
+			if use:
+				last = use[-1:]
+			if not left:
+				break
+			block = self.rfile.read(min(CHUNK_SIZE, left))
+			left -= len(block)
+		self.server.parts.put({'name': name.group(1).decode(), 'size': received, 'first': first.decode(),
+		                       'last': last.decode(), 'md5': md5.hexdigest(), 'attach': re.search(
+		                       b'name="attach"\r\n\r\n(\\d)', head).group(1).decode()})
+		self._answer([{'fid': '1'}])
+
+
+def serve(port, parts):
+	server = HTTPServer(('127.0.0.1', port), Handler)
+	server.parts = parts
+	server.serve_forever()
+
+
+if __name__ == "__main__":
+	size = int(float(sys.argv[1]) * 1000 ** 3) if len(sys.argv) > 1 else 3 * 1000 ** 3
+	folder = sys.argv[2] if len(sys.argv) > 2 else tempfile.gettempdir()
+	path = os.path.join(folder, 'WaterChemistryData.csv')
+	print('writing a %.1f GB file' % (size / 1e9))
+	write_file(path, size)
+	size = os.path.getsize(path)
+	parts = multiprocessing.Queue()
+	port = 8000 + os.getpid() % 1000
+	server = multiprocessing.Process(target=serve, args=(port, parts), daemon=True)
+	server.start()
+	time.sleep(1)
+	try:
+		before = peak_rss()
+		start = time.perf_counter()
+		r = StreamingClient('http://127.0.0.1:%d/' % port, 'u', 'p').attach_file_to_node(path, 2386, 'field_upload')
+		elapsed = time.perf_counter() - start
+		after = peak_rss()
+		print('sent %.1f GB in %.1f sec (%.0f MB/s), peak RSS %.1f MB before, %.1f MB after' %
+		      (size / 1e9, elapsed, size / 1e6 / elapsed, before / 1e6, after / 1e6))
+		expected = len(part_ranges(path))
+		received = [parts.get(timeout=60) for i in range(expected)]
+		for part in received:
+			print('\t%s  %.1f MB  attach=%s' % (part['name'], part['size'] / 1e6, part['attach']))
+	finally:
+		server.terminate()
+	md5 = hashlib.md5()
+	with open(path, 'rb') as fileIn:
+		for block in iter(lambda: fileIn.read(CHUNK_SIZE), b''):
+			md5.update(block)
+	# the server only keeps the md5 of each part, so the parts are checked against the bytes of the file they should
+	# hold, and put back together (without the header of every part but the first)
+	joined = hashlib.md5()
+	with open(path, 'rb') as fileIn:
+		position = 0
+		for number, part in enumerate(received):
+			partHash = hashlib.md5(HEADER if number else b'')
+			left = part['size'] - (len(HEADER) if number else 0)
+			fileIn.seek(position)
+			while left:
+				block = fileIn.read(min(CHUNK_SIZE, left))
+				partHash.update(block)
+				joined.update(block)
+				left -= len(block)
+			position = fileIn.tell()
+			part['same'] = partHash.hexdigest() == part['md5']
+	os.remove(path)
+	passed = True
+	for check, condition in (
+			('the upload succeeded', r.ok),
+			('the file was sent in %d parts' % len(received), len(received) > 1 and
+			 [part['name'] for part in received] == ['WaterChemistryData_part%d.csv' % (number + 1)
+			                                         for number in range(len(received))]),
+			('no part is larger than the portal limit', all(part['size'] <= PORTAL_LIMIT for part in received)),
+			('every part starts with the header', all(part['first'] == HEADER.decode() for part in received)),
+			('every part ends with a whole line', all(part['last'] == '\n' for part in received)),
+			('the first part replaces, the others are attached', [part['attach'] for part in received] ==
+			 ['0'] + ['1'] * (len(received) - 1)),
+			('the parts are the file', all(part['same'] for part in received) and
+			 joined.hexdigest() == md5.hexdigest()),
+			('the peak memory grew by %.1f MB, at most %.0f MB' % ((after - before) / 1e6, MAX_GROWTH / 1e6),
+			 after - before <= MAX_GROWTH)):
+		print('%-60s %s' % (check, 'ok' if condition else 'FAILED'))
+		passed &= bool(condition)
+	print('\nall checks passed' if passed else '\nsome checks FAILED')
+	sys.exit(0 if passed else 1)
@@ -0,0 +1,139 @@
+'''
+This is a testing script for the upload scheduler (CEDEN_Upload.py). It starts a local stand-in for the DKAN
+attach_file endpoint of data.ca.gov (login, then POST api/dataset/node/<node>/attach_file with a multipart body) that
+can be told to answer some nodes with errors, then sends a handful of files through the scheduler and checks that
+every file arrived once, transient errors were tried again, permanent ones were not, no more than the allowed number
+of uploads ran at once and every thread kept its connection open. The files are sent twice more with a manifest
+(CEDEN_Manifest.py), unchanged files must be skipped the second time.
+	The uploads go through the StreamingClient, the client the upload section of CEDEN_DataRefresh.py uses.
+
+	python WorkingScripts\\Test_Uploads.py
+'''
+
+import os, sys, re, json, time, uuid, shutil, tempfile, threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from CEDEN_Upload import UploadScheduler, StreamingClient
+from CEDEN_Manifest import Manifest
+
+ATTACH = re.compile(r'/node/(\d+)/attach_file')
+
+
+# FakeDKAN is the state of the stand-in server. failures is a dictionary of node: list of response codes to answer
+# before accepting the file, latency the time an upload takes.
+class FakeDKAN:
+	def __init__(self, failures=None, latency=0.2):
+		self.failures = {node: list(codes) for node, codes in (failures or {}).items()}
+		self.latency = latency
+		self.lock = threading.Lock()
+		self.active = 0
+		self.maxActive = 0
+		self.received = {}
+		self.logins = 0
+		self.connections = set()
+
+
+class Handler(BaseHTTPRequestHandler):
+	protocol_version = 'HTTP/1.1'
+
+	def log_message(self, *args):
+		pass
+
+	def _answer(self, code, body):
+		data = body.encode('utf8')
+		self.send_response(code)
+		self.send_header('Content-Type', 'application/json')
+		self.send_header('Content-Length', str(len(data)))
+		self.end_headers()
+		self.wfile.write(data)
+
+	def do_GET(self):
+		self._answer(200, '{}')
+
+	def do_POST(self):
+		dkan = self.server.dkan
+		body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+		with dkan.lock:
+			dkan.connections.add(self.client_address)
+		if self.path.endswith('/user/login'):
+			with dkan.lock:
+				dkan.logins += 1
+			return self._answer(200, json.dumps({'sessid': uuid.uuid4().hex, 'session_name': 'SESS',
+			                                     'token': 'token', 'user': {'uid': '1'}}))
+		if self.path.endswith('/session/token'):
+			return self._answer(200, 'token')
+		match = ATTACH.search(self.path)
+		if not match:
+			return self._answer(404, '{"error": "unknown endpoint"}')
+		node = int(match.group(1))
+		with dkan.lock:
+			dkan.active += 1
+			dkan.maxActive = max(dkan.maxActive, dkan.active)
+			code = dkan.failures[node].pop(0) if dkan.failures.get(node) else 200
+		try:
+			time.sleep(dkan.latency)
+			if code != 200:
+				return self._answer(code, '{"error": "stand-in error"}')
+			with dkan.lock:
+				dkan.received[node] = dkan.received.get(node, []) + [len(body)]
+			self._answer(200, json.dumps([{'fid': str(node)}]))
+		finally:
+			with dkan.lock:
+				dkan.active -= 1
+
+
+def check(name, condition):
+	print('%-60s %s' % (name, 'ok' if condition else 'FAILED'))
+	return condition
+
+
+if __name__ == "__main__":
+	# nodes 2 and 3 fail twice with errors that go away, node 4 with one that doesn't
+	dkan = FakeDKAN(failures={2: [503, 502], 3: [429, 500], 4: [404]}, latency=0.2)
+	server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+	server.dkan = dkan
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	URI = 'http://127.0.0.1:%d/' % server.server_address[1]
+	client_factory = lambda: StreamingClient(URI, 'u', 'p')
+	folder = tempfile.mkdtemp()
+	uploads = {}
+	for node in range(1, 9):
+		file = os.path.join(folder, 'Dataset_%d.csv' % node)
+		with open(file, 'wb') as fileOut:
+			fileOut.write(os.urandom(node * 100000))
+		uploads[file] = node
+	workers = 3
+	start = time.perf_counter()
+	reports = UploadScheduler(client_factory, workers=workers, retries=3, backoff=0.05).run(uploads)
+	elapsed = time.perf_counter() - start
+	received, logins, connections = dict(dkan.received), dkan.logins, len(dkan.connections)
+	# with a manifest: the first run publishes everything, the second only what changed and what failed
+	manifest = Manifest(os.path.join(folder, 'Manifest.json'))
+	manifest.update(uploads)
+	dkan.failures = {4: [404, 404]}
+	UploadScheduler(client_factory, workers=workers, retries=3, backoff=0.05, manifest=manifest).run(uploads)
+	with open(os.path.join(folder, 'Dataset_5.csv'), 'ab') as fileOut:
+		fileOut.write(b'one more record\n')
+	dkan.received = {}
+	manifest = Manifest(os.path.join(folder, 'Manifest.json'))
+	manifest.update(uploads)
+	again = UploadScheduler(client_factory, workers=workers, retries=3, backoff=0.05, manifest=manifest).run(uploads)
+	server.shutdown()
+	shutil.rmtree(folder)
+	byNode = {report['node']: report for report in reports}
+	passed = True
+	passed &= check('every file but the 404 one was uploaded', [node for node in byNode if not byNode[node]['ok']] == [4])
+	passed &= check('each accepted file arrived exactly once', all(len(received.get(node, [])) == 1
+	                                                                for node in byNode if node != 4))
+	passed &= check('the whole file was sent', all(received[node][0] > node * 100000 for node in received))
+	passed &= check('transient errors were tried again', byNode[2]['tries'] == 3 and byNode[3]['tries'] == 3)
+	passed &= check('a 404 was not tried again', byNode[4]['tries'] == 1)
+	passed &= check('uploads ran at the same time, up to %d' % workers, 1 < dkan.maxActive <= workers)
+	passed &= check('faster than one after another', elapsed < 12 * dkan.latency)
+	passed &= check('one login and one connection per thread', logins <= workers and connections <= workers)
+	passed &= check('unchanged files were skipped the second time', sorted(dkan.received) == [5] and
+	                [report['node'] for report in again if report['skipped']] == [1, 2, 3, 6, 7, 8])
+	passed &= check('a file that failed is tried again', [report['node'] for report in again
+	                                                      if not report['ok']] == [4])
+	print('\nall checks passed' if passed else '\nsome checks FAILED')
+	sys.exit(0 if passed else 1)
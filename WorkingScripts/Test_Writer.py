@@ -0,0 +1,69 @@
+'''
+This is a testing script for the write behind stage (CEDEN_Writer.py). It checks that
+	- the batches are written in the order they are put, with and without the writer thread,
+	- put waits once depth batches are waiting, so no more than depth batches are ever held,
+	- an error of the writer thread is raised on the main thread, and the main thread's own error wins.
+
+	python WorkingScripts\\Test_Writer.py
+'''
+
+import os, sys, time, threading
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from CEDEN_Writer import WriteBehind
+
+
+def check(name, condition):
+	print('%-60s %s' % (name, 'ok' if condition else 'FAILED'))
+	return condition
+
+
+if __name__ == "__main__":
+	passed = True
+	batches = [[[str(batch), str(row)] for row in range(100)] for batch in range(50)]
+	for depth in (0, 1, 4):
+		written = []
+		with WriteBehind(written.extend, depth=depth) as behind:
+			for batch in batches:
+				behind.put(batch)
+		passed &= check('depth %d: every record written in order' % depth,
+		                written == [record for batch in batches for record in batch])
+	# a slow writer, the main thread is held back instead of piling batches up
+	gate = threading.Event()
+	held = []
+
+	def slow(batch):
+		gate.wait()
+		held.append(batch)
+	behind = WriteBehind(slow, depth=2)
+	putter = threading.Thread(target=lambda: [behind.put(batch) for batch in batches[:10]])
+	putter.start()
+	time.sleep(0.3)
+	passed &= check('put waits when depth batches are waiting', putter.is_alive() and behind._batches.qsize() == 2)
+	gate.set()
+	putter.join()
+	behind.close()
+	passed &= check('the waiting batches are all written', held == batches[:10] and behind.waitSeconds > 0.2)
+
+	# the writer fails on the third batch
+	def failing(batch):
+		if batch is batches[2]:
+			raise IOError('disk full')
+	raised = None
+	try:
+		with WriteBehind(failing, depth=2) as behind:
+			for batch in batches:
+				behind.put(batch)
+	except IOError as error:
+		raised = error
+	passed &= check('the error of the writer is raised on the main thread', str(raised) == 'disk full')
+	raised = None
+	try:
+		with WriteBehind(failing, depth=2) as behind:
+			for batch in batches[:5]:
+				behind.put(batch)
+			raise KeyError('main')
+	except Exception as error:
+		raised = error
+	passed &= check('the error of the main thread is kept', isinstance(raised, KeyError))
+	print('\nall checks passed' if passed else '\nsome checks FAILED')
+	sys.exit(0 if passed else 1)